@@ -1,6 +1,9 @@
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import os
 from Constants import Constants
+from LazyModule import LazyModule
+
+aead = LazyModule("cryptography.hazmat.primitives.ciphers.aead")
+
 
 class AesGcm256:
 
@@ -15,20 +18,29 @@ class AesGcm256:
 
     @staticmethod
     def encrypt(messageBytes, key):
-        aesgcm = AESGCM(key)
+        aesgcm = aead.AESGCM(key)
         nonce = os.urandom(16)
         encryptedBytes = aesgcm.encrypt(nonce=nonce, data=messageBytes, associated_data=None)
         encryptedBytes += nonce
 
         return encryptedBytes
 
+    @staticmethod
+    def encryptInto(messageBytes, key, buffer, offset):
+        '''
+            encrypts into buffer[offset:] (e.g. a buffer of the BufferPool), returns the amount of written bytes
+        '''
+        encryptedBytes = AesGcm256.encrypt(messageBytes, key)
+        buffer[offset:offset + len(encryptedBytes)] = encryptedBytes
+        return len(encryptedBytes)
+
     @staticmethod
     def decrypt(messageBytes, key):
-        overhead = Constants.BLOCK_OVERHEAD
-        raw = messageBytes[0:len(messageBytes)-overhead]
-        tag = messageBytes[len(raw):len(raw)+Constants.TAG_BYTE_LENGTH]
-        iv = messageBytes[len(raw)+len(tag):len(messageBytes)]
+        # layout: raw | tag | iv, raw and tag are passed on without joining them
+        ivStart = len(messageBytes) - Constants.IV_BYTE_LENGTH
+        rawAndTag = messageBytes[0:ivStart]
+        iv = messageBytes[ivStart:len(messageBytes)]
 
-        aesgcm = AESGCM(key)
-        decryptedBytes = aesgcm.decrypt(nonce=iv, data=raw+tag, associated_data=None)
+        aesgcm = aead.AESGCM(key)
+        decryptedBytes = aesgcm.decrypt(nonce=bytes(iv), data=rawAndTag, associated_data=None)
         return decryptedBytes
\ No newline at end of file
@@ -0,0 +1,187 @@
+import json
+import os
+import posixpath
+import shlex
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class BatchCommand:
+
+    def __init__(self, index, name, args):
+        self.index = index
+        self.name = name
+        self.args = args
+
+    def keys(self):
+        '''
+            (folder, subtree) of every opacity folder the command reads or changes, subtree if the folders below
+            it may change as well. A folder deleted or moved by its handle is only looked up when the command runs,
+            so everything below its parent counts as changed
+        '''
+        args = self.args
+        folderHandle = self.name in ("delete", "move") and len(args[1]) == 64
+        if self.name == "upload":
+            keys = {(BatchCommand.normalize(args[1]), False)}
+            if os.path.isdir(args[0]):
+                created = posixpath.join(args[1], os.path.basename(os.path.normpath(args[0])))
+                keys.add((BatchCommand.normalize(created), True))
+            return keys
+        if self.name in ("dir", "list"):
+            return {(BatchCommand.normalize(args[0]), False)}
+        if self.name == "delete":
+            return {(BatchCommand.normalize(args[0]), folderHandle)}
+        if self.name == "move":
+            return {(BatchCommand.normalize(args[0]), folderHandle), (BatchCommand.normalize(args[2]), folderHandle)}
+        if self.name == "createFolder":
+            folder = BatchCommand.normalize(args[0])
+            return {(posixpath.dirname(folder), False), (folder, False)}
+        return set()
+
+    def dependencies(self, lastByKey):
+        '''
+            the futures of lastByKey ((folder, subtree) -> future of the last command with it)
+            whose keys conflict with the ones of the command
+        '''
+        keys = self.keys()
+        return {future for key, future in lastByKey.items()
+                if any(BatchCommand.conflicting(key, own) for own in keys)}
+
+    @staticmethod
+    def conflicting(key, other):
+        (folder, subtree), (otherFolder, otherSubtree) = key, other
+        return (folder == otherFolder or (subtree and BatchCommand.below(otherFolder, folder))
+                or (otherSubtree and BatchCommand.below(folder, otherFolder)))
+
+    @staticmethod
+    def below(folder, parent):
+        return parent == "/" or folder.startswith(parent + "/")
+
+    @staticmethod
+    def normalize(folder):
+        '''
+            "/x/", "x" and "/x" are the same folder
+        '''
+        return posixpath.normpath("/" + folder.lstrip("/"))
+
+
+class BatchRunner:
+    '''
+        Runs a list of cli commands (upload, download, delete, move, createFolder, dir or list) against one account.
+        Commands run concurrently with up to workers at once, but a command waits for all earlier commands
+        which touch one of its folders (or a folder above it which they delete or move, see BatchCommand.keys),
+        so changes to one folder keep the order of the script.
+        Every command produces a result {"index", "command", "args", "ok", "result", "error", "started", "seconds"}
+    '''
+    COMMANDS = {"upload": 2, "download": 2, "delete": 2, "move": 3, "createFolder": 1, "dir": 1, "list": 1}
+
+    def __init__(self, account, workers=8):
+        self.account = account
+        self.workers = workers
+
+    @staticmethod
+    def parse(lines):
+        '''
+            one command per line, either as in the interactive cli (upload "C:\\file" /folder)
+            or as json ({"command": "upload", "args": ["C:\\file", "/folder"]}). Empty lines and # comments are skipped
+        '''
+        commands = []
+        for number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+                name, args = entry["command"], [str(arg) for arg in entry.get("args", [])]
+            else:
+                parts = shlex.split(line)
+                name, args = parts[0], parts[1:]
+            if name not in BatchRunner.COMMANDS:
+                raise ValueError("line {}: unknown command {}".format(number, name))
+            if len(args) < BatchRunner.COMMANDS[name]:
+                raise ValueError("line {}: {} needs {} arguments".format(number, name, BatchRunner.COMMANDS[name]))
+            commands.append(BatchCommand(len(commands), name, args))
+        return commands
+
+    def run(self, commands, onResult=None):
+        '''
+            runs the commands and returns their results in the order of the commands,
+            onResult(result) is called as soon as a command is finished
+        '''
+        results = [None] * len(commands)
+        lastByKey = dict()  # (folder, subtree) -> future of the last command touching it
+        lock = threading.Lock()
+
+        def execute(command, dependencies):
+            wait(dependencies)
+            result = self.execute(command)
+            results[command.index] = result
+            if onResult is not None:
+                with lock:
+                    onResult(result)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for command in commands:
+                future = pool.submit(execute, command, command.dependencies(lastByKey))
+                for key in command.keys():
+                    lastByKey[key] = future
+        return results
+
+    def execute(self, command, plan=None):
+        '''
+            plan is the UploadPlan of an upload command when its folder was scanned already
+        '''
+        result = {"index": command.index, "command": command.name, "args": command.args,
+                  "ok": True, "result": None, "error": None, "started": time.time()}
+        start = time.perf_counter()
+        try:
+            if plan is not None:
+                result["result"] = self._upload(*command.args, plan=plan)
+            else:
+                result["result"] = getattr(self, "_" + command.name)(*command.args)
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = "{}: {}".format(type(e).__name__, e)
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        return result
+
+    def _upload(self, path, folder, plan=None):
+        if self.account.upload(path, folder, plan) is False:
+            raise IOError("Failed to upload {}, see the log for the reason".format(path))
+
+    def _download(self, handle, path):
+        if len(handle) != 128:
+            raise ValueError("Please provide a file handle with the length of 128")
+        self.account.downloadFile(path, handle)
+        return path
+
+    def _delete(self, folder, handle):
+        self.account.delete(folder, handle)
+
+    def _move(self, fromFolder, handle, toFolder, name=None):
+        if name is None:
+            metadata = self.account.getFolderData(fromFolder)["metadata"]
+            names = [entry.name for entry in metadata.folders if entry.handle == handle]
+            names += [summary[0] for summary in metadata.fileSummaries() if summary[3] == handle]
+            if len(names) == 0:
+                raise FileNotFoundError("{} isn't in {}".format(handle, fromFolder))
+            name = names[0]
+        self.account.move(fromFolder, {"handle": handle, "name": name}, toFolder)
+
+    def _createFolder(self, folder):
+        return self.account.createFolder(folder).handle
+
+    def _dir(self, folder):
+        metadata = self.account.getFolderData(folder)["metadata"]
+        return {"folders": [{"name": entry.name, "handle": entry.handle} for entry in metadata.folders],
+                "files": [{"name": name, "created": created, "size": size, "handle": handle}
+                          for name, created, size, handle in metadata.fileSummaries()]}
+
+    def _list(self, folder):
+        return self._dir(folder)
+
+    @staticmethod
+    def summary(results, seconds):
+        return {"summary": {"commands": len(results), "ok": sum(1 for result in results if result["ok"]),
+                            "failed": sum(1 for result in results if not result["ok"]), "seconds": round(seconds, 3)}}
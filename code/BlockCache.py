@@ -0,0 +1,133 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+class BlockCache:
+    '''
+        On-disk cache of encrypted file blocks, keyed by file id and block index
+        (directory/<first 2 characters of the file id>/<file id>/<block index>).
+        Only the encrypted blocks are stored, so the cache doesn't expose file contents.
+        Every entry starts with a blake2b digest of the block which is checked on read, broken entries
+        are removed and count as a miss. The entries are evicted in least recently used order once the
+        cache grows above maxBytes, the order survives restarts through the modification times.
+    '''
+
+    DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".opacity", "blocks")
+    DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+    DIGEST_SIZE = 16
+
+    def __init__(self, directory=None, maxBytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or BlockCache.DEFAULT_DIRECTORY
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.corrupt = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # (fileId, index) -> size on disk
+        self._size = 0
+        self._lock = threading.Lock()
+        self._scan()
+
+    def _path(self, fileId, index):
+        return os.path.join(self.directory, fileId[:2], fileId, str(index))
+
+    def _scan(self):
+        found = []
+        if os.path.isdir(self.directory):
+            for prefix in os.scandir(self.directory):
+                if not prefix.is_dir():
+                    continue
+                for fileFolder in os.scandir(prefix.path):
+                    if not fileFolder.is_dir():
+                        continue
+                    for entry in os.scandir(fileFolder.path):
+                        if entry.name.isdigit():
+                            stat = entry.stat()
+                            found.append((stat.st_mtime, fileFolder.name, int(entry.name), stat.st_size))
+        for _, fileId, index, size in sorted(found):
+            self._entries[(fileId, index)] = size
+            self._size += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def _digest(data):
+        return hashlib.blake2b(data, digest_size=BlockCache.DIGEST_SIZE).digest()
+
+    def get(self, fileId, index):
+        '''
+            the encrypted block or None
+        '''
+        key = (fileId, index)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+
+        path = self._path(fileId, index)
+        try:
+            with open(path, "rb") as file:
+                content = file.read()
+            os.utime(path)
+        except OSError:
+            content = b""
+
+        data = content[BlockCache.DIGEST_SIZE:]
+        if len(content) <= BlockCache.DIGEST_SIZE or BlockCache._digest(data) != content[:BlockCache.DIGEST_SIZE]:
+            with self._lock:
+                self.corrupt += 1
+                self.misses += 1
+                self._remove(key)
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, fileId, index, data):
+        key = (fileId, index)
+        path = self._path(fileId, index)
+        content = BlockCache._digest(data) + bytes(data)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporaryPath = "{}.{}.tmp".format(path, threading.get_ident())
+            with open(temporaryPath, "wb") as file:
+                file.write(content)
+            os.replace(temporaryPath, path)
+        except OSError as e:
+            print("Failed to cache block {} of {}\nReason: {}".format(index, fileId, e))
+            return
+
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+            self._entries[key] = len(content)
+            self._size += len(content)
+            self._evict()
+
+    def _remove(self, key):
+        self._size -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(*key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._size > self.maxBytes and len(self._entries) > 0:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "corrupt": self.corrupt, "evictions": self.evictions,
+                    "hitRate": self.hits / lookups if lookups > 0 else 0.0, "blocks": len(self._entries),
+                    "bytes": self._size, "maxBytes": self.maxBytes}
+
+    @staticmethod
+    def formatStats(stats):
+        return "{} hits, {} misses ({:.0%} hit rate), {} corrupt, {} evicted, {} blocks, {:.1f} of {:.1f} MB".format(
+            stats["hits"], stats["misses"], stats["hitRate"], stats["corrupt"], stats["evictions"],
+            stats["blocks"], stats["bytes"] / 1e6, stats["maxBytes"] / 1e6)
@@ -0,0 +1,146 @@
+import random
+import threading
+import time
+from LazyModule import LazyModule
+
+requests = LazyModule("requests")
+
+
+class BrokerEndpoint:
+
+    def __init__(self, url):
+        self.url = url
+        self.latency = None  # moving average of the probe and small request times in seconds
+        self.failures = 0  # failures in a row
+        self.unhealthySince = None
+        self.requests = 0
+
+    @property
+    def healthy(self):
+        return self.unhealthySince is None
+
+    def toDict(self):
+        return {"url": self.url, "latency": self.latency, "healthy": self.healthy,
+                "failures": self.failures, "requests": self.requests}
+
+
+class BrokerPool:
+    '''
+        The broker endpoints of an account. Requests are routed to a random healthy endpoint weighted by
+        1 / latency², so the fastest endpoint gets most requests while the others keep being measured.
+        An endpoint becomes unhealthy after failureThreshold connection errors or 5xx answers in a row and
+        gets another chance after cooldown seconds or as soon as a probe reaches it.
+        Idempotent requests fail over to the next endpoint, the others (init-upload, metadata/create)
+        only go to one endpoint since they might have been executed already.
+        probe() measures the latency of every endpoint, startProbing() repeats it every probeInterval seconds.
+        Requests with a large payload (the upload parts) are posted with measure=False, their duration
+        depends on the payload size and would make the endpoint they went to look slow.
+    '''
+    SMOOTHING = 0.3
+
+    def __init__(self, urls, failureThreshold=3, cooldown=30.0, probeInterval=60.0, probeTimeout=5.0):
+        if len(urls) == 0:
+            raise AttributeError("At least one broker endpoint is needed")
+        self.endpoints = [BrokerEndpoint(url) for url in urls]
+        self.failureThreshold = failureThreshold
+        self.cooldown = cooldown
+        self.probeInterval = probeInterval
+        self.probeTimeout = probeTimeout
+        self._lock = threading.Lock()
+        self._probeThread = None
+        self._stopProbing = threading.Event()
+
+    def choose(self, exclude=()):
+        with self._lock:
+            now = time.time()
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude and
+                          (endpoint.healthy or now - endpoint.unhealthySince > self.cooldown)]
+            if len(candidates) == 0:
+                candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+            if len(candidates) == 0:
+                return None
+            known = [endpoint.latency for endpoint in candidates if endpoint.latency is not None]
+            # endpoints without a measurement yet are treated like the best one, so they get measured
+            default = min(known) if len(known) > 0 else 1.0
+            weights = [1 / max(endpoint.latency if endpoint.latency is not None else default, 0.001) ** 2
+                       for endpoint in candidates]
+            return random.choices(candidates, weights=weights)[0]
+
+    def best(self):
+        with self._lock:
+            healthy = [endpoint for endpoint in self.endpoints if endpoint.healthy] or self.endpoints
+            return min(healthy, key=lambda endpoint: endpoint.latency if endpoint.latency is not None else float("inf"))
+
+    def report(self, endpoint, seconds, ok, measure=True):
+        '''
+            measure=False only updates the health of the endpoint, not its latency
+        '''
+        with self._lock:
+            endpoint.requests += 1
+            if ok:
+                endpoint.failures = 0
+                endpoint.unhealthySince = None
+                if measure and endpoint.latency is None:
+                    endpoint.latency = seconds
+                elif measure:
+                    endpoint.latency += BrokerPool.SMOOTHING * (seconds - endpoint.latency)
+            else:
+                endpoint.failures += 1
+                if endpoint.failures >= self.failureThreshold:
+                    endpoint.unhealthySince = time.time()
+
+    def post(self, session, path, idempotent=True, measure=True, **kwargs):
+        '''
+            session.post to path of the chosen endpoint, see the class description for the failover
+        '''
+        tried = []
+        while True:
+            endpoint = self.choose(exclude=tried)
+            tried.append(endpoint)
+            canRetry = idempotent and len(tried) < len(self.endpoints)
+            start = time.time()
+            try:
+                response = session.post(endpoint.url + path, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.report(endpoint, time.time() - start, ok=False, measure=measure)
+                if canRetry:
+                    continue
+                raise
+            ok = response.status_code < 500
+            self.report(endpoint, time.time() - start, ok, measure)
+            if not ok and canRetry:
+                continue
+            return response
+
+    def probe(self):
+        '''
+            measures the time until every endpoint answers, any answer except a 5xx counts as healthy
+        '''
+        for endpoint in self.endpoints:
+            start = time.time()
+            try:
+                ok = requests.get(endpoint.url, timeout=self.probeTimeout).status_code < 500
+            except Exception:
+                ok = False
+            self.report(endpoint, time.time() - start, ok)
+        return self.stats()
+
+    def startProbing(self):
+        if self._probeThread is not None or len(self.endpoints) < 2:
+            return
+
+        def run():
+            while not self._stopProbing.is_set():
+                self.probe()
+                self._stopProbing.wait(self.probeInterval)
+
+        self._probeThread = threading.Thread(target=run)
+        self._probeThread.daemon = True
+        self._probeThread.start()
+
+    def stopProbing(self):
+        self._stopProbing.set()
+
+    def stats(self):
+        with self._lock:
+            return [endpoint.toDict() for endpoint in self.endpoints]
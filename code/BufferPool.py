@@ -0,0 +1,88 @@
+import threading
+from contextlib import contextmanager
+
+
+class BufferPool:
+    '''
+        Shared memory budget of the upload, download and crypto stages.
+        borrow(size) hands out a bytearray of exactly that size and blocks while the budget is used up,
+        reserve(size) only books memory which a library allocates itself (e.g. a response body).
+        A request bigger than the whole budget is let through when nothing else is borrowed, so it can't block forever.
+        Returned buffers are kept for reuse as long as they fit into the budget.
+        Every stage should borrow everything it needs at once, waiting with a buffer in hand can deadlock.
+    '''
+
+    def __init__(self, budget):
+        self.budget = budget
+        self._used = 0
+        self._cached = 0
+        self._peak = 0
+        self._waits = 0
+        self._free = dict()  # size -> List[bytearray]
+        self._condition = threading.Condition()
+
+    def _book(self, size):
+        while self._used > 0 and self._used + size > self.budget:
+            self._waits += 1
+            self._condition.wait()
+        self._used += size
+        self._peak = max(self._peak, self._used)
+        # drop cached buffers which don't fit anymore
+        while self._cached > 0 and self._used + self._cached > self.budget:
+            freeSize = next(iter(self._free))
+            self._free[freeSize].pop()
+            if len(self._free[freeSize]) == 0:
+                del self._free[freeSize]
+            self._cached -= freeSize
+
+    def _unbook(self, size):
+        self._used -= size
+        self._condition.notify_all()
+
+    def acquire(self, size):
+        with self._condition:
+            self._book(size)
+            free = self._free.get(size)
+            if free:
+                self._cached -= size
+                buffer = free.pop()
+                if len(free) == 0:
+                    del self._free[size]
+                return buffer
+        return bytearray(size)
+
+    def release(self, buffer):
+        size = len(buffer)
+        with self._condition:
+            self._unbook(size)
+            if self._used + self._cached + size <= self.budget:
+                self._free.setdefault(size, []).append(buffer)
+                self._cached += size
+
+    @contextmanager
+    def borrow(self, size):
+        buffer = self.acquire(size)
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+    @contextmanager
+    def reserve(self, size):
+        with self._condition:
+            self._book(size)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._unbook(size)
+
+    def stats(self):
+        with self._condition:
+            return {"budget": self.budget, "used": self._used, "peak": self._peak,
+                    "cached": self._cached, "waits": self._waits}
+
+    @staticmethod
+    def formatStats(stats):
+        return "{:.1f} MB used, {:.1f} MB peak of {:.1f} MB, {:.1f} MB cached, waited {} times".format(
+            stats["used"] / 1e6, stats["peak"] / 1e6, stats["budget"] / 1e6, stats["cached"] / 1e6, stats["waits"])
@@ -6,4 +6,11 @@ class Constants:
     TAG_BIT_LENGTH = TAG_BYTE_LENGTH * 8
     DEFAULT_BLOCK_SIZE = 64 * 1024
     BLOCK_OVERHEAD = TAG_BYTE_LENGTH + IV_BYTE_LENGTH
-    DEFAULT_PART_SIZE = 128 * (DEFAULT_BLOCK_SIZE + BLOCK_OVERHEAD)
\ No newline at end of file
+    DEFAULT_PART_SIZE = 128 * (DEFAULT_BLOCK_SIZE + BLOCK_OVERHEAD)
+    # part sizes the uploader chooses from (plaintext bytes, multiples of DEFAULT_BLOCK_SIZE);
+    # 10485760 is the part size this client always used and the broker accepts
+    MIN_PART_SIZE = 16 * DEFAULT_BLOCK_SIZE
+    MAX_PART_SIZE = 160 * DEFAULT_BLOCK_SIZE
+    UPLOAD_PART_SIZE = 160 * DEFAULT_BLOCK_SIZE
+    # memory all transfers of an account may hold at once, see BufferPool
+    BUFFER_POOL_BUDGET = 256 * 1024 * 1024
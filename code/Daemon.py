@@ -0,0 +1,292 @@
+import hmac
+import json
+import os
+import re
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import Opactiy
+from BatchRunner import BatchRunner
+from BufferPool import BufferPool
+from SharedResources import SharedResources
+from TransferTuning import TransferProgress
+
+
+class DaemonJob:
+
+    def __init__(self, id, handle, command):
+        self.id = id
+        self.handle = handle
+        self.command = command
+        self.status = "queued"
+        self.result = None
+        self.progress = TransferProgress()
+        self.submitted = time.time()
+        self.future = None
+
+    def toDict(self):
+        return {"id": self.id, "command": self.command.name, "args": self.command.args, "status": self.status,
+                "submitted": self.submitted, "progress": self.progress.toDict(), "result": self.result}
+
+
+class Daemon:
+    '''
+        Keeps Opacity accounts alive between jobs, with their derived keys, caches, sessions and workers,
+        and runs the jobs (the commands of BatchRunner) submitted through a http api on localhost:
+            POST /jobs {"command": "upload", "args": ["C:\\file", "/folder"], "account": handle, "wait": false}
+            GET /jobs, GET /jobs/<id> (status, progress in bytes, result), GET /status
+        account is optional, the daemon's own account is used without it. Jobs touching the same folder of an
+        account run in the order they were submitted. Every request needs the header
+        "Authorization: Bearer <token>"; port and token are written to STATE_FILE, which only the user can read.
+    '''
+    STATE_FILE = os.path.join(os.path.expanduser("~"), ".opacity", "daemon.json")
+    KEEP_JOBS = 1000  # finished jobs kept for status queries
+
+    def __init__(self, handle=None, host="127.0.0.1", port=0, workers=8):
+        self.handle = handle
+        self.token = secrets.token_hex(16)
+        self.accounts = dict()  # account handle -> Opacity
+        self.jobs = OrderedDict()  # id -> DaemonJob
+        self.started = time.time()
+        self._lastByKey = dict()  # account handle -> {(folder, subtree) -> future of the last job touching it}
+        self._nextId = 1
+        self._lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+        self.server.daemon_threads = True
+        self.server.daemon = self
+
+    @property
+    def url(self):
+        return "http://{}:{}/".format(*self.server.server_address[:2])
+
+    def account(self, handle):
+        with self._lock:
+            account = self.accounts.get(handle)
+            if account is None:
+                account = Opactiy.Opacity(handle)
+                self.accounts[handle] = account
+                # derive the master key now instead of during the first job
+                warmUp = threading.Thread(target=Daemon._warmUp, args=(account,))
+                warmUp.daemon = True
+                warmUp.start()
+            return account
+
+    @staticmethod
+    def _warmUp(account):
+        try:
+            account._masterKey
+        except Exception as e:
+            print("Failed to derive the master key\nReason: {}".format(e))
+
+    def submit(self, request):
+        '''
+            queues the job of the request, raises a ValueError for invalid requests
+        '''
+        handle = request.get("account") or self.handle
+        if handle is None or len(handle) != 128:
+            raise ValueError("Please provide the 128 character account handle")
+        command = BatchRunner.parse([json.dumps({"command": request.get("command"),
+                                                 "args": request.get("args", [])})])[0]
+        account = self.account(handle)
+
+        keys = command.keys()
+        with self._lock:
+            job = DaemonJob(str(self._nextId), handle, command)
+            self._nextId += 1
+            lastByKey = self._lastByKey.setdefault(handle, dict())
+            job.future = self.pool.submit(self._run, job, account, command.dependencies(lastByKey))
+            for key in keys:
+                lastByKey[key] = job.future
+            self.jobs[job.id] = job
+            self._forget()
+        # outside of the lock, the callback runs right away if the job is done already
+        job.future.add_done_callback(lambda future: self._release(handle, keys, future))
+        return job
+
+    def _release(self, handle, keys, future):
+        '''
+            forgets the keys of a finished job, unless a later job touching them replaced it
+        '''
+        with self._lock:
+            lastByKey = self._lastByKey.get(handle, dict())
+            for key in keys:
+                if lastByKey.get(key) is future:
+                    del lastByKey[key]
+            if len(lastByKey) == 0:
+                self._lastByKey.pop(handle, None)
+
+    def _run(self, job, account, dependencies):
+        try:
+            wait(dependencies)
+            job.status = "running"
+            plan = None
+            if job.command.name == "upload":
+                try:
+                    # the upload reuses the plan, the folder only gets scanned once
+                    plan = account.planUpload(*job.command.args[:2])
+                    job.progress.total = plan.uploadBytes
+                except OSError:
+                    pass  # the upload reports the missing path
+            with job.progress.activate():
+                job.result = BatchRunner(account).execute(job.command, plan)
+        except Exception as e:
+            job.result = {"index": job.command.index, "command": job.command.name, "args": job.command.args,
+                          "ok": False, "result": None, "error": "{}: {}".format(type(e).__name__, e)}
+        finally:
+            job.status = "done" if job.result is not None and job.result["ok"] else "failed"
+
+    def _forget(self):
+        finished = [id for id, job in self.jobs.items() if job.future.done()]
+        for id in finished[:max(len(finished) - Daemon.KEEP_JOBS, 0)]:
+            del self.jobs[id]
+
+    def job(self, id):
+        with self._lock:
+            return self.jobs.get(id)
+
+    def listJobs(self):
+        with self._lock:
+            return [job.toDict() for job in self.jobs.values()]
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self.jobs.values())
+            accounts = len(self.accounts)
+        states = dict()
+        for job in jobs:
+            states[job.status] = states.get(job.status, 0) + 1
+        resources = SharedResources.default()
+        return {"pid": os.getpid(), "uptime": round(time.time() - self.started, 1), "accounts": accounts,
+                "jobs": states, "bufferPool": BufferPool.formatStats(resources.bufferPool.stats())}
+
+    def serve(self):
+        '''
+            serves until interrupted, STATE_FILE exists meanwhile
+        '''
+        os.makedirs(os.path.dirname(Daemon.STATE_FILE), exist_ok=True)
+        try:
+            # os.open only applies the mode to new files, an existing one might be readable by others
+            os.remove(Daemon.STATE_FILE)
+        except FileNotFoundError:
+            pass
+        descriptor = os.open(Daemon.STATE_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(descriptor, "w") as stateFile:
+            json.dump({"url": self.url, "token": self.token, "pid": os.getpid()}, stateFile)
+        if self.handle is not None:
+            self.account(self.handle)
+        print("Opacity daemon listening on {}".format(self.url))
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            try:
+                os.remove(Daemon.STATE_FILE)
+            except OSError:
+                pass
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body):
+        body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        expected = "Bearer " + self.server.daemon.token
+        if hmac.compare_digest(self.headers.get("Authorization", ""), expected):
+            return True
+        self.send(401, {"error": "missing or wrong token"})
+        return False
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        daemon = self.server.daemon
+        if self.path == "/status":
+            return self.send(200, daemon.stats())
+        if self.path == "/jobs":
+            return self.send(200, daemon.listJobs())
+        match = re.match(r"^/jobs/(\d+)$", self.path)
+        job = daemon.job(match.group(1)) if match else None
+        if job is None:
+            return self.send(404, {"error": "unknown job"})
+        return self.send(200, job.toDict())
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if not self.authorized():
+            return
+        if self.path != "/jobs":
+            return self.send(404, {"error": "unknown endpoint"})
+        try:
+            request = json.loads(body.decode("utf-8") or "{}")
+            job = self.server.daemon.submit(request)
+        except (ValueError, KeyError, TypeError) as e:
+            return self.send(400, {"error": str(e)})
+        if request.get("wait"):
+            wait([job.future])
+            return self.send(200, job.toDict())
+        return self.send(202, job.toDict())
+
+
+class DaemonClient:
+    '''
+        Talks to a running daemon, found through Daemon.STATE_FILE. Only uses the standard library,
+        so submitting a job doesn't import anything heavy.
+    '''
+
+    def __init__(self, url, token):
+        self.url = url
+        self.token = token
+
+    @staticmethod
+    def fromState(path=None):
+        try:
+            with open(path or Daemon.STATE_FILE) as stateFile:
+                state = json.load(stateFile)
+        except OSError:
+            raise ConnectionError("No opacity daemon is running, start one with: python OpacityCLI.py daemon")
+        return DaemonClient(state["url"], state["token"])
+
+    def _request(self, path, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(self.url + path.lstrip("/"), data=data,
+                                         headers={"Authorization": "Bearer " + self.token,
+                                                  "Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            raise ValueError(json.loads(e.read().decode("utf-8")).get("error", str(e)))
+
+    def submit(self, command, args, wait=False, account=None):
+        body = {"command": command, "args": args, "wait": wait}
+        if account is not None:
+            body["account"] = account
+        return self._request("jobs", body)
+
+    def job(self, id):
+        return self._request("jobs/{}".format(id))
+
+    def jobs(self):
+        return self._request("jobs")
+
+    def status(self):
+        return self._request("status")
@@ -0,0 +1,87 @@
+import os
+import posixpath
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from TransferTuning import TransferThrottle
+
+
+class DownloadJob:
+    '''
+        one file of a DownloadScheduler, done is set once the file is downloaded or failed (error is set then)
+    '''
+
+    def __init__(self, handle, name, opacityPath, savePath):
+        self.handle = handle
+        self.name = name
+        self.opacityPath = opacityPath
+        self.savePath = savePath  # local folder the file gets saved to
+        self.error = None
+        self.seconds = None
+        self.done = threading.Event()
+
+
+class DownloadScheduler:
+    '''
+        Downloads files and whole folder trees with several files at once.
+        The folders are walked while the first files already download, the local folders are created on the way.
+        All range requests of all files share one TransferThrottle (maxRequests requests at once, maxBandwidth
+        bytes per second), so more files at once don't mean more load. onFileDone(job) is called from the
+        worker thread as soon as a file is finished.
+    '''
+
+    def __init__(self, account, maxFiles=4, maxRequests=8, maxBandwidth=None, onFileDone=None):
+        self.account = account
+        self.maxFiles = maxFiles
+        self.throttle = TransferThrottle(maxRequests, maxBandwidth)
+        self.onFileDone = onFileDone
+        self.jobs = []
+        self._lock = threading.Lock()
+
+    def download(self, items, folderPath, pathToSave):
+        '''
+            items like in Opacity.Download_GUI ({"handle", "name"}, 128 character handles are files,
+            64 character handles folders in folderPath). Blocks until everything is done, returns the jobs
+        '''
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.maxFiles) as pool:
+            for item in items:
+                if len(item["handle"]) == 128:
+                    self._submit(pool, DownloadJob(item["handle"], item["name"], folderPath, pathToSave))
+                elif len(item["handle"]) == 64:
+                    self._walk(pool, posixpath.join(folderPath, item["name"]),
+                               os.path.join(pathToSave, item["name"]))
+
+        failed = [job for job in self.jobs if job.error is not None]
+        print("Downloaded {} of {} files in {:.1f} seconds".format(
+            len(self.jobs) - len(failed), len(self.jobs), time.time() - start))
+        return self.jobs
+
+    def _walk(self, pool, opacityPath, localPath):
+        folders = [(opacityPath, localPath)]
+        while len(folders) > 0:
+            opacityPath, localPath = folders.pop(0)
+            os.makedirs(localPath, exist_ok=True)
+            metadata = self.account.getFolderData(opacityPath)["metadata"]
+            for name, _, _, handle in metadata.fileSummaries():
+                if handle is not None:
+                    self._submit(pool, DownloadJob(handle, name, opacityPath, localPath))
+            for folder in metadata.folders:
+                folders.append((posixpath.join(opacityPath, folder.name), os.path.join(localPath, folder.name)))
+
+    def _submit(self, pool, job):
+        with self._lock:
+            self.jobs.append(job)
+        pool.submit(self._run, job)
+
+    def _run(self, job):
+        start = time.time()
+        try:
+            self.account.downloadFile(job.savePath, job.handle, throttle=self.throttle)
+        except Exception as e:
+            job.error = e
+            print("Failed to download {}\nReason: {}".format(posixpath.join(job.opacityPath, job.name), e))
+        job.seconds = time.time() - start
+        job.done.set()
+        if self.onFileDone is not None:
+            self.onFileDone(job)
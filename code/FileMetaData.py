@@ -3,11 +3,11 @@ from Constants import Constants
 
 class FileMetaData:
 
-    def __init__(self, fileData):
+    def __init__(self, fileData, partSize=None):
         self.name = fileData["name"]
         self.type = fileData["type"]
         self.size = fileData["size"]
-        self.p = FileMetaOptions()
+        self.p = FileMetaOptions(partSize)
 
     def getDict(self):
         temp = self.__dict__.copy()
@@ -17,6 +17,7 @@ class FileMetaData:
 
 class FileMetaOptions:
 
-    def __init__(self):
+    def __init__(self, partSize=None):
         self.blockSize = Constants.DEFAULT_BLOCK_SIZE
-        self.partSize = 10485760  # should be Constants.DEFAULT_PART_SIZE but they are 2 different numbers
+        # plaintext bytes per part, chosen per file by PartSizePolicy (not the same as Constants.DEFAULT_PART_SIZE)
+        self.partSize = partSize or Constants.UPLOAD_PART_SIZE
@@ -0,0 +1,171 @@
+from operator import itemgetter
+
+
+class FolderListing:
+    '''
+        Data model of the folder view in the gui.
+        Every entry is a dict which is directly used as view data of the RecycleView,
+        so sorting, filtering and the checkbox state live in here instead of in the widgets.
+        Only the visible rows get widgets, the widgets are recycled while scrolling.
+
+        The sort keys are computed once when the folder is loaded and the sorted orders are kept
+        per column, so switching the sort column or direction doesn't sort again.
+    '''
+
+    SORT_COLUMNS = ("name", "size", "created")
+
+    def __init__(self):
+        self.entries = []  # List[dict], in the order of the folder metadata
+        self.visible = []  # List[dict], the entries in the order they are shown
+        self.sort_column = None
+        self.ascending = False
+        self.filter_text = ""
+        self._orders = dict()  # column -> (folders, files) sorted ascending
+        self._filtered = None  # the entries matching filter_text in the current order
+
+    def load(self, folderMetaData, keep_view=False):
+        '''
+            keep_view keeps the sort column, direction, filter and the selected entries,
+            e.g. when the shown folder got revalidated
+        '''
+        selected = set(entry["handle"] for entry in self.entries if entry["selected"]) if keep_view else set()
+        entries = []
+        for folder in folderMetaData.folders:
+            entries.append(FolderListing.folder_entry(folder.name, folder.handle))
+            entries[-1]["selected"] = folder.handle in selected
+        for name, created, size, handle in folderMetaData.fileSummaries():
+            if handle is None:
+                continue  # file without any version
+            sort_name = (name.casefold(), name)
+            entries.append({
+                "viewclass": "FileItem",
+                "is_folder": False,
+                "name": name,
+                "handle": handle,
+                "file_size": size,
+                "timestamp": created,
+                "selected": handle in selected,
+                "sort_name": sort_name,
+                "sort_size": (size, sort_name),
+                "sort_created": (created, sort_name)
+            })
+        self.entries = entries
+        if not keep_view:
+            self.sort_column = None
+            self.ascending = False
+            self.filter_text = ""
+        self._orders = dict()
+        self._update()
+
+    @staticmethod
+    def folder_entry(name, handle):
+        sort_name = (name.casefold(), name)
+        return {
+            "viewclass": "FolderItem",
+            "is_folder": True,
+            "name": name,
+            "handle": handle,
+            "file_size": 0,
+            "timestamp": 0,
+            "selected": False,
+            "sort_name": sort_name,
+            "sort_size": (0, sort_name),
+            "sort_created": (0, sort_name)
+        }
+
+    @staticmethod
+    def format_size(size):
+        for unit in ("B", "KB", "MB", "GB"):
+            if size < 1000:
+                return "{:.1f} {}".format(size, unit) if unit != "B" else "{} {}".format(size, unit)
+            size = size / 1000
+        return "{:.1f} TB".format(size)
+
+    def sort_by(self, column):
+        '''
+            sorts by the column, selecting the same column again toggles between ascending and descending.
+            Folders are always listed before the files. Returns True if sorted ascending.
+        '''
+        if column not in FolderListing.SORT_COLUMNS:
+            raise ValueError("Unknown sort column: {}".format(column))
+        if column == self.sort_column:
+            self.ascending = not self.ascending
+        else:
+            self.sort_column = column
+            self.ascending = True
+        self._update()
+        return self.ascending
+
+    def set_filter(self, text):
+        '''
+            only shows the entries whose name contains the text (case insensitive).
+            If the text extends the previous filter only the previous matches get searched.
+        '''
+        text = text.casefold()
+        if self._filtered is not None and self.filter_text and text.startswith(self.filter_text):
+            self.filter_text = text
+            self._filtered = [entry for entry in self._filtered if text in entry["sort_name"][0]]
+            self.visible = self._filtered
+        else:
+            self.filter_text = text
+            self._update()
+
+    def _ordered(self):
+        if self.sort_column is None:
+            return self.entries
+
+        order = self._orders.get(self.sort_column)
+        if order is None:
+            key = itemgetter("sort_" + self.sort_column)
+            folders = sorted((entry for entry in self.entries if entry["is_folder"]), key=key)
+            files = sorted((entry for entry in self.entries if not entry["is_folder"]), key=key)
+            order = (folders, files)
+            self._orders[self.sort_column] = order
+
+        folders, files = order
+        if self.ascending:
+            return folders + files
+        return folders[::-1] + files[::-1]
+
+    def _update(self):
+        ordered = self._ordered()
+        if self.filter_text:
+            self._filtered = [entry for entry in ordered if self.filter_text in entry["sort_name"][0]]
+        else:
+            self._filtered = list(ordered)
+        self.visible = self._filtered
+
+    def selected(self):
+        return [entry for entry in self.visible if entry["selected"]]
+
+    def select_all(self, value):
+        for entry in self.visible:
+            entry["selected"] = value
+
+    def find(self, handle):
+        for entry in self.entries:
+            if entry["handle"] == handle:
+                return entry
+        return None
+
+    def add_folder(self, name, handle):
+        self.entries.append(FolderListing.folder_entry(name, handle))
+        self._orders = dict()
+        self._update()
+
+    def remove(self, handles):
+        handles = set(handles)
+        self.entries = [entry for entry in self.entries if entry["handle"] not in handles]
+        self._orders = dict()
+        self._update()
+
+    def rename(self, handle, name):
+        entry = self.find(handle)
+        if entry is not None:
+            sort_name = (name.casefold(), name)
+            entry["name"] = name
+            entry["sort_name"] = sort_name
+            entry["sort_size"] = (entry["file_size"], sort_name)
+            entry["sort_created"] = (entry["timestamp"], sort_name)
+            self._orders = dict()
+            self._update()
@@ -1,7 +1,9 @@
 import json
+from array import array
 
 
 class FolderMetaFileVersion:
+    __slots__ = ("size", "handle", "modified", "created")
 
     def __init__(self, size=None, handle=None, modified=None, created=None):
         self.size = size
@@ -10,66 +12,188 @@ class FolderMetaFileVersion:
         self.created = created
 
 class FolderMetaFile:
+    __slots__ = ("name", "created", "modified", "tags", "versions")
 
     def __init__(self):
         self.name = None
+        self.created = None
+        self.modified = None
         self.tags = []
         self.versions = []  # List[FolderMetaFileVersion]
 
+    def toList(self):
+        return [self.name, self.created, self.modified,
+                [[version.handle, version.size, version.created, version.modified] for version in self.versions]]
+
 class FolderMetaFolder:
+    __slots__ = ("name", "handle")
 
     def __init__(self, name=None, handle=None):
         self.name = name
         self.handle = handle
 
 
+class CompactFileList:
+    '''
+        Column based storage of the files of a folder for folders with a huge amount of files.
+        The FolderMetaFile objects only get created when an entry is accessed and are kept afterwards,
+        so changes to them end up in toString. Files with more or less than one version keep their raw versions.
+    '''
+
+    def __init__(self, files):
+        self.names = [str(file[0]) for file in files]
+        self.created = array("q", [int(file[1]) for file in files])
+        self.modified = array("q", [int(file[2]) for file in files])
+
+        self.rawVersions = dict()  # index -> raw versions of files which don't have exactly one version
+        handles = []
+        sizes = []
+        versionCreated = []
+        versionModified = []
+        for index, file in enumerate(files):
+            versions = file[3]
+            if len(versions) == 1:
+                version = versions[0]
+                handles.append(str(version[0]))
+                sizes.append(int(version[1]))
+                versionCreated.append(int(version[2]))
+                versionModified.append(int(version[3]))
+            else:
+                self.rawVersions[index] = [[str(version[0]), int(version[1]), int(version[2]), int(version[3])]
+                                           for version in versions]
+                handles.append(None)
+                sizes.append(0)
+                versionCreated.append(0)
+                versionModified.append(0)
+
+        self.handles = handles
+        self.sizes = array("q", sizes)
+        self.versionCreated = array("q", versionCreated)
+        self.versionModified = array("q", versionModified)
+
+        self._materialized = dict()  # index -> FolderMetaFile
+        self._appended = []  # List[FolderMetaFile]
+
+    def __len__(self):
+        return len(self.names) + len(self._appended)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("file index out of range")
+        if index >= len(self.names):
+            return self._appended[index - len(self.names)]
+
+        file = self._materialized.get(index)
+        if file is None:
+            file = FolderMetaFile()
+            file.name = self.names[index]
+            file.created = self.created[index]
+            file.modified = self.modified[index]
+            if index in self.rawVersions:
+                file.versions = [FolderMetaFileVersion(size=version[1], handle=version[0],
+                                                       created=version[2], modified=version[3])
+                                 for version in self.rawVersions[index]]
+            else:
+                file.versions = [FolderMetaFileVersion(size=self.sizes[index], handle=self.handles[index],
+                                                       created=self.versionCreated[index],
+                                                       modified=self.versionModified[index])]
+            self._materialized[index] = file
+        return file
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, file):
+        self._appended.append(file)
+
+    def remove(self, removed):
+        '''
+            removes the files whose newest version has one of the handles in removed, without creating the file objects
+        '''
+        summaries = self.summaries()
+        keep = [index for index in range(len(self.names)) if summaries[index][3] not in removed]
+        newIndex = dict((index, position) for position, index in enumerate(keep))
+
+        self.names = [self.names[index] for index in keep]
+        self.created = array("q", [self.created[index] for index in keep])
+        self.modified = array("q", [self.modified[index] for index in keep])
+        self.handles = [self.handles[index] for index in keep]
+        self.sizes = array("q", [self.sizes[index] for index in keep])
+        self.versionCreated = array("q", [self.versionCreated[index] for index in keep])
+        self.versionModified = array("q", [self.versionModified[index] for index in keep])
+        self.rawVersions = dict((newIndex[index], versions) for index, versions in self.rawVersions.items()
+                                if index in newIndex)
+        self._materialized = dict((newIndex[index], file) for index, file in self._materialized.items()
+                                  if index in newIndex)
+        self._appended = [file for file in self._appended if FolderMetaData.summary(file)[3] not in removed]
+
+    def summaries(self):
+        '''
+            (name, created, size, handle) of the newest version of every file without creating the file objects
+        '''
+        result = list(zip(self.names, self.created, self.sizes, self.handles))
+        for index, versions in self.rawVersions.items():
+            if len(versions) > 0:
+                result[index] = (self.names[index], self.created[index], versions[0][1], versions[0][0])
+            else:
+                result[index] = (self.names[index], self.created[index], None, None)
+        for index, file in self._materialized.items():
+            result[index] = FolderMetaData.summary(file)
+        result.extend(FolderMetaData.summary(file) for file in self._appended)
+        return result
+
+    def toLists(self):
+        result = [[name, created, modified, [[handle, size, versionCreated, versionModified]]]
+                  for name, created, modified, handle, size, versionCreated, versionModified
+                  in zip(self.names, self.created, self.modified, self.handles, self.sizes,
+                         self.versionCreated, self.versionModified)]
+        for index, versions in self.rawVersions.items():
+            result[index][3] = versions
+        for index, file in self._materialized.items():
+            result[index] = file.toList()
+        result.extend(file.toList() for file in self._appended)
+        return result
+
+
 class FolderMetaData:
 
     def __init__(self):
         self.name = None
         self.created = None
         self.modified = None
-        self.files = []  # List[FolderMetaFile]
+        self.files = []  # List[FolderMetaFile] or CompactFileList
         self.folders = []  # List[FolderMetaFolder]
         self.tags = []
 
-    def toString(self):
-        newList = list()
-        newList.append(self.name)
-
-        files = []
-
-        for file in self.files:
-            fileAsList = list()
-            fileAsList.append(file.name)
-            fileAsList.append(file.created)
-            fileAsList.append(file.modified)
-
-            versionsList = []
-            for version in file.versions:
-                versionAsList = list()
-                versionAsList.append(version.handle)
-                versionAsList.append(version.size)
-                versionAsList.append(version.created)
-                versionAsList.append(version.modified)
-                versionsList.append(versionAsList)
-
-            fileAsList.append(versionsList)
-            files.append(fileAsList)
-
-        newList.append(files)
+    @staticmethod
+    def summary(file):
+        if len(file.versions) == 0:
+            return file.name, file.created, None, None
+        return file.name, file.created, file.versions[0].size, file.versions[0].handle
+
+    def fileSummaries(self):
+        '''
+            (name, created, size, handle) of the newest version of every file,
+            for CompactFileList without creating the file objects
+        '''
+        if isinstance(self.files, CompactFileList):
+            return self.files.summaries()
+        return [FolderMetaData.summary(file) for file in self.files]
 
-        folders = []
-        for folder in self.folders:
-            folderAsList = list()
-            folderAsList.append(folder.name)
-            folderAsList.append(folder.handle)
-            folders.append(folderAsList)
+    def toString(self):
+        if isinstance(self.files, CompactFileList):
+            files = self.files.toLists()
+        else:
+            files = [file.toList() for file in self.files]
 
-        newList.append(folders)
+        folders = [[folder.name, folder.handle] for folder in self.folders]
 
-        newList.append(self.created)
-        newList.append(self.modified)
+        newList = [self.name, files, folders, self.created, self.modified]
 
         newListAsString = json.dumps(newList, separators=(',', ':'))
 
@@ -88,21 +212,31 @@ class FolderMetaData:
             folderMetaFile.name = str(file[0])
             folderMetaFile.created = int(file[1])
             folderMetaFile.modified = int(file[2])
+            folderMetaFile.versions = [FolderMetaFileVersion(handle=str(version[0]), size=int(version[1]),
+                                                             created=int(version[2]), modified=int(version[3]))
+                                       for version in file[3]]
 
-            for version in file[3]:
-                folderMetaFileVersion = FolderMetaFileVersion()
-                folderMetaFileVersion.handle = str(version[0])
-                folderMetaFileVersion.size = int(version[1])
-                folderMetaFileVersion.created = int(version[2])
-                folderMetaFileVersion.modified = int(version[3])
+            folderMetaData.files.append(folderMetaFile)
 
-                folderMetaFile.versions.append(folderMetaFileVersion)
+        folderMetaData.folders = [FolderMetaFolder(folder[0], folder[1]) for folder in data[2]]
 
-            folderMetaData.files.append(folderMetaFile)
+        return folderMetaData
 
-        for folder in data[2]:
-            folderMetaFolder = FolderMetaFolder(folder[0],folder[1])
-            folderMetaData.folders.append(folderMetaFolder)
+    @staticmethod
+    def ToCompact(data):
+        '''
+            same as ToObject, but the files are stored in a CompactFileList
+        '''
+        folderMetaData = FolderMetaData()
+
+        folderMetaData.name = str(data[0])
+        folderMetaData.created = int(data[3])
+        folderMetaData.modified = int(data[4])
+        folderMetaData.files = CompactFileList(data[1])
+        folderMetaData.folders = [FolderMetaFolder(folder[0], folder[1]) for folder in data[2]]
 
         return folderMetaData
 
+    @staticmethod
+    def FromString(string):
+        return FolderMetaData.ToCompact(json.loads(string))
@@ -1,12 +1,12 @@
 from Constants import Constants
-import Crypto.Random
-from Crypto.Hash import keccak
+from LazyModule import LazyModule
 #from FileMetaData import FileMetaOptions
 import math
 import json
 import time
-import bitcoinlib
-import Crypto
+
+keccak = LazyModule("Crypto.Hash.keccak")
+CryptoRandom = LazyModule("Crypto.Random")
 
 class Helper:
 
@@ -65,7 +65,7 @@ class Helper:
 
     @staticmethod
     def GenerateFileKeys():
-        arr = Crypto.Random.get_random_bytes(64)
+        arr = CryptoRandom.get_random_bytes(64)
         return arr
 
 
@@ -80,6 +80,21 @@ class Helper:
 
         return part
 
+    @staticmethod
+    def ReadPartialInto(fileInfo, partSize, currentIndex, buffer):
+        '''
+            same as GetPartial, but reads into the given buffer which has to have the size of the part
+        '''
+        view = memoryview(buffer)
+        with open(fileInfo["fullName"], "rb", buffering=0) as input_file:
+            input_file.seek(partSize*currentIndex)
+            read = 0
+            while read < len(view):
+                amount = input_file.readinto(view[read:])
+                if not amount:
+                    raise EOFError("{} ended before the end of part {}".format(fileInfo["fullName"], currentIndex + 1))
+                read += amount
+
 
     @staticmethod
     def GetJson(dictionary):
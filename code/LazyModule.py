@@ -0,0 +1,30 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    '''
+        Stands in for a module and only imports it on the first attribute access.
+        Used for the heavy dependencies (web3, bitcoinlib, joblib, requests, cryptography)
+        so that starting the cli/gui doesn't pay for modules a command never needs.
+    '''
+
+    _lock = threading.Lock()
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            with LazyModule._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return "<LazyModule '{}' ({})>".format(self._name, state)
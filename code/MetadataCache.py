@@ -0,0 +1,169 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from AesGcm256 import AesGcm256
+from LazyModule import LazyModule
+
+keccak = LazyModule("Crypto.Hash.keccak")
+
+
+class MetadataCache:
+    '''
+        Encrypted on-disk cache for one account (the file is named after the account's public key).
+        Per opacity path it stores
+            - the derived folder keys (metadataKey and keyString), which are expensive to derive
+            - the decrypted folder metadata string of the last time the folder was seen
+
+        The entries are kept in least recently used order and the oldest ones get evicted
+        once the cache grows above maxBytes. Writes to disk are batched and happen in the background.
+    '''
+
+    DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".opacity", "cache")
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+    SAVE_DELAY = 2.0
+    VERSION = 1
+
+    def __init__(self, publicKey, privateKey, directory=None, maxBytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or MetadataCache.DEFAULT_DIRECTORY
+        self.maxBytes = maxBytes
+
+        fileName = keccak.new(data=bytes(publicKey, "utf-8"), digest_bits=256).hexdigest()[:32] + ".cache"
+        self.path = os.path.join(self.directory, fileName)
+        self._key = bytes.fromhex(
+            keccak.new(data=bytes("metadata cache: " + privateKey, "utf-8"), digest_bits=256).hexdigest())
+
+        self._entries = OrderedDict()  # path -> {"metadataKey", "keyString", "metadata"}
+        self._fetchedAt = dict()  # path -> time the metadata was last seen in this process
+        self._size = 0
+        self._lock = threading.RLock()
+        self._saveTimer = None
+        self._dirty = False
+
+        self._load()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _entrySize(path, entry):
+        return len(path) + len(entry["metadataKey"]) + len(entry["keyString"]) + len(entry["metadata"] or "")
+
+    def getKeys(self, path):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            self._entries.move_to_end(path)
+            return {"metadataKey": entry["metadataKey"], "keyString": entry["keyString"]}
+
+    def putKeys(self, path, metadataKey, keyString):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry["metadataKey"] == metadataKey:
+                self._entries.move_to_end(path)
+                return
+            self._store(path, {"metadataKey": metadataKey, "keyString": keyString, "metadata": None})
+
+    def getMetadata(self, path):
+        '''
+            returns the cached metadata string of the folder or None
+        '''
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            self._entries.move_to_end(path)
+            return entry["metadata"]
+
+    def putMetadata(self, path, metadataKey, keyString, metadata):
+        '''
+            returns True if the metadata differs from the cached one
+        '''
+        with self._lock:
+            self._fetchedAt[path] = time.time()
+            entry = self._entries.get(path)
+            if entry is not None and entry["metadata"] == metadata:
+                self._entries.move_to_end(path)
+                return False
+            self._store(path, {"metadataKey": metadataKey, "keyString": keyString, "metadata": metadata})
+            return True
+
+    def age(self, path):
+        '''
+            seconds since the metadata of the path was last fetched by this process, None if it wasn't
+        '''
+        fetchedAt = self._fetchedAt.get(path)
+        if fetchedAt is None:
+            return None
+        return time.time() - fetchedAt
+
+    def remove(self, path):
+        with self._lock:
+            self._fetchedAt.pop(path, None)
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._size -= MetadataCache._entrySize(path, entry)
+                self._scheduleSave()
+
+    def _store(self, path, entry):
+        old = self._entries.pop(path, None)
+        if old is not None:
+            self._size -= MetadataCache._entrySize(path, old)
+        self._entries[path] = entry
+        self._size += MetadataCache._entrySize(path, entry)
+
+        # evict the least recently used entries, but never the one that was just stored
+        while self._size > self.maxBytes and len(self._entries) > 1:
+            oldPath, oldEntry = self._entries.popitem(last=False)
+            self._size -= MetadataCache._entrySize(oldPath, oldEntry)
+
+        self._scheduleSave()
+
+    def _scheduleSave(self):
+        self._dirty = True
+        if self._saveTimer is None:
+            self._saveTimer = threading.Timer(MetadataCache.SAVE_DELAY, self.flush)
+            self._saveTimer.daemon = True
+            self._saveTimer.start()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "rb") as cacheFile:
+                decrypted = AesGcm256.decrypt(cacheFile.read(), self._key)
+            content = json.loads(decrypted.decode("utf-8"))
+            if content["version"] != MetadataCache.VERSION:
+                return
+            for path, metadataKey, keyString, metadata in content["entries"]:
+                self._store(path, {"metadataKey": metadataKey, "keyString": keyString, "metadata": metadata})
+        except Exception as e:
+            print("Ignoring the unreadable metadata cache {}\nReason: {}".format(self.path, e))
+            self._entries.clear()
+            self._size = 0
+        finally:
+            if self._saveTimer is not None:
+                self._saveTimer.cancel()
+                self._saveTimer = None
+            self._dirty = False
+
+    def flush(self):
+        with self._lock:
+            if self._saveTimer is not None:
+                self._saveTimer.cancel()
+                self._saveTimer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+
+            entries = [[path, entry["metadataKey"], entry["keyString"], entry["metadata"]]
+                       for path, entry in self._entries.items()]
+            content = json.dumps({"version": MetadataCache.VERSION, "entries": entries}, separators=(',', ':'))
+            encrypted = AesGcm256.encrypt(content.encode("utf-8"), self._key)
+
+            os.makedirs(self.directory, exist_ok=True)
+            temporaryPath = self.path + ".tmp"
+            with open(temporaryPath, "wb") as cacheFile:
+                cacheFile.write(encrypted)
+            os.replace(temporaryPath, self.path)
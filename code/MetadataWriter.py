@@ -0,0 +1,157 @@
+import os
+import threading
+from concurrent.futures import Future
+from FolderMetaData import CompactFileList, FolderMetaData
+from Tracing import tracer
+
+
+class _PendingFolder:
+
+    def __init__(self):
+        self.changes = []  # (kind, value, future)
+        self.scheduled = False
+
+
+class MetadataWriter:
+    '''
+        Serializes the changes to the metadata of a folder and writes them in as few metadata/set calls as possible.
+        A change waits up to window seconds for others to the same folder, then all of them are applied to a
+        fresh copy of the folder metadata and written with one metadata/set. Only one write per folder runs at
+        a time, changes arriving meanwhile go into the next write, so concurrent jobs don't overwrite each other.
+        Every change returns a Future with the written folder metadata (same format as getFolderData) or the error.
+        Inside one write the changes have the same effect as one after another in the order they were made.
+    '''
+    WINDOW = 0.1
+
+    def __init__(self, account, window=WINDOW):
+        self.account = account
+        self.window = window
+        self.writes = 0
+        self.changes = 0
+        self._folders = dict()  # folder path -> _PendingFolder
+        self._lock = threading.Lock()
+
+    def addFiles(self, folder, files):
+        return self._change(folder, "addFile", files)
+
+    def addFolders(self, folder, folders):
+        return self._change(folder, "addFolder", folders)
+
+    def removeFiles(self, folder, handles):
+        return self._change(folder, "removeFile", handles)
+
+    def removeFolders(self, folder, handles):
+        return self._change(folder, "removeFolder", handles)
+
+    def renameFile(self, folder, handle, name, keepExtension=False):
+        '''
+            keepExtension appends the extension of the current name to name
+        '''
+        return self._change(folder, "renameFile", [(handle, name, keepExtension)])
+
+    def _change(self, folder, kind, values):
+        future = Future()
+        if len(values) == 0:
+            future.set_result(None)
+            return future
+        with self._lock:
+            pending = self._folders.get(folder)
+            if pending is None:
+                pending = self._folders[folder] = _PendingFolder()
+            pending.changes.extend((kind, value, future) for value in values)
+            self.changes += len(values)
+            if not pending.scheduled:
+                pending.scheduled = True
+                self._schedule(folder)
+        return future
+
+    def _schedule(self, folder):
+        timer = threading.Timer(self.window, self._write, (folder,))
+        timer.daemon = True
+        timer.start()
+
+    def _write(self, folder):
+        with self._lock:
+            pending = self._folders[folder]
+            changes, pending.changes = pending.changes, []
+
+        futures = dict.fromkeys(future for _, _, future in changes)
+        try:
+            with tracer.span("metadata write", folder=folder, changes=len(changes)):
+                account = self.account
+                metadata = account.createMetadatakeyAndKeystring(folder)
+                metadata["metadata"] = account.GetFolderMetaData(metadata["metadataKey"], metadata["keyString"],
+                                                                 folder)
+                MetadataWriter.apply(metadata["metadata"], changes)
+                metadata = account.setMetadata(metadata)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future in futures:
+                if not future.done():
+                    future.set_result(metadata)
+
+        with self._lock:
+            self.writes += 1
+            if len(pending.changes) > 0:
+                self._schedule(folder)
+            else:
+                del self._folders[folder]
+
+    @staticmethod
+    def apply(folderMetaData, changes):
+        '''
+            same result as replaying the changes in the order they were submitted: per handle the last addition
+            or removal wins, it replaces the entry already in the folder, and only the renames after it apply
+        '''
+        lastFile = dict()  # handle -> (position, added FolderMetaFile or None if removed)
+        lastFolder = dict()  # handle -> (position, added FolderMetaFolder or None if removed)
+        renames = dict()  # handle -> renames after its last addition or removal
+        for position, (kind, value, _) in enumerate(changes):
+            if kind == "addFile":
+                handle = FolderMetaData.summary(value)[3]
+                lastFile[handle] = (position, value)
+                renames.pop(handle, None)
+            elif kind == "removeFile":
+                lastFile[value] = (position, None)
+                renames.pop(value, None)
+            elif kind == "renameFile":
+                renames.setdefault(value[0], []).append(value)
+            elif kind == "addFolder":
+                lastFolder[value.handle] = (position, value)
+            elif kind == "removeFolder":
+                lastFolder[value] = (position, None)
+
+        if len(renames) > 0 or len(lastFile) > 0:
+            summaries = folderMetaData.fileSummaries()
+            for index, summary in enumerate(summaries):
+                if summary[3] in renames and summary[3] not in lastFile:
+                    MetadataWriter._rename(folderMetaData.files[index], renames[summary[3]])
+            removedFiles = set(lastFile).intersection(summary[3] for summary in summaries)
+            if len(removedFiles) > 0:
+                if isinstance(folderMetaData.files, CompactFileList):
+                    folderMetaData.files.remove(removedFiles)
+                else:
+                    folderMetaData.files = [file for file in folderMetaData.files
+                                            if FolderMetaData.summary(file)[3] not in removedFiles]
+        if len(lastFolder) > 0:
+            folderMetaData.folders = [entry for entry in folderMetaData.folders if entry.handle not in lastFolder]
+
+        for handle, (_, file) in sorted(lastFile.items(), key=lambda item: item[1][0]):
+            if file is not None:
+                MetadataWriter._rename(file, renames.get(handle, []))
+                folderMetaData.files.append(file)
+        for _, folder in sorted(lastFolder.values(), key=lambda item: item[0]):
+            if folder is not None:
+                folderMetaData.folders.append(folder)
+
+    @staticmethod
+    def _rename(file, renames):
+        for _, name, keepExtension in renames:
+            file.name = name + os.path.splitext(file.name)[1] if keepExtension else name
+
+    def stats(self):
+        with self._lock:
+            return {"changes": self.changes, "writes": self.writes, "pendingFolders": len(self._folders)}
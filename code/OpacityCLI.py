@@ -1,5 +1,18 @@
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import posixpath
+import sys
+import time
 import Opactiy
 import shlex
+from BatchRunner import BatchRunner
+from Daemon import Daemon, DaemonClient
+from TransferTuning import PartSizePolicy
+from TreeScanner import TreeScanner
+from Tracing import tracer
 
 class Interface:
     @staticmethod
@@ -41,18 +54,230 @@ class Interface:
                         acc.createFolder(action[1])
                     elif action[0] == "dir":
                         if len(action) == 2:
-                            acc.getFolderData(action[1])
-                            acc.showFiles()
+                            print(acc.showFiles(acc.getFolderData(action[1])["metadata"]))
                         else:
                             print("Please provide the folderpath!")
                     elif action[0] == "move":
                         acc.move(action[1], action[2], action[3])
+                    elif action[0] == "cat":
+                        if len(action) < 2 or len(action[1]) != 128:
+                            print("Please provide a file handle!")
+                        else:
+                            Interface.cat(acc, action[1], action[2] if len(action) == 3 else None)
+                    elif action[0] == "verify":
+                        if len(action) < 2:
+                            print("Please provide a file handle or a folder path!")
+                        else:
+                            report = acc.verify(action[1])
+                            for problem in report.problems():
+                                print("{} {} {}\n\t{}".format(problem["status"].upper(), problem["path"],
+                                                               problem["handle"], problem["detail"]))
+                            print(report.summary())
+                            if len(action) == 3:
+                                with open(action[2], "w") as reportFile:
+                                    json.dump(report.toDict(), reportFile, indent=2)
+                    elif action[0] == "status":
+                        status = acc.status
+                        print("Payment status: {}\nStorage used: {} of {}\nExpiration date: {}".format(
+                            status.paymentStatus, status.account.storageUsed, status.account.storageLimit,
+                            status.account.expirationDate))
                     else:
                         print("unrecognized command")
                 except Exception as e:
                     print("Error: {}".format(e))
 
 
+    @staticmethod
+    def cat(acc, handle, outputPath=None, output=None):
+        '''
+            writes the content of the file to outputPath or the binary stream output (stdout by default)
+            without a temporary copy on disk
+        '''
+        if outputPath:
+            output = open(outputPath, "wb")
+        elif output is None:
+            output = sys.stdout.buffer
+        try:
+            with acc.open_stream(handle) as stream:
+                for data in stream:
+                    output.write(data)
+            output.flush()
+        finally:
+            if outputPath:
+                output.close()
+
+    @staticmethod
+    def accountHandle():
+        '''
+            the account handle of the non-interactive commands: OPACITY_HANDLE or the one the gui saved in the keyring
+        '''
+        accountHandle = os.environ.get("OPACITY_HANDLE")
+        if accountHandle is None:
+            try:
+                import keyring
+                accountHandle = keyring.get_password("Opacity", "handle")
+            except Exception:
+                accountHandle = None
+        if accountHandle is None or len(accountHandle) != 128:
+            sys.stderr.write("Please set OPACITY_HANDLE to your 128 character account handle\n")
+            sys.exit(1)
+        return accountHandle
+
+    @staticmethod
+    def runCat(handle):
+        '''
+            python OpacityCLI.py cat <file handle> | tar x
+            stdout only gets the file content, the log goes to stderr
+        '''
+        stdout = sys.stdout.buffer
+        with contextlib.redirect_stdout(sys.stderr):
+            acc = Opactiy.Opacity(Interface.accountHandle(), fetchStatus=False)
+            Interface.cat(acc, handle, output=stdout)
+
+    @staticmethod
+    def runUpload(path, folder, dryRun=False, outputPath=None):
+        '''
+            uploads a file or folder, with dryRun it only prints the plan (folders, files, parts, requests, ETA)
+            and writes it as json to outputPath, without logging in
+        '''
+        if dryRun:
+            scanner = TreeScanner(PartSizePolicy(workers=Opactiy.Opacity.UPLOAD_WORKERS),
+                                  smallFileSize=Opactiy.Opacity.SMALL_FILE_SIZE)
+            plan = scanner.scan(path, folder)
+            seconds = plan.estimateSeconds(smallFileWorkers=Opactiy.Opacity.SMALL_FILE_WORKERS)
+            for file in plan.files:
+                print("{} -> {} ({} bytes, {} parts)".format(file.path, posixpath.join(file.folder, file.name),
+                                                            file.size, file.parts))
+            for skippedPath, reason in plan.skipped:
+                print("skipped {}: {}".format(skippedPath, reason))
+            print(plan.summary(seconds))
+            if outputPath:
+                with open(outputPath, "w") as output:
+                    json.dump(plan.toDict(seconds), output, indent=2)
+            return True
+        acc = Opactiy.Opacity(Interface.accountHandle(), fetchStatus=False)
+        return acc.upload(path, folder) is not False
+
+    @staticmethod
+    def runPut(folder, name, size=None):
+        '''
+            pg_dump db | python OpacityCLI.py put /backups db.sql
+            uploads stdin. A file redirected to stdin is read in place, a pipe is buffered so missing parts
+            can be sent again: in memory up to StreamSourceReader.SPOOL_SIZE (64 MB), beyond that in a temporary
+            file on disk (in TMPDIR)
+        '''
+        with contextlib.redirect_stdout(sys.stderr):
+            acc = Opactiy.Opacity(Interface.accountHandle(), fetchStatus=False)
+            return acc.uploadData(sys.stdin.buffer, name, folder, size=size)
+
+    @staticmethod
+    def runDaemon(port, workers):
+        '''
+            keeps the account warm and runs the jobs of submit, see Daemon
+        '''
+        Daemon(Interface.accountHandle(), port=port, workers=workers).serve()
+
+    @staticmethod
+    def runSubmit(command, args, wait=False):
+        '''
+            python OpacityCLI.py submit upload "C:\\file" /folder --wait
+            hands the command to the running daemon and prints the job as json
+        '''
+        client = DaemonClient.fromState()
+        job = client.submit(command, [os.path.abspath(arg) if command in ("upload", "download") and index == 0
+                                      and os.path.exists(arg) else arg for index, arg in enumerate(args)], wait)
+        print(json.dumps(job))
+        return job["status"] != "failed"
+
+    @staticmethod
+    def runBatch(scriptPath, workers, outputPath=None):
+        '''
+            Runs the commands of the script (or stdin for "-") concurrently, see BatchRunner.
+            The results are written as json lines to outputPath or stdout as soon as a command is finished,
+            followed by a summary line. Everything else the client prints goes to stderr.
+        '''
+        if scriptPath == "-":
+            commands = BatchRunner.parse(sys.stdin.readlines())
+        else:
+            with open(scriptPath) as script:
+                commands = BatchRunner.parse(script.readlines())
+
+        output = open(outputPath, "w") if outputPath else sys.stdout
+
+        def writeResult(result):
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stderr):
+            acc = Opactiy.Opacity(Interface.accountHandle(), fetchStatus=False)
+            results = BatchRunner(acc, workers).run(commands, onResult=writeResult)
+        writeResult(BatchRunner.summary(results, time.perf_counter() - start))
+        if outputPath:
+            output.close()
+        return all(result["ok"] for result in results)
+
+    @staticmethod
+    def main():
+        parser = argparse.ArgumentParser(description="Opacity cli, without arguments it starts the interactive mode. "
+                                                     "The account handle is taken from OPACITY_HANDLE or the keyring.")
+        parser.add_argument("--trace", help="write a chrome trace of the run to this file (chrome://tracing, perfetto)")
+        parser.add_argument("--block-cache", metavar="DIRECTORY",
+                            help="keep downloaded blocks in this directory and read them from there next time "
+                                 "(same as OPACITY_BLOCK_CACHE, the daemon passes it on to its accounts)")
+        commands = parser.add_subparsers(dest="mode")
+        cat = commands.add_parser("cat", help="write the content of a file to stdout")
+        cat.add_argument("handle", help="file handle")
+        upload = commands.add_parser("upload", help="upload a file or folder")
+        upload.add_argument("path", help="local file or folder")
+        upload.add_argument("folder", help="opacity folder to upload to")
+        upload.add_argument("--dry-run", action="store_true", help="only show what would be uploaded and the ETA")
+        upload.add_argument("--output", help="with --dry-run write the plan as json to this file")
+        put = commands.add_parser("put", help="upload the content of stdin as a file, piped input above 64 MB is "
+                                              "buffered in a temporary file (TMPDIR) during the upload")
+        put.add_argument("folder", help="opacity folder to upload to")
+        put.add_argument("name", help="file name in opacity")
+        put.add_argument("--size", type=int, help="number of bytes to read from stdin, by default until it ends")
+        daemon = commands.add_parser("daemon", help="keep the account warm and accept jobs on localhost")
+        daemon.add_argument("--port", type=int, default=0, help="port of the job api, by default a free one")
+        daemon.add_argument("--workers", type=int, default=8, help="jobs running at the same time")
+        submit = commands.add_parser("submit", help="hand a command to the running daemon")
+        submit.add_argument("command", choices=sorted(BatchRunner.COMMANDS))
+        submit.add_argument("args", nargs="*")
+        submit.add_argument("--wait", action="store_true", help="wait until the job is finished")
+        jobs = commands.add_parser("jobs", help="status and progress of the daemon's jobs")
+        jobs.add_argument("id", nargs="?", help="only this job")
+        batch = commands.add_parser("batch", help="run a script or json lines file of commands concurrently")
+        batch.add_argument("script", help='file with one command per line, "-" for stdin')
+        batch.add_argument("--workers", type=int, default=8, help="commands running at the same time")
+        batch.add_argument("--output", help="write the json results to this file instead of stdout")
+        args = parser.parse_args()
+
+        if args.trace:
+            tracer.enable()
+            atexit.register(tracer.export, args.trace)
+        if args.block_cache:
+            # every account of this process picks it up, see Opacity
+            os.environ["OPACITY_BLOCK_CACHE"] = args.block_cache
+
+        if args.mode == "cat":
+            Interface.runCat(args.handle)
+        elif args.mode == "upload":
+            sys.exit(0 if Interface.runUpload(args.path, args.folder, args.dry_run, args.output) else 1)
+        elif args.mode == "put":
+            sys.exit(0 if Interface.runPut(args.folder, args.name, args.size) else 1)
+        elif args.mode == "daemon":
+            Interface.runDaemon(args.port, args.workers)
+        elif args.mode == "submit":
+            sys.exit(0 if Interface.runSubmit(args.command, args.args, args.wait) else 1)
+        elif args.mode == "jobs":
+            client = DaemonClient.fromState()
+            print(json.dumps(client.job(args.id) if args.id else client.jobs(), indent=2))
+        elif args.mode == "batch":
+            sys.exit(0 if Interface.runBatch(args.script, args.workers, args.output) else 1)
+        else:
+            Interface.run()
+
     @staticmethod
     def printHelp():
         print('\nUsage:\n'
@@ -63,7 +288,10 @@ class Interface:
               'delete <directory of file/folder> <file/folder handle>\n'
               'move <folder path in opacity> <file or folder handle> <move to folder path in opacity>\n'
               'createFolder <path of folder>\n'
-              'dir <folder path in opacity>\n')
+              'dir <folder path in opacity>\n'
+              'cat <file handle> [saving path]  (prints the content, also: python OpacityCLI.py cat <file handle>)\n'
+              'verify <file handle or folder path, "/" for everything> [report.json]\n'
+              'status\n')
 
 if __name__ == "__main__":
-    Interface.run()
\ No newline at end of file
+    Interface.main()
\ No newline at end of file
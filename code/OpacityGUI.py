@@ -11,13 +11,17 @@ from kivy.uix.popup import Popup
 from kivy.uix.button import Button
 from kivy.core.window import Window
 from kivy.uix.screenmanager import Screen
-from kivy.properties import ObjectProperty, StringProperty, NumericProperty, ListProperty
+from kivy.properties import ObjectProperty, StringProperty, NumericProperty, ListProperty, BooleanProperty
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivy.clock import Clock
 from kivymd.app import MDApp
 from kivymd.uix.boxlayout import MDBoxLayout
 from kivymd.uix.screen import MDScreen
 
 import Opactiy
+from FolderListing import FolderListing
+from DownloadScheduler import DownloadScheduler
+from FolderMetaData import FolderMetaData
 import keyring
 from threading import Thread
 import pyperclip
@@ -26,16 +30,42 @@ import datetime as dt
 import time
 
 
-class FolderItem(MDBoxLayout):
+class ListItem(RecycleDataViewBehavior):
+    '''
+        row of the folder view, the row widgets get reused for different entries while scrolling
+        so the checkbox state is written back into the entry of the FolderListing
+    '''
+    entry = None
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.entry = data
+        return super(ListItem, self).refresh_view_attrs(rv, index, data)
+
+    def on_checkbox(self, active):
+        if self.entry is not None:
+            self.entry["selected"] = active
+
+
+class FolderItem(ListItem, MDBoxLayout):
     name = StringProperty()
     handle = StringProperty()
+    selected = BooleanProperty(False)
 
 
-class FileItem(MDBoxLayout):
+class FileItem(ListItem, MDBoxLayout):
     name = StringProperty()
     handle = StringProperty()
     created_date = StringProperty()
+    size_text = StringProperty()
     timestamp = NumericProperty(0)
+    selected = BooleanProperty(False)
+
+    def refresh_view_attrs(self, rv, index, data):
+        # the date only gets formatted once the row becomes visible
+        if "created_date" not in data:
+            data["created_date"] = dt.datetime.utcfromtimestamp(data["timestamp"] / 1000.0).strftime("%d/%m/%Y")
+            data["size_text"] = FolderListing.format_size(data["file_size"])
+        return super(FileItem, self).refresh_view_attrs(rv, index, data)
 
 
 class DownloadDialog(FloatLayout):
@@ -82,11 +112,15 @@ class UIWidget(Screen):
     account = ObjectProperty(None)
     current_path = StringProperty("/")
     output = ListProperty([])
+    loading = BooleanProperty(False)
+    REVALIDATE_AFTER = 30  # seconds
+    PREFETCH_COUNT = 20
 
     def __init__(self, **kwargs):
         super(UIWidget, self).__init__(**kwargs)
         Window.bind(on_dropfile=self._on_file_drop)
-        self.ascending = False
+        self.listing = FolderListing()
+        self.load_generation = 0
         self.path_depth = 0
         Clock.schedule_once(self.checkForHandle, 0.25)
 
@@ -98,12 +132,13 @@ class UIWidget(Screen):
                                  }})
 
     def multiple_delete(self):
-        items = [item for item in self.scroller.children if item.checkbox.active]
+        items = self.listing.selected()
+        self.listing.remove([item["handle"] for item in items])
+        self.scroller.data = self.listing.visible
         for item in items:
-            self.scroller.remove_widget(item)
             self.account._queue.put({"action": "delete",
                                      "information": {
-                                         "handle": item.handle,
+                                         "handle": item["handle"],
                                          "opacity_path": self.current_path
                                      }})
 
@@ -137,24 +172,60 @@ class UIWidget(Screen):
         self.load_path_content()
 
     def load_path_content(self, _=None):
-        # self.scroller.bind(minimum_height=self.scroller.setter('height'))
-        #start = time.time()
-        self.account.getFolderData(self.current_path)
-        #print("{}".format(time.time()-start))
-        #start = time.time()
-        account_metadata = self.account._metaData
-        self.scroller.clear_widgets()
-        for folder in account_metadata.folders:
-            folderitem = FolderItem(name=folder.name, handle=folder.handle)
-            self.scroller.add_widget(folderitem)
-        for file in account_metadata.files:
-            self.scroller.add_widget(
-                FileItem(name=file.name, handle=file.versions[0].handle, timestamp=file.created,
-                         created_date=dt.datetime.utcfromtimestamp(file.created/1000.0).strftime("%d/%m/%Y")))
-        self.reset_sorts()
-        #print("{}".format(time.time()-start))
-        # print(self.current_path)
-        # print("")
+        '''
+            loads the folder in a background thread, which shows its cached content first (if there is one)
+            and then loads or revalidates it. Results of loads which were superseded by a newer one get dropped.
+        '''
+        self.load_generation += 1
+        generation = self.load_generation
+        path = self.current_path
+
+        self.listing.load(FolderMetaData())
+        self.scroller.data = self.listing.visible
+        self.loading = True
+
+        t = Thread(target=self.fetch_path_content, args=(path, generation))
+        t.daemon = True
+        t.start()
+
+    def fetch_path_content(self, path, generation):
+        cached = None
+        try:
+            cached = self.account.getCachedFolderData(path)
+            if cached is not None:
+                Clock.schedule_once(lambda _: self.show_loaded_content(path, generation, cached))
+                age = self.account.cache.age(path)
+                if age is not None and age < self.REVALIDATE_AFTER:
+                    return
+                metadata = self.account.revalidateFolderData(path)
+            else:
+                metadata = self.account.getFolderData(path)
+        except Exception as e:
+            print("Failed to load {}\nReason: {}".format(path, e))
+            metadata = None
+        Clock.schedule_once(lambda _: self.show_loaded_content(path, generation, metadata, cached is not None))
+
+    def show_loaded_content(self, path, generation, metadata, revalidated=False):
+        if generation != self.load_generation or path != self.current_path:
+            return  # a newer load was started in the meantime
+        self.loading = False
+        if metadata is not None:
+            self.show_folder_content(metadata["metadata"], revalidated)
+
+    def show_folder_content(self, folder_metadata, revalidated=False):
+        '''
+            a revalidated folder keeps the sort, filter and selection the user applied to its cached content
+        '''
+        self.listing.load(folder_metadata, keep_view=revalidated)
+        self.scroller.data = self.listing.visible
+        if not revalidated:
+            self.reset_sorts()
+        self.prefetch_subfolders()
+
+    def prefetch_subfolders(self):
+        # the folders are listed first, so these are the ones on the screen
+        folders = [entry["name"] for entry in self.listing.visible[:self.PREFETCH_COUNT] if entry["is_folder"]]
+        self.account.prefetchFolders([posixpath.join(self.current_path, folder) for folder in folders])
 
     def update_path(self, newpath):
         self.current_path = posixpath.join(self.current_path, newpath)
@@ -190,12 +261,13 @@ class UIWidget(Screen):
 
     def multiple_download(self):
         # print("multiple_download")
-        items = [item for item in self.scroller.children if item.checkbox.active]
+        items = self.listing.selected()
         if len(items) == 0:
             return
         for item in items:
-            item.checkbox.active = False
-        handles = [{"handle": item.handle, "name": item.name} for item in items]
+            item["selected"] = False
+        self.scroller.refresh_from_data()
+        handles = [{"handle": item["handle"], "name": item["name"]} for item in items]
         content = DownloadDialog(download=self.initiate_download, cancel=self.dismiss_download_popup, handles=handles)
         self._download_popup = Popup(title="Choose saving location", content=content, size_hint=(0.9, 0.9))
         self._download_popup.open()
@@ -213,8 +285,12 @@ class UIWidget(Screen):
         self.dismiss_download_popup()
 
     def download_handles(self, path, handles, current_path):
-        for handle in handles:
-            self.account.Download_GUI(item=handle, folderPath=current_path, pathToSave=path)
+        scheduler = DownloadScheduler(self.account, onFileDone=self.file_downloaded)
+        scheduler.download(handles, current_path, path)
+
+    def file_downloaded(self, job):
+        if job.error is None:
+            print("Downloaded {} in {:.1f} seconds".format(job.name, job.seconds))
 
     def dismiss_download_popup(self):
         self._download_popup.dismiss()
@@ -246,7 +322,8 @@ class UIWidget(Screen):
 
     def create_folder(self, name):
         folder = self.account.createFolder(posixpath.join(self.current_path, name))
-        self.scroller.add_widget(FolderItem(name=folder.name, handle=folder.handle))
+        self.listing.add_folder(folder.name, folder.handle)
+        self.scroller.data = self.listing.visible
         self.dismiss_create_folder()
 
     def dismiss_create_folder(self):
@@ -259,8 +336,8 @@ class UIWidget(Screen):
         self._delete_popup.open()
 
     def delete_handle(self, handle):
-        item = [item for item in self.scroller.children if item.handle == handle][0]
-        self.scroller.remove_widget(item)
+        self.listing.remove([handle])
+        self.scroller.data = self.listing.visible
         self.account._queue.put({"action": "delete",
                                  "information": {
                                      "handle": handle,
@@ -281,9 +358,10 @@ class UIWidget(Screen):
     def rename_item(self, new_name, old_name, handle):
         if new_name != old_name:
             # call rename function
-            for item in self.scroller.children:
-                if item.handle == handle:
-                    item.name = new_name + posixpath.splitext(item.name)[1]
+            item = self.listing.find(handle)
+            if item is not None:
+                self.listing.rename(handle, new_name + posixpath.splitext(item["name"])[1])
+                self.scroller.data = self.listing.visible
             # print("Renaming: file:{} handle: {}".format(new_name, handle))
             self.account.rename(self.current_path, handle, old_name, new_name)
         self.dismiss_rename_popup()
@@ -299,65 +377,47 @@ class UIWidget(Screen):
         pyperclip.copy(link)
         # print(link)
 
-    def sort_items(self):
-        '''
-        sort folders
-            1. get all folders/files
-            2. sort them
-            3. put them back reversed
-        '''
-
-        folders = []
-        files = []
-        for item in self.scroller.children[::-1]:
-            if type(item).__name__ == "FileItem":
-                files.append(item)
-            elif type(item).__name__ == "FolderItem":
-                folders.append(item)
+    def sort_items(self, column="name"):
+        ascending = self.listing.sort_by(column)
+        for sort_column, button in self.sort_buttons().items():
+            if sort_column != column:
+                button.icon = ""
+            elif ascending:
+                button.icon = "menu-down"
             else:
-                raise TypeError("Strange type encountered")
-
-        # sort files
-        folders = sorted(folders, key=lambda folder: (folder.name.casefold(), folder.name))
-        files = sorted(files, key=lambda file: (file.name.casefold(), file.name))
-
-        self.scroller.clear_widgets()
-        self.ascending = not self.ascending
-        if not self.ascending:
-            print("sorted descending")
-            self.header.name_sort.icon = "menu-up"
-            folders = folders[::-1]
-            files = files[::-1]
-        else:
-            print("sorted ascending")
-            self.header.name_sort.icon = "menu-down"
-        for folder in folders:
-            self.scroller.add_widget(folder)
-        for file in files:
-            self.scroller.add_widget(file)
+                button.icon = "menu-up"
+        self.scroller.data = self.listing.visible
+
+    def sort_buttons(self):
+        return {"name": self.header.name_sort, "size": self.header.size_sort, "created": self.header.created_sort}
+
+    def filter_items(self, text):
+        self.listing.set_filter(text)
+        self.scroller.data = self.listing.visible
 
     def reset_sorts(self):
-        self.ascending = False
-        self.header.name_sort.icon = ""
+        for button in self.sort_buttons().values():
+            button.icon = ""
         self.header.checkbox.active = False
+        self.header.filter.text = ""
 
     def change_all_checkboxes(self, *args):
         if args[1] == "down":  # checked
-            for item in self.scroller.children:
-                item.checkbox.active = True
+            self.listing.select_all(True)
         elif args[1] == "normal":  # unchecked
-            for item in self.scroller.children:
-                item.checkbox.active = False
+            self.listing.select_all(False)
         else:
             print("checkbox has a new value")
+            return
+        self.scroller.refresh_from_data()
 
     def move_files(self):
         if self.move_button.text == "Move":
             items_to_move = []
-            for item in self.scroller.children:
-                if item.checkbox.active:
-                    items_to_move.append({"handle": item.handle, "name": item.name})
-                    item.checkbox.active = False
+            for item in self.listing.selected():
+                items_to_move.append({"handle": item["handle"], "name": item["name"]})
+                item["selected"] = False
+            self.scroller.refresh_from_data()
             if len(items_to_move) == 0:
                 print("No item was selected")
                 return
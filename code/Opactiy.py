@@ -1,37 +1,72 @@
 import base64
-import bitcoinlib
+import contextvars
 import json
 import math
 import mimetypes
-from joblib import Parallel, delayed, parallel_backend
-import requests
 import shutil
-import web3
 import os
-from Crypto.Hash import keccak
 from Helper import Helper
 from FileMetaData import FileMetaData
 from FolderMetaData import FolderMetaData, FolderMetaFolder, FolderMetaFile, FolderMetaFileVersion
 from AesGcm256 import AesGcm256
 from Constants import Constants
 from AccountStatus import AccountStatus
+from MetadataCache import MetadataCache
+from TransferTuning import TransferMetrics, AdaptiveRangeSizer, RangeQueue, PartSizePolicy
+from LazyModule import LazyModule
+from BufferPool import BufferPool
+from BlockCache import BlockCache
+from SourceReader import SourceReader, MemorySourceReader, StreamSourceReader
+from TreeScanner import TreeScanner
+from RemoteFile import RemoteFileSource, RemoteFileStream, RemoteFile, IncompleteRangeError
+from Verification import VerificationReport
+from DownloadScheduler import DownloadScheduler
+from Tracing import tracer
+from Retry import RetryPolicy, RetryableError, FatalError, checkResponse, notSent
+from BrokerPool import BrokerPool
+from MetadataWriter import MetadataWriter
+from SharedResources import SharedResources
 import posixpath
 import queue
 import time
-from threading import Thread
-from multiprocessing import Process
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock
 
+# heavy dependencies get imported on first use, see LazyModule
+bitcoinlib = LazyModule("bitcoinlib")
+requests = LazyModule("requests")
+web3 = LazyModule("web3")
+keccak = LazyModule("Crypto.Hash.keccak")
 
-class Opacity:
-    _baseUrl = "https://broker-1.opacitynodes.com:3000/api/v1/"
-    _privateKey = ""
-    _chainCode = ""
-    _masterKey = None
-    _status = None
-    _metaData = FolderMetaData()
-    _queue = queue.Queue()
 
-    def __init__(self, account_handle):
+class Opacity:
+    DEFAULT_BROKERS = ["https://broker-1.opacitynodes.com:3000/api/v1/"]
+    PREFETCH_WORKERS = 4
+    UPLOAD_WORKERS = 8
+    QUEUE_WORKERS = 4  # jobs of _queue running at the same time, their folder changes go through metadataWriter
+    SMALL_FILE_WORKERS = 32
+    FOLDER_WORKERS = 8  # folders of one level created at the same time by executePlan
+    SMALL_FILE_SIZE = 1024 * 1024  # files up to that size are uploaded by uploadSmallFiles in folder uploads
+    STREAM_RANGE_BLOCKS = 80  # blocks per range request of open_stream, about 5 MB
+    VERIFY_WORKERS = 8
+    VERIFY_RANGE_BLOCKS = 80  # blocks per range request of verify, about 5 MB
+    PREFETCH_MAX_AGE = 30  # seconds, folders fetched more recently than that aren't prefetched again
+
+    def __init__(self, account_handle, fetchStatus=True, useCache=True, cacheDirectory=None, bufferPool=None,
+                 blockCache=None, brokers=None, resources=None):
+        '''
+            The HD master key is only derived when it's needed for the first time and the account status
+            is fetched in the background (fetchStatus=True) or on the first access of self.status.
+            With useCache the derived folder keys and the last seen folder metadata are kept in an
+            encrypted on-disk cache, see MetadataCache.
+            Sessions, transfer workers, broker pools and (without bufferPool) the buffer memory come from
+            resources, by default the SharedResources of the process, so many accounts can work in one
+            process at the same time. An account has no state shared with other instances.
+            blockCache is an optional BlockCache of encrypted file blocks which downloads, open_stream and
+            open_file consult before fetching ranges (default: the one of the directory in OPACITY_BLOCK_CACHE).
+            brokers is a list of broker urls or a BrokerPool (default: OPACITY_BROKERS, a comma separated
+            list, or DEFAULT_BROKERS). With several brokers their latency is probed in the background
+        '''
 
         if len(account_handle) != 128:
             raise AttributeError("The Account handle should have the length of 128")
@@ -39,37 +74,118 @@ class Opacity:
         self._privateKey = account_handle[0:64]
         self._chainCode = account_handle[64:128]
 
-        private_key_bytes = bytearray.fromhex(self._privateKey)
-        chain_code_bytes = bytearray.fromhex(self._chainCode)
-
-        new_key = bitcoinlib.keys.Key(import_key=private_key_bytes, is_private=True, compressed=True)
-        self._masterKey = bitcoinlib.keys.HDKey(key=new_key.private_byte, chain=chain_code_bytes)
-
-        self._status = self.checkAccountStatus()
-
-        t = Thread(target=self.handle_queue)
-        t.daemon = True
-        t.start()
+        self._status = None
+        self._masterKeyCache = None
+        self._masterKeyLock = Lock()
+        self._statusError = None
+        self._statusThread = None
+        self._useCache = useCache
+        self._cacheDirectory = cacheDirectory
+        self._cacheInstance = None
+        self._cacheLock = Lock()
+        self._prefetchPool = None
+        self._prefetches = []
+        self.metrics = TransferMetrics()
+        self.partSizePolicy = PartSizePolicy(workers=Opacity.UPLOAD_WORKERS)
+        self.retryPolicy = RetryPolicy()
+        self.resources = resources or SharedResources.default()
+        self.bufferPool = bufferPool or self.resources.bufferPool
+        if blockCache is None and os.environ.get("OPACITY_BLOCK_CACHE"):
+            blockCache = self.resources.blockCache(os.environ["OPACITY_BLOCK_CACHE"])
+        self.blockCache = blockCache
+        if brokers is None:
+            brokers = os.environ.get("OPACITY_BROKERS", "").split(",") if os.environ.get("OPACITY_BROKERS") \
+                else Opacity.DEFAULT_BROKERS
+        self.brokers = brokers if isinstance(brokers, BrokerPool) else self.resources.brokerPool(brokers)
+        self.brokers.startProbing()
+        self.metadataWriter = MetadataWriter(self)
+        self._jobQueue = None
+        self._jobQueueLock = Lock()
+
+        if fetchStatus:
+            self._statusThread = Thread(target=self._loadStatus)
+            self._statusThread.daemon = True
+            self._statusThread.start()
+
+    @property
+    def _queue(self):
+        '''
+            the jobs (upload, delete, move) of the gui, the thread handling them starts with the first access
+        '''
+        if self._jobQueue is None:
+            with self._jobQueueLock:
+                if self._jobQueue is None:
+                    self._jobQueue = queue.Queue()
+                    t = Thread(target=self.handle_queue)
+                    t.daemon = True
+                    t.start()
+        return self._jobQueue
+
+    @property
+    def _masterKey(self):
+        if self._masterKeyCache is None:
+            with self._masterKeyLock:
+                if self._masterKeyCache is None:
+                    private_key_bytes = bytearray.fromhex(self._privateKey)
+                    chain_code_bytes = bytearray.fromhex(self._chainCode)
+
+                    with tracer.span("derive master key"):
+                        new_key = bitcoinlib.keys.Key(import_key=private_key_bytes, is_private=True, compressed=True)
+                        self._masterKeyCache = bitcoinlib.keys.HDKey(key=new_key.private_byte, chain=chain_code_bytes)
+        return self._masterKeyCache
+
+    @property
+    def cache(self):
+        if self._useCache and self._cacheInstance is None:
+            with self._cacheLock:
+                if self._cacheInstance is None:
+                    self._cacheInstance = MetadataCache(self._masterKey.public_hex, self._privateKey,
+                                                        directory=self._cacheDirectory)
+        return self._cacheInstance
+
+    @property
+    def status(self):
+        '''
+            the account status, waits for the background fetch if it's still running
+        '''
+        if self._statusThread is not None:
+            self._statusThread.join()
+            self._statusThread = None
+        if self._statusError is not None:
+            error, self._statusError = self._statusError, None
+            raise error
+        if self._status is None:
+            self._status = self.checkAccountStatus()
+        return self._status
+
+    def _loadStatus(self):
+        try:
+            self._status = self.checkAccountStatus()
+        except Exception as e:
+            self._statusError = e
 
     def handle_queue(self):
+        pool = ThreadPoolExecutor(max_workers=Opacity.QUEUE_WORKERS)
         while True:
-            if self._queue.empty():
-                #print("no queue item")
-                time.sleep(2)
+            item = self._queue.get()
+            pool.submit(self.handle_queue_item, item)
+
+    def handle_queue_item(self, item):
+        try:
+            #print("got queue item")
+            print(item)
+            if item["action"] == "upload":
+                self.upload(item["information"]["file_path"], item["information"]["opacity_path"])
+            elif item["action"] == "delete":
+                self.delete(item["information"]["opacity_path"], item["information"]["handle"])
+            elif item["action"] == "move":
+                self.move(item["information"]["from_folder"],
+                          item["information"]["object"],
+                          item["information"]["to_folder"])
             else:
-                item = self._queue.get()
-                #print("got queue item")
-                print(item)
-                if item["action"] == "upload":
-                    self.upload(item["information"]["file_path"], item["information"]["opacity_path"])
-                elif item["action"] == "delete":
-                    self.delete(item["information"]["opacity_path"], item["information"]["handle"])
-                elif item["action"] == "move":
-                    self.move(item["information"]["from_folder"],
-                              item["information"]["object"],
-                              item["information"]["to_folder"])
-                else:
-                    print("not implemented yet")
+                print("not implemented yet")
+        except Exception as e:
+            print("Failed to {} {}\nReason: {}".format(item["action"], item["information"], e))
 
     def checkAccountStatus(self):
         '''
@@ -82,8 +198,7 @@ class Opacity:
         payload = self.signPayloadDict(rawPayload)
         payloadJson = Helper.GetJson(payload)
 
-        with requests.Session() as s:
-            response = s.post(self._baseUrl + "account-data", data=payloadJson)
+        response = self._post("account-data", data=payloadJson)
 
         if response.status_code == 404:
             raise AttributeError("The provided account handle is invalid!")
@@ -91,6 +206,7 @@ class Opacity:
             accountData = response.content.decode("utf-8")
             return AccountStatus.ToObject(accountData)
 
+    @tracer.traced("sign payload")
     def signPayloadDict(self, requestBodyJson):
         # hash the payload
         msgBytes = bytearray(requestBodyJson, "utf-8")
@@ -119,156 +235,316 @@ class Opacity:
 
         return newDict
 
-    def upload(self, pathToFile, uploadToFolder):
+    def upload(self, pathToFile, uploadToFolder, plan=None):
+        '''
+            plan is the UploadPlan of a folder from planUpload, which is scanned otherwise
+        '''
         if uploadToFolder[0] != "/":
             raise EnvironmentError("Please make sure that your upload destination starts with a '/'."
                                    "\nThe main folder equals '/'."
                                    "\nAnd a subdirectory is defined as '/subdir/subdirofsubdir'")
 
         if os.path.isfile(pathToFile):
-            self.uploadFile(pathToFile, uploadToFolder)
+            return self.uploadFile(pathToFile, uploadToFolder)
         elif os.path.isdir(pathToFile):
-            self.uploadFolder(pathToFile, uploadToFolder)
+            if plan is not None:
+                return self.executePlan(plan)
+            return self.uploadFolder(pathToFile, uploadToFolder)
         else:
             raise EnvironmentError("The path is neither a file nor a folder. Make sure the path is correct")
 
     def uploadFolder(self, folderPath, uploadToFolder):
-
         '''
-            1. create metadata for the main folder and attach the metadatahandle to the parent folder
-            2. go into the main folder and upload there the folders/files
-
+            scans the folder first (see TreeScanner) and uploads it according to the plan
         '''
-        folderName = os.path.basename(folderPath)
-
-        finalPath = posixpath.join(uploadToFolder, folderName)
-        metadata = self.createMetadata(finalPath)
-        if metadata["addFolder"]:
-            folder = FolderMetaFolder(name=folderName, handle=metadata["metadataKey"])
-            self.AddFileToFolderMetaData(uploadToFolder, folder, isFolder=True)
-            print("Created successfully {}".format(folderPath))
+        return self.executePlan(self.planUpload(folderPath, uploadToFolder))
 
-        for fileOrFolder in os.listdir(folderPath):
-            path = os.path.join(folderPath, fileOrFolder)
-            self.upload(path, finalPath)
+    def planUpload(self, localPath, uploadToFolder):
+        scanner = TreeScanner(self.partSizePolicy, self.metrics.throughput("upload"), Opacity.SMALL_FILE_SIZE)
+        with tracer.span("scan", path=localPath):
+            return scanner.scan(localPath, uploadToFolder)
 
-    def uploadFile(self, filePath, folder) -> bool:
+    def estimateSeconds(self, plan):
+        '''
+            upload time of the plan at the throughput and broker latency seen so far
+        '''
+        throughput = self.metrics.throughput("upload")
+        return plan.estimateSeconds(throughput * Opacity.UPLOAD_WORKERS if throughput else None,
+                                    self.brokers.best().latency, Opacity.SMALL_FILE_WORKERS)
 
+    def executePlan(self, plan):
+        '''
+            creates the folders of the plan, the folders of one level at once, and uploads the files.
+            Returns False if a file failed to upload
+        '''
+        print(plan.summary(self.estimateSeconds(plan)))
+        for path, reason in plan.skipped:
+            print(f"Couldn't upload: {path}\nBecause {reason}.")
+
+        levels = dict()
+        for folder in plan.folders:
+            levels.setdefault(folder.count("/"), []).append(folder)
+        for depth in sorted(levels):
+            with ThreadPoolExecutor(max_workers=min(Opacity.FOLDER_WORKERS, len(levels[depth]))) as pool:
+                list(pool.map(self.createFolder, levels[depth]))
+
+        ok = True
+        start = time.time()
+        done = 0
+        total = plan.bytes
+
+        def progress():
+            elapsed = time.time() - start
+            left = (total - done) / (done / elapsed) if done > 0 and elapsed > 0 else self.estimateSeconds(plan)
+            print("Uploaded {:.1f} of {:.1f} MB, about {:.0f} s left".format(done / 1e6, total / 1e6, left))
+
+        smallFiles = dict()
+        for file in plan.smallFiles():
+            smallFiles.setdefault(file.folder, []).append(file)
+        for folder, files in smallFiles.items():
+            names = set(entry.name for entry in self.uploadSmallFiles([file.path for file in files], folder))
+            missing = [file.name for file in files if file.name not in names]
+            if len(missing) > 0:
+                ok = False
+                print("Failed to upload to {}: {}".format(folder, ", ".join(missing)))
+            done += sum(file.size for file in files)
+            progress()
+
+        for file in plan.largeFiles():
+            if self.uploadFile(file.path, file.folder, file.partSize) is False:
+                ok = False
+            done += file.size
+            progress()
+        return ok
+
+    def describeFile(self, filePath):
+        '''
+            the file description used for the file metadata and for reading the parts, None for empty files
+        '''
         fd = dict()
         fd["fullName"] = os.path.normpath(filePath)
         fd["name"] = os.path.basename(filePath)
         if os.path.getsize(filePath) == 0:
             print(f"Couldn't upload: {fd['fullName']}\nBecause the filesize is equal to 0.")
-            return False
+            return None
         else:
             fd["size"] = os.path.getsize(filePath)
         fd["type"] = mimetypes.guess_type(filePath)[0]
         # fd["type"] = "application/octet-stream"
+        return fd
+
+    @staticmethod
+    def isSmallFile(filePath):
+        return 0 < os.path.getsize(filePath) <= Opacity.SMALL_FILE_SIZE
+
+    @tracer.traced("uploadFile")
+    def uploadFile(self, filePath, folder, partSize=None) -> bool:
+
+        fd = self.describeFile(filePath)
+        if fd is None:
+            return False
 
         '''
             Check first if the file exists already in the metadata
             -> If yes skip all of this
         '''
         metadataToCheckIn = self.getFolderData(folder=folder)
-        for file in metadataToCheckIn["metadata"].files:
-            if file.name == fd["name"]:
+        for name, _, _, _ in metadataToCheckIn["metadata"].fileSummaries():
+            if name == fd["name"]:
                 print("File: {} already exists".format(fd["name"]))
                 return
         else:
             print("Uploading file: {}".format(fd["name"]))
 
-        metaData = FileMetaData(fd)
-        uploadSize = Helper.GetUploadSize(fd["size"])
-        endIndex = Helper.GetEndIndex(uploadSize, metaData.p)
+        if partSize is None:
+            partSize = self.partSizePolicy.choose(fd["size"], self.metrics.throughput("upload"))
+        fileInfo = self.uploadContent(fd, partSize, Opacity.UPLOAD_WORKERS)
+        if fileInfo is None:
+            return False
 
-        handle = Helper.GenerateFileKeys()
-        hashBytes = handle[0:32]
-        keyBytes = handle[32:]
+        '''
+            Add file to the metadata
+        '''
+        try:
+            self.AddFileToFolderMetaData(folder, fileInfo, isFile=True)
+            print("Uploaded file: {}".format(fd["name"]))
+            return True
+        except Exception as e:
+            print("Failed to attach the file to the folder\nFilehandle: {}\nFolder: {}\nReason: {}".format(
+                fileInfo.versions[0].handle, folder, e))
+            return False
 
-        metaDataJson = Helper.GetJson(metaData.getDict())
+    @tracer.traced("uploadData")
+    def uploadData(self, data, name, folder, size=None, mimeType=None) -> bool:
+        '''
+            Uploads content which doesn't exist as a local file, e.g. a dump generated on the fly,
+            through the same part pipeline as uploadFile. data is bytes, a bytearray, a memoryview or a
+            file-like object; see StreamSourceReader for file-like objects with an unknown size or without seek
+        '''
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            reader = MemorySourceReader(data)
+        else:
+            reader = StreamSourceReader(data, size)
 
-        encryptedMetaData = AesGcm256.encryptString(metaDataJson, keyBytes)
+        fd = dict()
+        fd["fullName"] = name
+        fd["name"] = name
+        fd["size"] = reader.size
+        fd["type"] = mimeType or mimetypes.guess_type(name)[0]
+        fd["created"] = fd["modified"] = Helper.GetUnixMilliseconds()
+        if fd["size"] == 0:
+            reader.close()
+            print(f"Couldn't upload: {name}\nBecause the filesize is equal to 0.")
+            return False
 
-        handleHex = handle.hex()
-        fileId = hashBytes.hex()
+        for existing, _, _, _ in self.getFolderData(folder=folder)["metadata"].fileSummaries():
+            if existing == name:
+                reader.close()
+                print("File: {} already exists".format(name))
+                return False
+        print("Uploading file: {}".format(name))
 
-        requestBody = dict()
-        requestBody["fileHandle"] = fileId
-        requestBody["fileSizeInByte"] = uploadSize
-        requestBody["endIndex"] = endIndex
+        partSize = self.partSizePolicy.choose(fd["size"], self.metrics.throughput("upload"))
+        fileInfo = self.uploadContent(fd, partSize, Opacity.UPLOAD_WORKERS, reader)
+        if fileInfo is None:
+            return False
 
-        requestBodyJson = Helper.GetJson(requestBody)
-        payload = self.SignPayloadForm(requestBodyJson, {"metadata": encryptedMetaData})
-        with requests.Session() as s:
-            response = s.post(self._baseUrl + "init-upload", files=payload)
+        try:
+            self.AddFileToFolderMetaData(folder, fileInfo, isFile=True)
+            print("Uploaded file: {}".format(name))
+            return True
+        except Exception as e:
+            print("Failed to attach the file to the folder\nFilehandle: {}\nFolder: {}\nReason: {}".format(
+                fileInfo.versions[0].handle, folder, e))
+            return False
 
-        if response.status_code != 200:
-            raise Exception("Error during init-upload\n{}".format(response.content.decode()))
+    def uploadSmallFiles(self, filePaths, folder):
         '''
-            Uploading Parts
+            Uploads files which fit into a single part without the per file worker pool of uploadFile.
+            Up to SMALL_FILE_WORKERS files are in flight at once, every worker thread reuses its keep-alive
+            session for init-upload, upload and upload-status, and the uploaded files are added to the
+            folder metadata together with a single metadata/set. Returns the FolderMetaFiles of the files
+            which are in the folder afterwards (uploaded or already there), failed files are missing from it
         '''
+        metadata = self.getFolderData(folder=folder)["metadata"]
+        existing = dict((summary[0], index) for index, summary in enumerate(metadata.fileSummaries()))
+
+        present = []
+        fds = []
+        for filePath in filePaths:
+            fd = self.describeFile(filePath)
+            if fd is None:
+                continue
+            if fd["name"] in existing:
+                print("File: {} already exists".format(fd["name"]))
+                if existing[fd["name"]] is not None:
+                    present.append(metadata.files[existing[fd["name"]]])
+                continue
+            existing[fd["name"]] = None
+            fds.append(fd)
 
-        # start_time = time.time()
-        Parallel(n_jobs=8)(delayed(self.uploadPart)(fd, metaData, handle, index, endIndex) for index in range(endIndex))
-        # print("--- %s seconds ---" % (time.time() - start_time))
-
-        # for index in range(endIndex):
-        #    #start_time = time.time()
-        #    print("Uploading file %s part %d/%d" % (fd["name"], index, endIndex))
-        #    self.uploadPart(fd, metaData, handle, index, endIndex)
-        #    #print("--- %s seconds ---" % (time.time() - start_time))
+        if len(fds) == 0:
+            return present
 
+        def uploadSmallFile(fd):
+            print("Uploading file: {}".format(fd["name"]))
+            return self.uploadContent(fd, Constants.UPLOAD_PART_SIZE, 1)
+
+        uploaded = []
+        failed = []
+        with ThreadPoolExecutor(max_workers=min(Opacity.SMALL_FILE_WORKERS, len(fds))) as pool:
+            futures = [(fd, pool.submit(contextvars.copy_context().run, uploadSmallFile, fd)) for fd in fds]
+            for fd, future in futures:
+                try:
+                    fileInfo = future.result()
+                except Exception as e:
+                    print("Failed to upload file: {}\nReason: {}".format(fd["name"], e))
+                    fileInfo = None
+                if fileInfo is None:
+                    failed.append(fd["name"])
+                else:
+                    uploaded.append(fileInfo)
+
+        if len(uploaded) > 0:
+            try:
+                self.AddFileToFolderMetaData(folder, uploaded, isFile=True)
+                print("Uploaded {} files to {}".format(len(uploaded), folder))
+            except Exception as e:
+                print("Failed to attach {} files to the folder\nFolder: {}\nReason: {}".format(
+                    len(uploaded), folder, e))
+                return present
+        if len(failed) > 0:
+            print("Failed to upload {} of {} files to {}: {}".format(len(failed), len(fds), folder, ", ".join(failed)))
+        return present + uploaded
+
+    def uploadContent(self, fd, partSize, workers, reader=None):
         '''
-            Verify Upload & Retry missing parts
+            init-upload, the parts, upload-status and the re-upload of missing parts.
+            reader hands out the parts and gets closed afterwards, by default a SourceReader of fd["fullName"].
+            Returns the FolderMetaFile to add to the folder metadata or None if the upload failed
         '''
-        requestBody = dict()
-        requestBody["fileHandle"] = fileId
-        requestBodyJson = Helper.GetJson(requestBody)
-        payload = self.signPayloadDict(requestBodyJson)
-        payloadJson = Helper.GetJson(payload)
+        metaData = FileMetaData(fd, partSize=partSize)
+        uploadSize = Helper.GetUploadSize(fd["size"])
+        endIndex = Helper.GetEndIndex(uploadSize, metaData.p)
 
-        with requests.Session() as s:
-            response = s.post(self._baseUrl + "upload-status", data=payloadJson)
-
-        retries = 3
-        content = json.loads(response.content.decode())
-        if content["status"] != 'File is uploaded':
-            if content["status"] == 'chunks missing':
-                missing_parts = content["missingIndexes"]
-                while len(missing_parts) > 0 and retries > 0:
-                    amount = content["endIndex"]
-                    for missingPart in missing_parts:
-                        print("Trying to re-upload part {} out of {}".format(missingPart, amount))
-                        self.uploadPart(fd, metaData, handle, missingPart-1, endIndex)
-                    with requests.Session() as s:
-                        response = s.post(self._baseUrl + "upload-status", data=payloadJson)
-                        retries -= 1
-                    content = json.loads(response.content.decode())
-                    if content["status"] == "File is uploaded":
-                        break
-                    else:
-                        if retries == 0:
-                            print(f"Failed to upload the {fd['name']}\nReason: Too many retries")
-                            return
-                        missing_parts = content["missingIndexes"]
-            else:
-                raise AssertionError("Unknown status of upload-status")
+        handle = Helper.GenerateFileKeys()
+        fileId = handle[0:32].hex()
 
-        '''
-            Add file to the metadata
-        '''
+        budget = self.retryPolicy.newBudget()
+        if reader is None:
+            # small files are read with a single read, mapping them costs more than it saves
+            reader = SourceReader(fd["fullName"], fd["size"], useMmap=fd["size"] > Opacity.SMALL_FILE_SIZE)
+        try:
+            self.initUpload(fileId, uploadSize, endIndex, metaData, handle[32:], budget)
+
+            '''
+                Uploading Parts
+            '''
+            self.uploadParts(fd, metaData, handle, range(endIndex), endIndex, budget, workers, reader)
+
+            '''
+                Verify Upload & re-upload missing parts with the same workers
+            '''
+            recoveryStart = None
+            rounds = self.retryPolicy.statusRounds
+            while True:
+                content = self.getUploadStatus(fileId, budget)
+                if content["status"] == "File is uploaded":
+                    break
+                if content["status"] != "chunks missing":
+                    raise AssertionError("Unknown status of upload-status")
+                if rounds == 0:
+                    print(f"Failed to upload the {fd['name']}\nReason: Too many retries")
+                    return None
+                rounds -= 1
+                if recoveryStart is None:
+                    recoveryStart = time.time()
+                missing = [index - 1 for index in content["missingIndexes"]]
+                print("Re-uploading {} missing parts out of {}".format(len(missing), content["endIndex"]))
+                self.uploadParts(fd, metaData, handle, missing, endIndex, budget, workers, reader)
+        except (FatalError, RetryableError) as e:
+            print(f"Failed to upload the {fd['name']}\nReason: {e}")
+            return None
+        finally:
+            reader.close()
+
+        if recoveryStart is not None:
+            print("Recovered the missing parts of {} in {:.1f} seconds ({} retries)".format(
+                fd["name"], time.time() - recoveryStart, budget.used))
+        if workers > 1:
+            print("Buffer pool: {}".format(BufferPool.formatStats(self.bufferPool.stats())))
 
         fileInfo = FolderMetaFile()
         fileInfo.name = fd["name"]
-        fileInfo.created = int(os.path.getctime(fd["fullName"]) * 1000)
-        fileInfo.modified = int(os.path.getmtime(fd["fullName"]) * 1000)
+        fileInfo.created = fd["created"] if "created" in fd else int(os.path.getctime(fd["fullName"]) * 1000)
+        fileInfo.modified = fd["modified"] if "modified" in fd else int(os.path.getmtime(fd["fullName"]) * 1000)
         # fileInfo.created = Helper.GetUnixMilliseconds()
         # fileInfo.modified = Helper.GetUnixMilliseconds()
         # fileInfo.type = "file"
         fileInfo.versions.append(
             FolderMetaFileVersion(
                 size=fd["size"],
-                handle=handleHex,
+                handle=handle.hex(),
                 modified=fileInfo.modified,
                 created=fileInfo.created,
                 # modified=Helper.GetUnixMilliseconds(),
@@ -277,13 +553,53 @@ class Opacity:
                 # created=int(os.path.getctime(filePath))
             )
         )
-        try:
-            self.AddFileToFolderMetaData(folder, fileInfo, isFile=True)
-            print("Uploaded file: {}".format(fd["name"]))
-        except Exception as e:
-            print("Failed to attach the file to the folder\nFilehandle: {}\nFolder: {}\nReason: {}".format(handleHex,
-                                                                                                           folder, e))
+        return fileInfo
+
+    @tracer.traced("init-upload")
+    def initUpload(self, fileId, uploadSize, endIndex, metaData, keyBytes, budget=None):
+        metaDataJson = Helper.GetJson(metaData.getDict())
 
+        encryptedMetaData = AesGcm256.encryptString(metaDataJson, keyBytes)
+
+        requestBody = dict()
+        requestBody["fileHandle"] = fileId
+        requestBody["fileSizeInByte"] = uploadSize
+        requestBody["endIndex"] = endIndex
+
+        requestBodyJson = Helper.GetJson(requestBody)
+        payload = self.SignPayloadForm(requestBodyJson, {"metadata": encryptedMetaData})
+
+        def post():
+            response = self._post("init-upload", idempotent=False, files=payload)
+            return checkResponse(response, "init-upload")
+
+        # after a timeout or 5xx the upload might be initialized already, only unsent requests are sent again
+        return self.retryPolicy.run(post, budget=budget, retryIf=notSent)
+
+    def _session(self):
+        '''
+            keep-alive session of the current thread, shared with the other accounts
+        '''
+        return self.resources.session()
+
+    def _post(self, endpoint, idempotent=True, measure=True, **kwargs):
+        '''
+            posts to the endpoint (e.g. "metadata/get") of a broker chosen by self.brokers,
+            idempotent requests fail over to the other brokers, measure=False keeps large payloads
+            out of the broker latency
+        '''
+        return self.brokers.post(self._session(), endpoint, idempotent=idempotent, measure=measure, **kwargs)
+
+    @property
+    def _baseUrl(self):
+        return self.brokers.best().url
+
+    @_baseUrl.setter
+    def _baseUrl(self, url):
+        # the previous pool may be shared with other accounts, so it keeps probing
+        self.brokers = BrokerPool([url])
+
+    @tracer.traced("sign payload form")
     def SignPayloadForm(self, requestBodyJson, extraPayload):
         # hash the payload
         msgBytes = bytearray(requestBodyJson, "utf-8")
@@ -316,93 +632,136 @@ class Opacity:
 
         return newDict
 
-    def uploadPart(self, fileInfo, metaData, handle, currentIndex, lastIndex):
-        print("Uploading part {} out of {}".format(currentIndex + 1, lastIndex))
-        #output.put("Uploading part {} out of {}".format(currentIndex + 1, lastIndex))
-        # start_time = time.time()
-        try:
-            hashBytes = handle[0:32]
-            keyBytes = handle[32:]
-            fileId = hashBytes.hex()
+    def uploadParts(self, fileInfo, metaData, handle, indexes, lastIndex, budget=None, workers=UPLOAD_WORKERS,
+                    reader=None):
+        '''
+            uploads the parts concurrently on the shared workers, returns the indexes of the parts which
+            couldn't be uploaded. A single part or a single worker stays in the calling thread
+        '''
+        indexes = list(indexes)
+        queued = tracer.now()
+        if workers <= 1 or len(indexes) <= 1:
+            results = [self.uploadPart(fileInfo, metaData, handle, index, lastIndex, budget, reader)
+                       for index in indexes]
+        else:
+            def uploadQueuedPart(index):
+                tracer.complete("wait for worker", queued, part=index + 1)
+                return self.uploadPart(fileInfo, metaData, handle, index, lastIndex, budget, reader)
 
-            partSize = metaData.p.partSize
+            results = self.resources.map(uploadQueuedPart, indexes, workers)
+        return [index for index, uploaded in zip(indexes, results) if not uploaded]
 
-            rawpart = Helper.GetPartial(fileInfo, partSize, currentIndex)
+    @tracer.traced("uploadPart")
+    def uploadPart(self, fileInfo, metaData, handle, currentIndex, lastIndex, budget=None, reader=None):
+        '''
+            Retryable errors are retried with backoff (see RetryPolicy), if that doesn't help False is returned
+            and upload-status reports the part as missing. Errors which retrying won't fix raise a FatalError.
+            The part is taken from the SourceReader of the upload, without one it's read from fileInfo["fullName"]
+        '''
+        print("Uploading part {} out of {}".format(currentIndex + 1, lastIndex))
+        hashBytes = handle[0:32]
+        keyBytes = handle[32:]
+        fileId = hashBytes.hex()
 
-            numChunks = math.ceil(len(rawpart) / metaData.p.blockSize)
-            encryptedBlob = bytearray(0)
-            for chunkIndex in range(numChunks):
-                remaining = len(rawpart) - (chunkIndex * metaData.p.blockSize)
-                if (remaining <= 0):
-                    break
+        partSize = metaData.p.partSize
+        blockSize = metaData.p.blockSize
+        rawSize = max(min(partSize, fileInfo["size"] - currentIndex * partSize), 0)
+        numChunks = math.ceil(rawSize / blockSize)
+        encryptedSize = rawSize + numChunks * Constants.BLOCK_OVERHEAD
 
-                chunkSize = min(remaining, metaData.p.blockSize)
-                encryptedChunkSize = chunkSize + Constants.BLOCK_OVERHEAD
+        requestBody = dict()
+        requestBody["fileHandle"] = fileId
+        requestBody["partIndex"] = currentIndex + 1
+        requestBody["endIndex"] = lastIndex
 
-                # chunk = bytearray(chunkSize)
-                chunk = rawpart[chunkIndex * metaData.p.blockSize: chunkIndex * metaData.p.blockSize + chunkSize]
-                encryptedChunk = AesGcm256.encrypt(chunk, keyBytes)
+        requestBodyJson = Helper.GetJson(requestBody)
 
-                if (encryptedChunkSize != len(encryptedChunk)):
-                    breakpoint()
+        # a mapped part is a view of the file, otherwise the raw and the encrypted part share one buffer,
+        # so a worker waiting for memory holds none
+        mapped = reader is not None and reader.mapped
+        waiting = tracer.now()
+        with self.bufferPool.borrow(encryptedSize if mapped else rawSize + encryptedSize) as buffer:
+            tracer.complete("wait for buffer", waiting)
+            view = memoryview(buffer)
+            encryptedBlob = view[0:encryptedSize]
+
+            try:
+                with tracer.span("read part", mapped=mapped):
+                    if reader is not None:
+                        rawpart = reader.part(currentIndex, partSize, view[encryptedSize:])
+                    else:
+                        rawpart = view[encryptedSize:]
+                        Helper.ReadPartialInto(fileInfo, partSize, currentIndex, rawpart)
+            except (OSError, EOFError) as e:
+                raise FatalError("Couldn't read part {} of {}: {}".format(currentIndex + 1, fileInfo["fullName"], e))
 
-                encryptedBlob += encryptedChunk
+            with tracer.span("encrypt part", blocks=numChunks):
+                for chunkIndex in range(numChunks):
+                    chunkStart = chunkIndex * blockSize
+                    chunk = rawpart[chunkStart:chunkStart + blockSize]
+                    encryptedChunkSize = len(chunk) + Constants.BLOCK_OVERHEAD
 
-            requestBody = dict()
-            requestBody["fileHandle"] = fileId
-            requestBody["partIndex"] = currentIndex + 1
-            requestBody["endIndex"] = lastIndex
+                    written = AesGcm256.encryptInto(chunk, keyBytes, encryptedBlob,
+                                                    chunkStart + chunkIndex * Constants.BLOCK_OVERHEAD)
 
-            requestBodyJson = Helper.GetJson(requestBody)
+                    if (encryptedChunkSize != written):
+                        raise FatalError("Encrypted chunk has the length {} instead of {}".format(
+                            written, encryptedChunkSize))
 
             payload = self.SignPayloadForm(requestBodyJson, {"chunkData": encryptedBlob})
 
-            with requests.Session() as s:
-                response = s.post(self._baseUrl + "upload", files=payload)
+            try:
+                self.retryPolicy.run(self.sendPart, payload, encryptedSize, budget=budget)
+                return True
+            except RetryableError as e:
+                print(f"Failed upload of part {currentIndex + 1} out of {lastIndex}\nError: {e}")
+                return False
 
-        except Exception as e:
-            print(f"Failed upload of part {currentIndex + 1} out of {lastIndex}\nError: {e.args}")
-        # don't handle the response here, since when check upload-status is handling broken uploads
-        # print("-- %s seconds ---" % (time.time() - start_time))
+    @tracer.traced("upload request")
+    def sendPart(self, payload, size):
+        start = time.time()
+        try:
+            response = self._post("upload", measure=False, files=payload)
+        except Exception:
+            self.metrics.record("upload", size, time.time() - start, ok=False)
+            raise
+        self.metrics.record("upload", size, time.time() - start, ok=response.status_code == 200)
+        return checkResponse(response, "upload")
+
+    @tracer.traced("upload-status")
+    def getUploadStatus(self, fileId, budget=None):
+        requestBody = dict()
+        requestBody["fileHandle"] = fileId
+        requestBodyJson = Helper.GetJson(requestBody)
+        payload = self.signPayloadDict(requestBodyJson)
+        payloadJson = Helper.GetJson(payload)
 
-    def AddFileToFolderMetaData(self, folder, fileOrFolder, isFile=False, isFolder=False):
-        metadata = self.getFolderData(folder=folder)
-        keyString = metadata["keyString"]
-        folderMetaData = metadata["metadata"]
+        def post():
+            response = self._post("upload-status", data=payloadJson)
+            return json.loads(checkResponse(response, "upload-status").content.decode())
+
+        return self.retryPolicy.run(post, budget=budget)
 
+    @tracer.traced("AddFileToFolderMetaData")
+    def AddFileToFolderMetaData(self, folder, fileOrFolder, isFile=False, isFolder=False):
+        '''
+            adds the file(s) or folder to the folder metadata through metadataWriter
+            and returns the written folder metadata
+        '''
+        entries = fileOrFolder if isinstance(fileOrFolder, list) else [fileOrFolder]
         if isFile:
-            folderMetaData.files.append(fileOrFolder)
+            return self.metadataWriter.addFiles(folder, entries).result()
         elif isFolder:
-            folderMetaData.folders.append(fileOrFolder)
+            return self.metadataWriter.addFolders(folder, entries).result()
         else:
             raise EnvironmentError("neither file nor folder")
 
-        ## clean out bug deleted files
-        # folderMetaData.files = [temp for temp in folderMetaData.files if len(temp.versions)>0]
-
-        folderMetaDataString = folderMetaData.toString()
-
-        encryptedFolderMetaData = AesGcm256.encryptString(folderMetaDataString, bytearray.fromhex(keyString))
-        encryptedFolderMetaDataBase64 = base64.b64encode(encryptedFolderMetaData).decode("utf-8")
-
-        AesGcm256.decrypt(encryptedFolderMetaData, bytearray.fromhex(keyString))
-
-        metaReqDict = {
-            "timestamp": Helper.GetUnixMilliseconds(),
-            "metadataKey": metadata["metadataKey"],
-            "metadata": encryptedFolderMetaDataBase64
-        }
-
-        metaReqDictJson = Helper.GetJson(metaReqDict)
-        payload = self.signPayloadDict(metaReqDictJson)
-        payloadJson = Helper.GetJson(payload)
-
-        with requests.Session() as s:
-            response = s.post(self._baseUrl + "metadata/set", data=payloadJson)
+    def _cacheMetadata(self, folder, metaDataKey, keyString, metaDataString):
+        if folder is not None and self.cache is not None:
+            self.cache.putMetadata(folder, metaDataKey, keyString, metaDataString)
 
-        return response
-
-    def GetFolderMetaData(self, metaDataKey, keyString):
+    @tracer.traced("metadata/get")
+    def GetFolderMetaData(self, metaDataKey, keyString, folder=None):
 
         timestamp = Helper.GetUnixMilliseconds()
         payload = dict({
@@ -415,8 +774,7 @@ class Opacity:
 
         payloadMetaJson = Helper.GetJson(payloadMeta)
 
-        with requests.Session() as s:
-            response = s.post(self._baseUrl + "metadata/get", data=payloadMetaJson)
+        response = self._post("metadata/get", data=payloadMetaJson)
 
         resultMetaDataEncrypted = response.content.decode("utf-8")
         resultMetaDataEncryptedJson = json.loads(resultMetaDataEncrypted)
@@ -425,50 +783,104 @@ class Opacity:
 
         decryptedMetaData = AesGcm256.decrypt(stringDecoded, bytearray.fromhex(keyString))
         metaData = decryptedMetaData.decode("utf-8")
-        metaData = json.loads(metaData)
-
-        folderMetaData = FolderMetaData.ToObject(metaData)
+        self._cacheMetadata(folder, metaDataKey, keyString, metaData)
+        folderMetaData = FolderMetaData.FromString(metaData)
 
         return folderMetaData
 
+    @tracer.traced("getFolderData")
     def getFolderData(self, folder):
-        folderKey = Helper.getFolderHDKey(self._masterKey, folder)
-        metaDataKey = Helper.getMetaDataKey(folderKey)
-        keyString = keccak.new(data=bytearray(folderKey.private_hex, "utf-8"), digest_bits=256).hexdigest()
+        metadata = self.createMetadatakeyAndKeystring(folder)
+
+        folderMetaData = self.GetFolderMetaData(metadata["metadataKey"], metadata["keyString"], folder)
+        metadata["metadata"] = folderMetaData
+        return metadata
+
+    def getCachedFolderData(self, folder):
+        '''
+            returns the last seen metadata of the folder from the cache (same format as getFolderData)
+            or None if the folder isn't cached
+        '''
+        if self.cache is None:
+            return None
+        metaDataString = self.cache.getMetadata(folder)
+        keys = self.cache.getKeys(folder)
+        if metaDataString is None or keys is None:
+            return None
+
+        folderMetaData = FolderMetaData.FromString(metaDataString)
+        return {"metadata": folderMetaData, "keyString": keys["keyString"], "metadataKey": keys["metadataKey"],
+                "folder": folder}
+
+    def prefetchFolders(self, folders):
+        '''
+            loads the metadata of the folders in the background into the cache, so that opening them
+            afterwards doesn't have to wait for opacity. Prefetches of an earlier call which didn't start yet
+            are cancelled.
+        '''
+        if self.cache is None:
+            return []
+        if self._prefetchPool is None:
+            self._prefetchPool = ThreadPoolExecutor(max_workers=Opacity.PREFETCH_WORKERS)
+
+        for future in self._prefetches:
+            future.cancel()
+        self._prefetches = [self._prefetchPool.submit(self._prefetchFolder, folder) for folder in folders]
+        return self._prefetches
+
+    def _prefetchFolder(self, folder):
+        age = self.cache.age(folder)
+        if age is not None and age < Opacity.PREFETCH_MAX_AGE:
+            return
+        try:
+            keys = self.createMetadatakeyAndKeystring(folder)
+            self.GetFolderMetaData(keys["metadataKey"], keys["keyString"], folder)
+        except Exception as e:
+            print("Failed to prefetch {}\nReason: {}".format(folder, e))
 
-        folderMetaData = self.GetFolderMetaData(metaDataKey, keyString)
-        self._metaData = folderMetaData
-        return {"metadata": folderMetaData, "keyString": keyString, "metadataKey": metaDataKey}
+    def revalidateFolderData(self, folder):
+        '''
+            fetches the folder from opacity and returns its data,
+            or None if it didn't change compared to the cached version
+        '''
+        cached = self.cache.getMetadata(folder) if self.cache is not None else None
+        metadata = self.getFolderData(folder)
+        if cached is not None and self.cache.getMetadata(folder) == cached:
+            return None
+        return metadata
 
-    def showFiles(self):
+    @staticmethod
+    def showFiles(folderMetaData):
+        '''
+            the folders and files of the folder metadata as a table
+        '''
         maxSize = 15
-        if len(self._metaData.folders) > 0:
-            print(Fore.BLUE, "\nFolders")
-            print(Fore.BLUE, "{:15}  {:20}".format("Foldername", "Filehandle"))
-            for folder in self._metaData.folders:
-                info = [folder.name, folder.handle]
-                if len(folder.name) > maxSize:
-                    info[0] = folder.name[:maxSize - 3] + "..."
-                print(Fore.WHITE, "{:15}  {}".format(info[0], info[1]))
-            print(Style.RESET_ALL,"")
-
-        if len(self._metaData.files) > 0:
-            print(Fore.YELLOW, "\nFiles")
-            print(Fore.YELLOW, "{:15}  {:11}  {:20}".format("Filename", "Filesize", "Filehandle"))
-            for file in self._metaData.files:
-                info = [file.name, file.versions[0].size, file.versions[0].handle]
-                if len(file.name) > maxSize:
-                    info[0] = file.name[:maxSize - 3] + "..."
-                if info[1] >= 1000000000:
+        lines = []
+        if len(folderMetaData.folders) > 0:
+            lines.append("\nFolders")
+            lines.append("{:15}  {:20}".format("Foldername", "Filehandle"))
+            for folder in folderMetaData.folders:
+                name = folder.name if len(folder.name) <= maxSize else folder.name[:maxSize - 3] + "..."
+                lines.append("{:15}  {}".format(name, folder.handle))
+
+        summaries = folderMetaData.fileSummaries()
+        if len(summaries) > 0:
+            lines.append("\nFiles")
+            lines.append("{:15}  {:11}  {:20}".format("Filename", "Filesize", "Filehandle"))
+            for name, _, size, handle in summaries:
+                if len(name) > maxSize:
+                    name = name[:maxSize - 3] + "..."
+                size = size or 0
+                if size >= 1000000000:
                     type = "GB"
-                elif info[1] >= 1000000:
+                elif size >= 1000000:
                     type = "MB"
                 else:
                     type = "KB"
-                while info[1] >= 1000:
-                    info[1] = info[1] / 1000
-                print(Fore.WHITE, "{:15}  {:<7.3f} {:3}  {}".format(info[0], info[1], type, info[2]))
-            print(Style.RESET_ALL,"")
+                while size >= 1000:
+                    size = size / 1000
+                lines.append("{:15}  {:<7.3f} {:3}  {}".format(name, size, type, handle))
+        return "\n".join(lines)
 
     def Download_GUI(self, item, folderPath, pathToSave):
         if len(item["handle"]) == 128:
@@ -477,26 +889,10 @@ class Opacity:
             self.downloadFolder(item, folderPath, pathToSave)
 
     def downloadFolder(self, item, folderPath, pathToSave):
-        folder = item["name"]
-        newFolderPath = os.path.join(pathToSave, folder)
-
-        try:
-            os.mkdir(newFolderPath)
-            print("Created Folder: {}".format(newFolderPath))
-        except FileExistsError:
-            print("Folder: {} already exists".format(newFolderPath))
-
-        opacitypath = posixpath.join(folderPath, folder)
-        metadata = self.getFolderData(opacitypath)
-
-        for folder in metadata["metadata"].folders:
-            subitem = {"handle": folder.handle, "name": folder.name}
-            self.Download_GUI(subitem, opacitypath, newFolderPath)
-
-        for file in metadata["metadata"].files:
-            subitem = {"handle": file.versions[0].handle, "name": file.name}
-            self.Download_GUI(subitem, opacitypath, newFolderPath)
-        pass
+        '''
+            downloads the folder tree with several files at once, see DownloadScheduler
+        '''
+        return DownloadScheduler(self).download([item], folderPath, pathToSave)
 
     def Download(self, fileHandle, savingPath):
         if len(fileHandle) == 128:
@@ -507,151 +903,215 @@ class Opacity:
             #print(Fore.LIGHTRED_EX, "Please provide a handle with the length of 128 for a file and 64 for a folder")
             print("Please provide a handle with the length of 128 for a file and 64 for a folder")
 
-    def downloadFile(self, savingPath, fileHandle):
+    @tracer.traced("downloadFile")
+    def downloadFile(self, savingPath, fileHandle, throttle=None):
+        '''
+            throttle is the TransferThrottle shared with other downloads running at the same time
+        '''
         fileId = fileHandle[:64]
-        fileKey = fileHandle[64:]
-        key = bytearray.fromhex(fileKey)
 
-        payloadJson = json.dumps({"fileID": fileId})
-        with requests.Session() as s:
-            response = s.post(self._baseUrl + "download", data=payloadJson)
+        # resolves the download url and the file metadata
+        source = RemoteFileSource(self, fileHandle).open()
+        key = source.key
+        metaData = source.metaData
 
-        url = response.content.decode()
-        url = json.loads(url)["fileDownloadUrl"]
-
-        # Get file metadata
-        with requests.Session() as s:
-            response = s.get(url + "/metadata")
-
-        encryptedMetaData = response.content
-
-        # Decrypt file metadata
-        decryptedMetaData = AesGcm256.decrypt(encryptedMetaData, key)
-        metaData = json.loads(decryptedMetaData)
-
-        uploadSize = Helper.GetUploadSize(metaData["size"])
-        partSize = 5245440  # 80 * (Constants.DEFAULT_BLOCK_SIZE + Constants.BLOCK_OVERHEAD)
-        parts = int(uploadSize / partSize) + 1
+        uploadSize = source.uploadSize
+        chunkSize = source.chunkSize
 
         fileName = metaData["name"].split(".")[0]
         fileName = fileName.rstrip()
         #folderPath = os.path.normpath(savingPath + "/tmp/" + fileName)
-        folderPath = os.path.join(savingPath, "tmp", fileName)
+        # named after the file id, files with the same name can be downloaded at the same time
+        folderPath = os.path.join(savingPath, "tmp", fileId)
         os.makedirs(folderPath, exist_ok=True)
 
         '''
             Downloading all parts
+            the range size adapts to the link, see AdaptiveRangeSizer
         '''
-        fileUrl = url + "/file"
 
         print("Downloading file: {}".format(fileName))
-        # start_time = time.time()
-        Parallel(n_jobs=5)(
-            delayed(self.downloadPart)(partNumber, parts, partSize, uploadSize, fileUrl, folderPath) for partNumber in
-            range(parts))
-        # print("--- %s seconds with parallel n = 5---" % (time.time() - start_time))
-
-        '''
-        start_time = time.time()
-        for partNumber in range(parts):
-            byteFrom = partNumber * partSize
-            byteTo = (partNumber + 1) * partSize - 1
-            if (byteTo > uploadSize - 1):
-                byteTo = uploadSize - 1
-
-            fileBytes = None
-            with requests.Session() as s:
-                temp = "bytes={}-{}".format(byteFrom, byteTo)
-                s.headers.update({"range": temp})
-                response = s.get(url=url)
-
-                fileBytes = response.content
-
-            fileToWriteTo = folderPath + "\\" + str(partNumber) + ".part"
-
-            with open(fileToWriteTo, 'wb') as file:
-                file.write(fileBytes)
-        print("--- %s seconds --- with single " % (time.time() - start_time))
-        '''
+        startTime = time.time()
+        ranges = RangeQueue(uploadSize, AdaptiveRangeSizer(chunkSize))
+        self.resources.map(lambda _: self.downloadWorker(ranges, source, folderPath, throttle), range(5), 5)
+        if ranges.error is not None:
+            shutil.rmtree(folderPath)
+            raise ranges.error
+        print("Download metrics of {}: {}".format(
+            fileName, TransferMetrics.formatSummary(self.metrics.summary("download", since=startTime))))
+        print("Buffer pool: {}".format(BufferPool.formatStats(self.bufferPool.stats())))
+        if self.blockCache is not None:
+            print("Block cache: {}".format(BlockCache.formatStats(self.blockCache.stats())))
 
         '''
             Decrypt the chunks and restore the file
+            every part starts at a chunk boundary, the part files are named after their first byte
         '''
         print("Joining all parts together")
-        chunkSize = metaData["p"]["blockSize"] + Constants.BLOCK_OVERHEAD
-        chunksAmount = int(uploadSize / chunkSize) + 1
 
-        #path = os.path.normpath(savingPath + "\\" + metaData["name"])
-        path = os.path.join(savingPath, fileName)
+        path = os.path.join(savingPath, metaData["name"])
 
         if os.path.exists(path=path):
             os.remove(path=path)
 
-        with open(path, 'ab+') as saveFile:
-            fileIndex = 0
-            seek = 0
-            for chunkIndex in range(chunksAmount):
-                chunkRawBytes = None
-                with open(os.path.join(folderPath, str(fileIndex) + ".part"), 'rb') as partFile:
-                    partFile.seek(seek)
-                    toReadBytes = chunkSize
-                    if seek + toReadBytes >= os.path.getsize(partFile.name):
-                        toReadBytes = os.path.getsize(partFile.name) - seek
-
-                        # if the bytes to read exceed the file in the next iteration of the for loop
-                        # you need to go to the next partFile -> seek from start
-                        seek = 0
-                        fileIndex = fileIndex + 1
-                    else:
-                        seek = seek + chunkSize
-
-                    chunkRawBytes = partFile.read(toReadBytes)
-
-                decryptedChunk = AesGcm256.decrypt(chunkRawBytes, key)
-                saveFile.write(decryptedChunk)
+        with open(path, 'ab+') as saveFile, self.bufferPool.borrow(chunkSize) as chunkBuffer, \
+                tracer.span("decrypt and join", parts=len(os.listdir(folderPath))):
+            chunkView = memoryview(chunkBuffer)
+            for partName in sorted(os.listdir(folderPath)):
+                with open(os.path.join(folderPath, partName), 'rb') as partFile:
+                    while True:
+                        amount = partFile.readinto(chunkBuffer)
+                        if amount == 0:
+                            break
+                        decryptedChunk = AesGcm256.decrypt(chunkView[:amount], key)
+                        saveFile.write(decryptedChunk)
 
         shutil.rmtree(folderPath)
-        tempFolderPath = os.path.dirname(folderPath)
-        if len(os.listdir(tempFolderPath)) == 0:
-            shutil.rmtree(tempFolderPath)
+        try:
+            # only removes the tmp folder when it's empty, other downloads to the same path may still use it
+            os.rmdir(os.path.dirname(folderPath))
+        except OSError:
+            pass
 
         print("Finished download of {}".format(fileName))
 
-    def downloadPart(self, partNumber, endPartNumber, partSize, uploadSize, url, folderPath):
-        print("Downloading part {:d} out of {:d}".format(partNumber + 1, endPartNumber))
-        byteFrom = partNumber * partSize
-        byteTo = (partNumber + 1) * partSize - 1
-        if (byteTo > uploadSize - 1):
-            byteTo = uploadSize - 1
+    def downloadWorker(self, ranges, source, folderPath, throttle=None):
+        while True:
+            nextRange = ranges.next()
+            if nextRange is None:
+                return
+            byteFrom, byteTo, attempt = nextRange
+            size = byteTo - byteFrom + 1
+
+            try:
+                if throttle is not None:
+                    with throttle.request(size):
+                        start = time.time()
+                        self.downloadPart(source, byteFrom, byteTo, folderPath)
+                else:
+                    start = time.time()
+                    self.downloadPart(source, byteFrom, byteTo, folderPath)
+            except Exception as e:
+                # the range requests themselves are recorded in the metrics by RemoteFileSource.fetch
+                seconds = time.time() - start
+                ranges.sizer.report(size, seconds, ok=False)
+                print("Failed to download the bytes {}-{}, retrying\nError: {}".format(byteFrom, byteTo, e))
+                ranges.retry(byteFrom, byteTo, attempt)
+                continue
+
+            seconds = time.time() - start
+            ranges.sizer.report(size, seconds)
+            ranges.done()
+
+    @tracer.traced("downloadPart")
+    def downloadPart(self, source, byteFrom, byteTo, folderPath):
+        '''
+            byteFrom has to be at a block boundary, blocks in the block cache aren't fetched again
+        '''
+        size = byteTo - byteFrom + 1
+        print("Downloading {:.2f} MB at {:.1f}%".format(size / 1e6, byteFrom / source.uploadSize * 100))
+
+        # the response body is allocated by requests, only its size is booked in the pool
+        with self.bufferPool.reserve(size):
+            firstBlock = byteFrom // source.chunkSize
+            count = math.ceil(size / source.chunkSize)
+            fileBytes = source.fetchBlocks(firstBlock, count)
 
-        fileBytes = None
-        with requests.Session() as s:
-            temp = "bytes={}-{}".format(byteFrom, byteTo)
-            s.headers.update({"range": temp})
-            response = s.get(url=url)
+            if len(fileBytes) != size:
+                raise ConnectionError("Expected {} bytes but got {}".format(size, len(fileBytes)))
 
-            fileBytes = response.content
+            fileToWriteTo = os.path.join(folderPath, "{:020d}.part".format(byteFrom))
 
-        #fileToWriteTo = folderPath + "\\" + str(partNumber) + ".part"
-        fileToWriteTo = os.path.join(folderPath, str(partNumber) + ".part")
+            with open(fileToWriteTo, 'wb') as file:
+                file.write(fileBytes)
 
-        with open(fileToWriteTo, 'wb') as file:
-            file.write(fileBytes)
 
+    def open_stream(self, handle, prefetch=4):
+        '''
+            Iterator over the decrypted content of the file in order (bytes of about 5 MB each),
+            upcoming ranges are prefetched in the background. Nothing is written to disk:
+                with account.open_stream(handle) as stream:
+                    for data in stream:
+                        output.write(data)
+        '''
+        source = RemoteFileSource(self, handle).open()
+        return RemoteFileStream(source, rangeBlocks=Opacity.STREAM_RANGE_BLOCKS, prefetch=prefetch)
+
+    def open_file(self, handle, readAhead=16, cacheBlocks=64):
+        '''
+            read only, seekable file object of the file which only fetches the blocks that are read, see RemoteFile.
+            Wrap it in io.BufferedReader for small reads
+        '''
+        return RemoteFile(RemoteFileSource(self, handle).open(), readAhead=readAhead, cacheBlocks=cacheBlocks)
+
+    def walkFiles(self, folder):
+        '''
+            yields (path, handle, size) of every file in the folder and its subfolders
+        '''
+        folders = [folder]
+        while len(folders) > 0:
+            current = folders.pop(0)
+            folderMetaData = self.getFolderData(current)["metadata"]
+            for name, _, size, handle in folderMetaData.fileSummaries():
+                if handle is not None:
+                    yield posixpath.join(current, name), handle, size
+            folders.extend(posixpath.join(current, subFolder.name) for subFolder in folderMetaData.folders)
+
+    def verify(self, target, workers=None):
+        '''
+            Checks that the file handle, all files of a folder path or of the whole account ("/") are intact:
+            every block is fetched and its GCM tag checked by decrypting it, nothing is written to disk.
+            Returns a VerificationReport
+        '''
+        report = VerificationReport(target)
+        if len(target) == 128 and not target.startswith("/"):
+            self.verifyFile(report, target, target)
+            return report.finish()
+
+        with ThreadPoolExecutor(max_workers=workers or Opacity.VERIFY_WORKERS) as pool:
+            futures = [pool.submit(self.verifyFile, report, path, handle) for path, handle, _ in self.walkFiles(target)]
+            for future in futures:
+                future.result()
+        return report.finish()
+
+    def verifyFile(self, report, path, handle):
+        start = time.time()
+        checked = 0
+        try:
+            source = RemoteFileSource(self, handle).open()
+            for firstBlock in range(0, source.blockCount, Opacity.VERIFY_RANGE_BLOCKS):
+                count = min(Opacity.VERIFY_RANGE_BLOCKS, source.blockCount - firstBlock)
+                byteFrom, byteTo = source.blockRange(firstBlock, count)
+                with self.bufferPool.reserve(byteTo - byteFrom + 1):
+                    data = source.fetch(byteFrom, byteTo)
+                    for index, block in enumerate(source.blocks(data)):
+                        try:
+                            source.decryptBlock(block)
+                        except Exception:
+                            report.add(path, handle, VerificationReport.CORRUPT,
+                                       "block {} failed the tag check".format(firstBlock + index),
+                                       checked, time.time() - start)
+                            return
+                        checked += len(block)
+        except IncompleteRangeError as e:
+            report.add(path, handle, VerificationReport.CORRUPT, str(e), checked, time.time() - start)
+            return
+        except FatalError as e:
+            # only a not found means the file is gone, e.g. a 403 doesn't say anything about it
+            status = VerificationReport.MISSING if e.status == 404 else VerificationReport.FAILED
+            report.add(path, handle, status, str(e), checked, time.time() - start)
+            return
+        except Exception as e:
+            report.add(path, handle, VerificationReport.FAILED, str(e), checked, time.time() - start)
+            return
+        report.add(path, handle, VerificationReport.OK, "", checked, time.time() - start)
 
     def rename(self, folder, handle, oldName, newName):
 
         if len(handle) == 128:
             # only rename the file and set metadata
-            metadata = self.getFolderData(folder)
-            for file in metadata["metadata"].files:
-                if file.versions[0].handle == handle:
-                    oldName = file.name
-                    file.name = newName + os.path.splitext(os.path.basename(oldName))[1]
-                    break
-            self.setMetadata(metadata)
+            self.metadataWriter.renameFile(folder, handle, newName, keepExtension=True).result()
             print("Successfully renamed {} into {}".format(oldName, newName))
-            pass
         elif len(handle) == 64:
             # create new metadata and for all subfolders also create new metadata
             new_folder_path = posixpath.join(folder, newName)
@@ -684,9 +1144,7 @@ class Opacity:
             return
 
         if len(metadata_from["metadata"].files) != 0:
-            metadata_to = self.getFolderData(folder_to)
-            metadata_to["metadata"].files = metadata_from["metadata"].files
-            self.setMetadata(metadata_to)
+            self.metadataWriter.addFiles(folder_to, list(metadata_from["metadata"].files)).result()
 
         for folder in metadata_from["metadata"].folders:
             old_folder_path = posixpath.join(folder_from, folder.name)
@@ -694,6 +1152,7 @@ class Opacity:
             _ = self.createFolder(new_folder_path)
             self.copyMetadata(old_folder_path, new_folder_path)
 
+    @tracer.traced("metadata/set")
     def setMetadata(self, metadata):
         keyString = metadata["keyString"]
 
@@ -714,15 +1173,14 @@ class Opacity:
         payload = self.signPayloadDict(metaReqDictJson)
         payloadJson = Helper.GetJson(payload)
 
-        with requests.Session() as s:
-            response = s.post(self._baseUrl + "metadata/set", data=payloadJson)
+        response = self._post("metadata/set", data=payloadJson)
 
-        folderMetaData = self.decryptMetaData(response, keyString)
+        folderMetaData = self.decryptMetaData(response, keyString, metadata.get("folder"), metadata["metadataKey"])
         metadata["metadata"] = folderMetaData
 
         return metadata
 
-    def decryptMetaData(self, metadataResponse, keyString):
+    def decryptMetaData(self, metadataResponse, keyString, folder=None, metaDataKey=None):
         resultMetaDataEncrypted = metadataResponse.content.decode("utf-8")
         resultMetaDataEncryptedJson = json.loads(resultMetaDataEncrypted)
         stringbytes = bytes(resultMetaDataEncryptedJson["metadata"], "utf-8")
@@ -730,42 +1188,29 @@ class Opacity:
 
         decryptedMetaData = AesGcm256.decrypt(stringDecoded, bytearray.fromhex(keyString))
         metaData = decryptedMetaData.decode("utf-8")
-        metaData = json.loads(metaData)
-
-        folderMetaData = FolderMetaData.ToObject(metaData)
+        self._cacheMetadata(folder, metaDataKey, keyString, metaData)
+        folderMetaData = FolderMetaData.FromString(metaData)
 
         return folderMetaData
 
-    def delete(self, folderPath, handle, skipGetMetadata=False, metadata=None, deleteFiles=True):
+    def delete(self, folderPath, handle, skipGetMetadata=False, metadata=None, deleteFiles=True, parentDeleted=False):
+        '''
+            parentDeleted is set for the content of a folder which gets deleted, its metadata isn't written anymore
+        '''
 
         if skipGetMetadata is False:
             metadata = self.getFolderData(folderPath)
 
         if len(handle) == 128:  # file
-            requestBody = dict()
-            requestBody["fileID"] = handle[:64]
-            rawPayload = Helper.GetJson(requestBody)
-
-            payload = self.signPayloadDict(rawPayload)
-            payloadJson = Helper.GetJson(payload)
-
-            with requests.Session() as s:
-                response = s.post(self._baseUrl + "delete", data=payloadJson)
-
-            response = response.content.decode()
-            # successful delete
-            if response == "{}":
-                folderMetaData = metadata["metadata"]
-                fileToDelete = [file for file in folderMetaData.files if file.versions[0].handle == handle][0]
-                folderMetaData.files = [file for file in folderMetaData.files if file.versions[0].handle != handle]
-                # metadata changes it files list because folderMetaData is a shallow copy of the metadata
-                self.setMetadata(metadata)
-                #print(Fore.GREEN, "Successfully deleted the file: {}".format(fileToDelete.name))
-                print("Successfully deleted the file: {}".format(fileToDelete.name))
-                return folderMetaData
-            else:  # file doesn't exist
-                #print(Fore.LIGHTRED_EX, "Error:\n{}".format(response))
-                print("Error:\n{}".format(response))
+            if not self.deleteFileData(handle):
+                return
+            names = [summary[0] for summary in metadata["metadata"].fileSummaries() if summary[3] == handle]
+            if not parentDeleted:
+                # concurrent deletes of the same folder end up in one metadata/set
+                metadata = self.metadataWriter.removeFiles(metadata["folder"], [handle]).result()
+            #print(Fore.GREEN, "Successfully deleted the file: {}".format(fileToDelete.name))
+            print("Successfully deleted the file: {}".format(names[0] if len(names) > 0 else handle))
+            return metadata["metadata"]
 
         elif len(handle) == 64:  # folder
             # delete subdirectories aswell as subfiles first
@@ -775,24 +1220,25 @@ class Opacity:
 
             print("Starting to delete {}".format(folderToDeletePath))
             folderToDeleteMetadata = self.getFolderData(folderToDeletePath)
-            folders = folderToDeleteMetadata["metadata"].folders
-            if len(folders) > 0:
-                for folder in folders:
-                    self.delete(folderToDeletePath, folder.handle, True, folderToDeleteMetadata, deleteFiles)
+            for folder in folderToDeleteMetadata["metadata"].folders:
+                self.delete(folderToDeletePath, folder.handle, True, folderToDeleteMetadata, deleteFiles,
+                            parentDeleted=True)
 
             if deleteFiles:
-                files = folderToDeleteMetadata["metadata"].files
-                if len(files) > 0:
-                    for file in files:
-                        self.delete("", file.versions[0].handle, True, folderToDeleteMetadata)
+                # the metadata of the folder is deleted below, so only the file data gets deleted
+                for summary in folderToDeleteMetadata["metadata"].fileSummaries():
+                    if summary[3] is not None:
+                        self.deleteFileData(summary[3])
 
             # delte the folder itself
             response = self.deleteMetaData(handle)
 
             response = json.loads(response.content.decode())
             if response["status"] == "metadata successfully deleted":
-                folderMetaData.folders = [folder for folder in folderMetaData.folders if folder.handle != handle]
-                response = self.setMetadata(metadata)
+                if self.cache is not None:
+                    self.cache.remove(folderToDeletePath)
+                if not parentDeleted:
+                    self.metadataWriter.removeFolders(metadata["folder"], [handle]).result()
                 #print(Fore.GREEN, "Finished deleting: {}".format(folderToDeletePath))
                 print("Finished deleting: {}".format(folderToDeletePath))
             else:
@@ -803,6 +1249,28 @@ class Opacity:
             #print(Fore.LIGHTRED_EX, "Handle hasn't the length of 64 or 128")
             print("Handle hasn't the length of 64 or 128")
 
+    def deleteFileData(self, handle):
+        '''
+            deletes the stored file without touching any folder metadata, returns False if that failed
+        '''
+        requestBody = dict()
+        requestBody["fileID"] = handle[:64]
+        rawPayload = Helper.GetJson(requestBody)
+
+        payload = self.signPayloadDict(rawPayload)
+        payloadJson = Helper.GetJson(payload)
+
+        response = self._post("delete", data=payloadJson)
+
+        response = response.content.decode()
+        # successful delete
+        if response == "{}":
+            return True
+        # file doesn't exist
+        #print(Fore.LIGHTRED_EX, "Error:\n{}".format(response))
+        print("Error:\n{}".format(response))
+        return False
+
     def deleteMetaData(self, handle):
         requestBody = dict()
         requestBody["timestamp"] = Helper.GetUnixMilliseconds()
@@ -812,8 +1280,7 @@ class Opacity:
         payload = self.signPayloadDict(rawPayload)
         payloadJson = Helper.GetJson(payload)
 
-        with requests.Session() as s:
-            return s.post(self._baseUrl + "metadata/delete", data=payloadJson)
+        return self._post("metadata/delete", data=payloadJson)
 
     def createMetadata(self, folder):
         dictionary = self.createMetadatakeyAndKeystring(folder=folder)
@@ -825,8 +1292,7 @@ class Opacity:
         payload = self.signPayloadDict(rawPayload)
         payloadJson = Helper.GetJson(payload)
 
-        with requests.Session() as s:
-            response = s.post(self._baseUrl + "metadata/create", data=payloadJson)
+        response = self._post("metadata/create", idempotent=False, data=payloadJson)
 
         if response.status_code == 403:
             print("The folder: {} already exists! -> Will use that folder instead".format(folder))
@@ -842,13 +1308,21 @@ class Opacity:
             self.setMetadata(dictionary)
             return {"metadataKey": dictionary["metadataKey"], "addFolder": True}
 
+    @tracer.traced("derive folder keys")
     def createMetadatakeyAndKeystring(self, folder):
-        folder = folder
+        if self.cache is not None:
+            keys = self.cache.getKeys(folder)
+            if keys is not None:
+                return {"metadataKey": keys["metadataKey"], "keyString": keys["keyString"], "folder": folder}
+
         folderKey = Helper.getFolderHDKey(self._masterKey, folder)
         metaDataKey = Helper.getMetaDataKey(folderKey)
         keyString = keccak.new(data=bytearray(folderKey.private_hex, "utf-8"), digest_bits=256).hexdigest()
 
-        return {"metadataKey": metaDataKey, "keyString": keyString}
+        if self.cache is not None:
+            self.cache.putKeys(folder, metaDataKey, keyString)
+
+        return {"metadataKey": metaDataKey, "keyString": keyString, "folder": folder}
 
 
     def move(self, fromFolder, item, toFolder):
@@ -856,7 +1330,6 @@ class Opacity:
             print("moving file")
 
             fromFolderMetadata = self.getFolderData(fromFolder)
-            toFolderMetadata = self.getFolderData(toFolder)
 
             toMoveMetadata = [metadata for metadata in fromFolderMetadata["metadata"].files if
                               metadata.versions[0].handle == item["handle"]]
@@ -864,12 +1337,9 @@ class Opacity:
                 raise FileNotFoundError("The specified folder doesn't exist on the path: '{}'".format(fromFolder))
             toMoveMetadata = toMoveMetadata[0]
 
-            fromFolderMetadata["metadata"].files = [metadata for metadata in fromFolderMetadata["metadata"].files if
-                                                    metadata.versions[0].handle != toMoveMetadata.versions[0].handle]
-            self.setMetadata(fromFolderMetadata)
-
-            toFolderMetadata["metadata"].files.append(toMoveMetadata)
-            self.setMetadata(toFolderMetadata)
+            # add first, if removing fails the file is listed twice instead of not at all
+            self.metadataWriter.addFiles(toFolder, [toMoveMetadata]).result()
+            self.metadataWriter.removeFiles(fromFolder, [item["handle"]]).result()
         elif len(item["handle"]) == 64:  # move folder
 
             new_folder_path = posixpath.join(toFolder, item["name"])
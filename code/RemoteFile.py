@@ -0,0 +1,300 @@
+import io
+import json
+import math
+import threading
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from AesGcm256 import AesGcm256
+from Constants import Constants
+from Helper import Helper
+from Retry import FatalError, checkResponse
+from Tracing import tracer
+
+
+class IncompleteRangeError(FatalError):
+    '''
+        the storage node answered a range request completely, but with less bytes than requested
+    '''
+    pass
+
+
+class RemoteFileSource:
+    '''
+        A file stored on opacity: resolves the handle to the download url and the file metadata
+        and fetches encrypted byte ranges through the session, retry policy and metrics of the account.
+        Every block of blockSize plaintext bytes is encrypted on its own and takes chunkSize
+        (blockSize + BLOCK_OVERHEAD) bytes on the wire, so block i starts at i * chunkSize.
+    '''
+
+    def __init__(self, account, handle):
+        if len(handle) != 128:
+            raise AttributeError("A file handle should have the length of 128")
+        self.account = account
+        self.handle = handle
+        self.fileId = handle[:64]
+        self.key = bytearray.fromhex(handle[64:])
+        self.url = None
+        self.metaData = None
+        self.name = None
+        self.size = None
+        self.blockSize = None
+        self.chunkSize = None
+        self.uploadSize = None
+        self.blockCount = None
+
+    def open(self):
+        account = self.account
+        payloadJson = json.dumps({"fileID": self.fileId})
+
+        def resolve():
+            response = account._post("download", data=payloadJson)
+            url = json.loads(checkResponse(response, "download").content.decode())["fileDownloadUrl"]
+            response = account._session().get(url + "/metadata")
+            return url, checkResponse(response, "file metadata").content
+
+        self.url, encryptedMetaData = account.retryPolicy.run(resolve)
+
+        self.metaData = json.loads(AesGcm256.decrypt(encryptedMetaData, self.key))
+        self.name = self.metaData["name"]
+        self.size = self.metaData["size"]
+        self.blockSize = self.metaData["p"]["blockSize"]
+        self.chunkSize = self.blockSize + Constants.BLOCK_OVERHEAD
+        self.uploadSize = Helper.GetUploadSize(self.size)
+        self.blockCount = math.ceil(self.size / self.blockSize)
+        return self
+
+    def blockRange(self, firstBlock, count):
+        '''
+            inclusive encrypted byte range of count blocks starting at firstBlock
+        '''
+        byteFrom = firstBlock * self.chunkSize
+        byteTo = min((firstBlock + count) * self.chunkSize, self.uploadSize) - 1
+        return byteFrom, byteTo
+
+    def fetch(self, byteFrom, byteTo):
+        '''
+            encrypted bytes byteFrom-byteTo (inclusive), retried with the retry policy of the account
+        '''
+        account = self.account
+        size = byteTo - byteFrom + 1
+
+        def get():
+            start = time.time()
+            try:
+                with tracer.span("range request", size=size):
+                    response = account._session().get(self.url + "/file",
+                                                       headers={"range": "bytes={}-{}".format(byteFrom, byteTo)})
+                checkResponse(response, "download of the bytes {}-{}".format(byteFrom, byteTo))
+            except Exception:
+                account.metrics.record("download", size, time.time() - start, ok=False)
+                raise
+            account.metrics.record("download", size, time.time() - start)
+            if len(response.content) != size:
+                raise IncompleteRangeError("Expected {} bytes at {} but got {}".format(
+                    size, byteFrom, len(response.content)))
+            return response.content
+
+        return account.retryPolicy.run(get)
+
+    def fetchBlocks(self, firstBlock, count):
+        '''
+            the encrypted blocks firstBlock to firstBlock + count - 1 joined together.
+            Blocks in the BlockCache of the account aren't fetched again, the missing ones are fetched
+            with a single range request and added to the cache
+        '''
+        cache = self.account.blockCache
+        if cache is None:
+            return self.fetch(*self.blockRange(firstBlock, count))
+
+        count = min(count, self.blockCount - firstBlock)
+        blocks = [cache.get(self.fileId, index) for index in range(firstBlock, firstBlock + count)]
+        missing = [offset for offset, block in enumerate(blocks) if block is None]
+        if len(missing) > 0:
+            data = self.fetch(*self.blockRange(firstBlock + missing[0], missing[-1] - missing[0] + 1))
+            for offset, block in enumerate(self.blocks(data), start=missing[0]):
+                if blocks[offset] is None:
+                    blocks[offset] = block
+                    cache.put(self.fileId, firstBlock + offset, block)
+        return b"".join(blocks)
+
+    def blocks(self, data):
+        '''
+            the encrypted blocks of fetched data which starts at a block boundary
+        '''
+        view = memoryview(data)
+        for start in range(0, len(view), self.chunkSize):
+            yield view[start:start + self.chunkSize]
+
+    def decryptBlock(self, block):
+        return AesGcm256.decrypt(block, self.key)
+
+
+class RemoteFileStream:
+    '''
+        Iterates over the decrypted content of a remote file in order, one range of rangeBlocks blocks
+        (bytes) at a time. The next prefetch ranges are fetched and decrypted in the background
+        while the current one is consumed, so at most prefetch + 1 ranges are held in memory.
+    '''
+
+    def __init__(self, source, rangeBlocks=80, prefetch=4):
+        self.source = source
+        self.rangeBlocks = rangeBlocks
+        self.prefetch = prefetch
+        self._nextBlock = 0
+        self._pending = deque()
+        self._pool = ThreadPoolExecutor(max_workers=prefetch) if source.blockCount > 0 else None
+
+    def _fetchRange(self, firstBlock, count):
+        byteFrom, byteTo = self.source.blockRange(firstBlock, count)
+        # the response body is allocated by requests, only its size is booked in the pool of the account
+        with self.source.account.bufferPool.reserve(byteTo - byteFrom + 1):
+            data = self.source.fetchBlocks(firstBlock, count)
+            with tracer.span("decrypt range", blocks=count):
+                return b"".join(self.source.decryptBlock(block) for block in self.source.blocks(data))
+
+    def _fill(self):
+        while len(self._pending) < self.prefetch and self._nextBlock < self.source.blockCount:
+            count = min(self.rangeBlocks, self.source.blockCount - self._nextBlock)
+            self._pending.append(self._pool.submit(self._fetchRange, self._nextBlock, count))
+            self._nextBlock += count
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._pool is None:
+            raise StopIteration
+        self._fill()
+        if len(self._pending) == 0:
+            self.close()
+            raise StopIteration
+        future = self._pending.popleft()
+        try:
+            data = future.result()
+        except Exception:
+            self.close()
+            raise
+        self._fill()
+        return data
+
+    def close(self):
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class RemoteFile(io.RawIOBase):
+    '''
+        Read only, seekable file object of a remote file (read, readinto, seek, tell).
+        A read maps the plaintext offsets to the blocks covering them and fetches the missing ones
+        in a single range request, sequential reads fetch readAhead more blocks in the same request.
+        The last cacheBlocks decrypted blocks are kept, so e.g. reading the directory at the end of a ZIP
+        takes a couple of requests no matter how big the file is.
+    '''
+
+    def __init__(self, source, readAhead=16, cacheBlocks=64):
+        super().__init__()
+        self.source = source
+        self.readAhead = readAhead
+        self.cacheBlocks = max(cacheBlocks, 1)
+        self.requests = 0
+        self._position = 0
+        self._lastEnd = 0  # where the last read ended, to detect sequential reads
+        self._blocks = OrderedDict()  # block index -> decrypted bytes
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.source.name
+
+    @property
+    def size(self):
+        return self.source.size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.source.size + offset
+        else:
+            raise ValueError("invalid whence {}".format(whence))
+        if position < 0:
+            raise ValueError("negative seek position {}".format(position))
+        self._position = position
+        return position
+
+    def readinto(self, buffer):
+        with self._lock:
+            view = memoryview(buffer).cast("B")
+            position = self._position
+            amount = max(min(len(view), self.source.size - position), 0)
+            if amount == 0:
+                return 0
+
+            blockSize = self.source.blockSize
+            firstBlock = position // blockSize
+            lastBlock = (position + amount - 1) // blockSize
+            self._load(firstBlock, lastBlock, sequential=position == self._lastEnd)
+
+            written = 0
+            for index in range(firstBlock, lastBlock + 1):
+                block = self._blocks[index]
+                start = position + written - index * blockSize
+                length = min(len(block) - start, amount - written)
+                view[written:written + length] = block[start:start + length]
+                written += length
+
+            self._position = position + written
+            self._lastEnd = self._position
+            return written
+
+    def _load(self, firstBlock, lastBlock, sequential):
+        missing = [index for index in range(firstBlock, lastBlock + 1) if index not in self._blocks]
+        for index in range(firstBlock, lastBlock + 1):
+            if index in self._blocks:
+                self._blocks.move_to_end(index)
+        if len(missing) == 0:
+            return
+
+        fetchFrom = missing[0]
+        fetchTo = missing[-1]
+        if sequential:
+            fetchTo = min(fetchTo + self.readAhead, self.source.blockCount - 1)
+        # keeps what this read needs even if the cache is smaller
+        fetchTo = max(min(fetchTo, fetchFrom + self.cacheBlocks - 1), missing[-1])
+
+        byteFrom, byteTo = self.source.blockRange(fetchFrom, fetchTo - fetchFrom + 1)
+        with self.source.account.bufferPool.reserve(byteTo - byteFrom + 1):
+            data = self.source.fetchBlocks(fetchFrom, fetchTo - fetchFrom + 1)
+            self.requests += 1
+            for offset, block in enumerate(self.source.blocks(data)):
+                self._blocks[fetchFrom + offset] = self.source.decryptBlock(block)
+                self._blocks.move_to_end(fetchFrom + offset)
+
+        needed = set(range(firstBlock, lastBlock + 1))
+        while len(self._blocks) > self.cacheBlocks:
+            oldest = next(iter(self._blocks))
+            if oldest in needed:
+                break
+            del self._blocks[oldest]
@@ -0,0 +1,120 @@
+import random
+import threading
+import time
+from LazyModule import LazyModule
+
+requests = LazyModule("requests")
+urllib3 = LazyModule("urllib3")
+
+
+class RetryableError(Exception):
+    '''
+        the request failed but might succeed when it's sent again (timeouts, 5xx, 429, dropped connections)
+    '''
+    pass
+
+
+class FatalError(Exception):
+    '''
+        the request failed and sending it again won't help (4xx, unreadable source file, ...),
+        status is the http status of the answer if there was one
+    '''
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def checkResponse(response, action):
+    '''
+        raises a RetryableError or FatalError if the response isn't successful
+    '''
+    if 200 <= response.status_code < 300:
+        return response
+    message = "{} failed with status {}: {}".format(action, response.status_code, response.content[:200])
+    if response.status_code in (408, 429) or response.status_code >= 500:
+        raise RetryableError(message)
+    raise FatalError(message, response.status_code)
+
+
+def classify(error):
+    '''
+        returns True if the error is worth another try
+    '''
+    if isinstance(error, RetryableError):
+        return True
+    if isinstance(error, FatalError):
+        return False
+    exceptions = requests.exceptions
+    return isinstance(error, (exceptions.ConnectionError, exceptions.Timeout, exceptions.ChunkedEncodingError))
+
+
+def notSent(error):
+    '''
+        returns True if the request provably never reached the server (connection refused, connect timeout),
+        the only errors after which a request which isn't idempotent may be sent again
+    '''
+    exceptions = requests.exceptions
+    if isinstance(error, exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, exceptions.ConnectionError) or len(error.args) == 0:
+        return False
+    reason = getattr(error.args[0], "reason", error.args[0])  # requests wraps urllib3's MaxRetryError
+    return isinstance(reason, (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError))
+
+
+class RetryBudget:
+    '''
+        the amount of retries all requests of one operation (e.g. one file upload) may use together
+    '''
+
+    def __init__(self, retries):
+        self.remaining = retries
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self.remaining is not None:
+                if self.remaining <= 0:
+                    return False
+                self.remaining -= 1
+            self.used += 1
+            return True
+
+
+class RetryPolicy:
+    '''
+        Retries retryable errors with exponential backoff and full jitter:
+        before the nth retry it waits a random time between 0 and min(maxDelay, baseDelay * 2^n).
+        Every retry is taken from the budget of the operation, fatal errors are raised right away.
+    '''
+
+    def __init__(self, maxAttempts=5, baseDelay=0.5, maxDelay=30.0, budget=200, statusRounds=5):
+        self.maxAttempts = maxAttempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.budget = budget
+        self.statusRounds = statusRounds  # upload-status checks followed by a re-upload of the missing parts
+
+    def newBudget(self):
+        return RetryBudget(self.budget)
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.maxDelay, self.baseDelay * (2 ** attempt)))
+
+    def run(self, function, *args, budget=None, retryIf=classify, **kwargs):
+        '''
+            retryIf decides which errors get another try, e.g. notSent for requests which aren't idempotent
+        '''
+        attempt = 0
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                if not retryIf(e):
+                    raise
+                if attempt >= self.maxAttempts or (budget is not None and not budget.take()):
+                    raise RetryableError("Giving up after {} attempts: {}".format(attempt, e))
+                time.sleep(self.delay(attempt))
@@ -0,0 +1,110 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from BlockCache import BlockCache
+from BrokerPool import BrokerPool
+from BufferPool import BufferPool
+from Constants import Constants
+from LazyModule import LazyModule
+
+requests = LazyModule("requests")
+
+
+class SharedResources:
+    '''
+        What all Opacity accounts of a process share: the keep-alive sessions (one per thread), the worker
+        threads of the part uploads and range downloads, the buffer memory budget, the broker pools and block caches.
+        A process serving many accounts keeps a bounded number of threads, connections and buffers this way.
+        Every account uses SharedResources.default() unless it gets its own.
+    '''
+    _default = None
+    _defaultLock = threading.Lock()
+
+    def __init__(self, workers=64, bufferBudget=Constants.BUFFER_POOL_BUDGET):
+        self.workers = workers
+        self.bufferPool = BufferPool(bufferBudget)
+        self._sessions = threading.local()
+        self._executor = None
+        self._brokerPools = dict()  # tuple of urls -> BrokerPool
+        self._blockCaches = dict()  # directory -> BlockCache
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def default():
+        if SharedResources._default is None:
+            with SharedResources._defaultLock:
+                if SharedResources._default is None:
+                    SharedResources._default = SharedResources()
+        return SharedResources._default
+
+    def session(self):
+        '''
+            keep-alive session of the current thread
+        '''
+        session = getattr(self._sessions, "session", None)
+        if session is None:
+            session = requests.Session()
+            self._sessions.session = session
+        return session
+
+    def brokerPool(self, urls):
+        '''
+            the BrokerPool of these urls, shared by every account using them
+        '''
+        key = tuple(urls)
+        with self._lock:
+            if key not in self._brokerPools:
+                self._brokerPools[key] = BrokerPool(list(urls))
+            return self._brokerPools[key]
+
+    def blockCache(self, directory=None):
+        '''
+            the BlockCache of the directory (default BlockCache.DEFAULT_DIRECTORY), shared by every account using it
+        '''
+        directory = os.path.abspath(os.path.expanduser(directory or BlockCache.DEFAULT_DIRECTORY))
+        with self._lock:
+            if directory not in self._blockCaches:
+                self._blockCaches[directory] = BlockCache(directory)
+            return self._blockCaches[directory]
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="opacity")
+        return self._executor
+
+    def map(self, function, items, workers):
+        '''
+            function(item) for every item with up to workers of them running at once, the results in the
+            order of the items. The calling thread works on the items as well, so a call from inside the
+            executor (or with every worker busy) still makes progress. The helpers run in a copy of the
+            context of the caller (e.g. its TransferProgress).
+        '''
+        items = list(items)
+        results = [None] * len(items)
+        pending = iter(enumerate(items))
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                with lock:
+                    entry = next(pending, None)
+                if entry is None:
+                    return
+                results[entry[0]] = function(entry[1])
+
+        helpers = [self.executor.submit(contextvars.copy_context().run, work)
+                   for _ in range(min(workers, len(items)) - 1)]
+        try:
+            work()
+        finally:
+            # helpers which didn't start yet aren't needed anymore, waiting for them could deadlock
+            helpers = [helper for helper in helpers if not helper.cancel()]
+            for helper in helpers:
+                helper.exception()
+        for helper in helpers:
+            helper.result()
+        return results
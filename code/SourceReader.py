@@ -0,0 +1,206 @@
+import mmap
+import os
+import tempfile
+import threading
+
+
+class SourceReader:
+    '''
+        Hands out the parts of a local file to the upload workers.
+        The file gets memory mapped once per upload and part() returns memoryview slices of the mapping,
+        so the parts aren't copied and the page cache does the read-ahead.
+        Files which can't be mapped (pipes, network drives without mmap support, bigger than the address space)
+        are read into the buffer passed to part() instead.
+    '''
+
+    def __init__(self, path, size, useMmap=True):
+        self.path = path
+        self.size = size
+        self._file = None
+        self._map = None
+        self._view = None
+
+        if useMmap and size > 0:
+            try:
+                self._file = open(path, "rb")
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                if len(self._map) < size:
+                    raise ValueError("{} is smaller than expected".format(path))
+                if hasattr(self._map, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                    self._map.madvise(mmap.MADV_SEQUENTIAL)
+                self._view = memoryview(self._map)
+            except (OSError, ValueError, OverflowError):
+                self.close()
+
+    @property
+    def mapped(self):
+        return self._view is not None
+
+    def part(self, index, partSize, buffer=None):
+        '''
+            memoryview of the bytes of that part, buffer is only used (and needed) if the file isn't mapped
+        '''
+        start = min(index * partSize, self.size)
+        end = min(start + partSize, self.size)
+        if self.mapped:
+            return self._view[start:end]
+
+        view = memoryview(buffer)[:end - start]
+        with open(self.path, "rb", buffering=0) as file:
+            file.seek(start)
+            read = 0
+            while read < len(view):
+                amount = file.readinto(view[read:])
+                if not amount:
+                    raise EOFError("{} ended before the end of part {}".format(self.path, index + 1))
+                read += amount
+        return view
+
+    def close(self):
+        if self._view is not None:
+            try:
+                self._view.release()
+            except BufferError:
+                # slices are still in use, the mapping gets closed once they're garbage collected
+                pass
+            self._view = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def open(path, size=None):
+        return SourceReader(path, os.path.getsize(path) if size is None else size)
+
+
+class MemorySourceReader:
+    '''
+        SourceReader for content which is already in memory (bytes, bytearray, memoryview),
+        part() returns slices of it without copying
+    '''
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast("B")
+        self.size = len(self._view)
+        self.path = "<memory>"
+
+    @property
+    def mapped(self):
+        return True
+
+    def part(self, index, partSize, buffer=None):
+        start = min(index * partSize, self.size)
+        return self._view[start:min(start + partSize, self.size)]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class StreamSourceReader:
+    '''
+        SourceReader for a file-like object. Seekable objects are read in place, starting at their current position,
+        without a size they are read up to their end (measured by seeking there). Everything else is first copied into a temporary file which
+        stays in memory up to spoolSize bytes and moves to disk beyond that, so the parts can be read
+        in any order and read again for the re-upload of missing parts.
+    '''
+    SPOOL_SIZE = 64 * 1024 * 1024
+    COPY_SIZE = 1024 * 1024
+
+    def __init__(self, fileObject, size=None, spoolSize=SPOOL_SIZE):
+        self.path = getattr(fileObject, "name", "<stream>")
+        self._lock = threading.Lock()
+        self._spool = None
+        seekable = getattr(fileObject, "seekable", lambda: False)()
+        if seekable and size is None:
+            size = StreamSourceReader._remaining(fileObject)
+            seekable = size is not None
+        if size is not None and seekable:
+            self._file = fileObject
+            self._start = fileObject.tell()
+            self.size = size
+        else:
+            self._spool = tempfile.SpooledTemporaryFile(max_size=spoolSize)
+            self.size = 0
+            while size is None or self.size < size:
+                data = fileObject.read(StreamSourceReader.COPY_SIZE if size is None
+                                       else min(StreamSourceReader.COPY_SIZE, size - self.size))
+                if not data:
+                    break
+                self._spool.write(data)
+                self.size += len(data)
+            if size is not None and self.size < size:
+                self.close()
+                raise EOFError("{} ended after {} of {} bytes".format(self.path, self.size, size))
+            self._file = self._spool
+            self._start = 0
+
+    @staticmethod
+    def _remaining(fileObject):
+        '''
+            bytes from the current position to the end, None if seeking fails after all
+        '''
+        try:
+            position = fileObject.tell()
+            end = fileObject.seek(0, os.SEEK_END)
+            fileObject.seek(position)
+        except (OSError, ValueError):
+            return None
+        return max(end - position, 0)
+
+    @property
+    def mapped(self):
+        return False
+
+    def part(self, index, partSize, buffer=None):
+        '''
+            memoryview of the bytes of that part, read into buffer
+        '''
+        start = min(index * partSize, self.size)
+        end = min(start + partSize, self.size)
+        view = memoryview(buffer)[:end - start]
+        with self._lock:
+            self._file.seek(self._start + start)
+            read = 0
+            while read < len(view):
+                amount = self._readinto(view[read:])
+                if not amount:
+                    raise EOFError("{} ended before the end of part {}".format(self.path, index + 1))
+                read += amount
+        return view
+
+    def _readinto(self, view):
+        if hasattr(self._file, "readinto"):
+            return self._file.readinto(view)
+        data = self._file.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        # the file object of the caller stays open, only the spool belongs to the reader
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,123 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+
+class _NoSpan:
+    '''
+        returned by span() while tracing is disabled, entering and leaving it does nothing
+    '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args):
+        self.tracer._record(self.name, self.start, time.perf_counter_ns() - self.start, self.args)
+        return False
+
+
+class Tracer:
+    '''
+        Collects nested timing spans of all threads and exports them in the Chrome trace event format,
+        which chrome://tracing and https://ui.perfetto.dev open. While disabled span() returns a shared
+        object which does nothing, so instrumented code only pays for one function call.
+            with tracer.span("upload part", index=3):
+                ...
+        Set OPACITY_TRACE=trace.json to trace a whole run, it gets exported when python exits.
+    '''
+    _NO_SPAN = _NoSpan()
+
+    def __init__(self):
+        self.enabled = False
+        self._events = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter_ns()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self._lock:
+            self._events = []
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return Tracer._NO_SPAN
+        return _Span(self, name, args)
+
+    def traced(self, name):
+        '''
+            decorator which puts every call of the function into a span
+        '''
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Span(self, name, None):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def now(self):
+        return time.perf_counter_ns()
+
+    def complete(self, name, start, **args):
+        '''
+            records a span from start (a value of now()) until now, for spans which don't fit into a with block
+        '''
+        if self.enabled:
+            self._record(name, start, time.perf_counter_ns() - start, args)
+
+    def _record(self, name, start, duration, args):
+        event = {"name": name, "ph": "X", "ts": (start - self._origin) / 1000, "dur": duration / 1000,
+                 "pid": os.getpid(), "tid": threading.get_ident()}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self._events.append(event)
+
+    def events(self):
+        with self._lock:
+            events = list(self._events)
+        threadNames = {thread.ident: thread.name for thread in threading.enumerate()}
+        metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                     "args": {"name": threadNames.get(tid, str(tid))}}
+                    for tid in set(event["tid"] for event in events)]
+        return metadata + events
+
+    def export(self, path):
+        with open(path, "w") as traceFile:
+            json.dump({"traceEvents": self.events(), "displayTimeUnit": "ms"}, traceFile)
+        return path
+
+
+tracer = Tracer()
+
+if os.environ.get("OPACITY_TRACE"):
+    tracer.enable()
+    atexit.register(tracer.export, os.environ["OPACITY_TRACE"])
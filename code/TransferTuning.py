@@ -0,0 +1,255 @@
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from Constants import Constants
+
+
+class TransferMetrics:
+    '''
+        Thread safe record of the latest http transfers (kind, bytes, seconds, success)
+        to report throughput and to tune the transfer sizes.
+    '''
+
+    def __init__(self, keep=1000):
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=keep)
+
+    def record(self, kind, size, seconds, ok=True):
+        with self._lock:
+            self._records.append((kind, size, seconds, ok, time.time()))
+        progress = TransferProgress.current()
+        if ok and progress is not None:
+            progress.add(size)
+
+    def records(self, kind=None):
+        with self._lock:
+            return [record for record in self._records if kind is None or record[0] == kind]
+
+    def throughput(self, kind, last=20):
+        '''
+            bytes per second of the last successful transfers of that kind, None without any
+        '''
+        records = [record for record in self.records(kind) if record[3]][-last:]
+        seconds = sum(record[2] for record in records)
+        if len(records) == 0 or seconds <= 0:
+            return None
+        return sum(record[1] for record in records) / seconds
+
+    def summary(self, kind, since=0):
+        records = [record for record in self.records(kind) if record[4] >= since]
+        successful = [record for record in records if record[3]]
+        sizes = [record[1] for record in successful]
+        seconds = sum(record[2] for record in successful)
+        return {
+            "requests": len(records),
+            "failed": len(records) - len(successful),
+            "bytes": sum(sizes),
+            "minSize": min(sizes) if sizes else 0,
+            "maxSize": max(sizes) if sizes else 0,
+            "throughput": sum(sizes) / seconds if seconds > 0 else 0
+        }
+
+    @staticmethod
+    def formatSummary(summary):
+        return "{} requests ({} failed), {:.1f} MB, request size {:.2f}-{:.2f} MB, {:.2f} MB/s per request".format(
+            summary["requests"], summary["failed"], summary["bytes"] / 1e6, summary["minSize"] / 1e6,
+            summary["maxSize"] / 1e6, summary["throughput"] / 1e6)
+
+
+class AdaptiveRangeSizer:
+    '''
+        Chooses the size of the next download range request.
+        The size is always a multiple of the encrypted block size (blockSize + BLOCK_OVERHEAD)
+        and aims for requests of about targetSeconds: it grows on fast links, shrinks on slow ones
+        and is halved after every failed request. It changes at most by a factor of 2 per request.
+    '''
+
+    def __init__(self, chunkSize, initialChunks=80, minChunks=4, maxChunks=1280, targetSeconds=3.0):
+        self.chunkSize = chunkSize
+        self.minChunks = minChunks
+        self.maxChunks = maxChunks
+        self.targetSeconds = targetSeconds
+        self._chunks = initialChunks
+        self._lock = threading.Lock()
+
+    def nextSize(self):
+        with self._lock:
+            return self._chunks * self.chunkSize
+
+    def report(self, size, seconds, ok=True):
+        with self._lock:
+            if not ok:
+                chunks = self._chunks // 2
+            elif seconds <= 0:
+                chunks = self._chunks * 2
+            else:
+                wanted = size / seconds * self.targetSeconds / self.chunkSize
+                chunks = int(min(max(wanted, self._chunks / 2), self._chunks * 2))
+            self._chunks = min(max(chunks, self.minChunks), self.maxChunks)
+
+
+class RangeQueue:
+    '''
+        Hands out the byte ranges of a file to the download workers, sized by the AdaptiveRangeSizer.
+        Failed ranges are put back in two halves (still block aligned) and handed out first.
+        Workers call done or retry for every range they got; next only returns None once all ranges are done.
+    '''
+
+    def __init__(self, totalSize, sizer, maxRetries=3):
+        self.totalSize = totalSize
+        self.sizer = sizer
+        self.maxRetries = maxRetries
+        self.error = None
+        self._next = 0
+        self._inFlight = 0
+        self._retries = []  # List[(byteFrom, byteTo, attempt)]
+        self._condition = threading.Condition()
+
+    def next(self):
+        '''
+            returns (byteFrom, byteTo, attempt) with an inclusive byteTo, or None if everything is downloaded
+        '''
+        with self._condition:
+            while True:
+                if self.error is not None:
+                    return None
+                if len(self._retries) > 0:
+                    self._inFlight += 1
+                    return self._retries.pop(0)
+                if self._next < self.totalSize:
+                    byteFrom = self._next
+                    byteTo = min(byteFrom + self.sizer.nextSize(), self.totalSize) - 1
+                    self._next = byteTo + 1
+                    self._inFlight += 1
+                    return byteFrom, byteTo, 0
+                if self._inFlight == 0:
+                    return None
+                self._condition.wait()
+
+    def done(self):
+        with self._condition:
+            self._inFlight -= 1
+            self._condition.notify_all()
+
+    def retry(self, byteFrom, byteTo, attempt):
+        chunkSize = self.sizer.chunkSize
+        chunks = (byteTo - byteFrom + chunkSize) // chunkSize
+        with self._condition:
+            self._inFlight -= 1
+            if attempt + 1 > self.maxRetries:
+                self.error = ConnectionError("Failed to download the bytes {}-{} {} times".format(
+                    byteFrom, byteTo, attempt + 1))
+            elif chunks >= 2:
+                middle = byteFrom + (chunks // 2) * chunkSize
+                self._retries.append((byteFrom, middle - 1, attempt + 1))
+                self._retries.append((middle, byteTo, attempt + 1))
+            else:
+                self._retries.append((byteFrom, byteTo, attempt + 1))
+            self._condition.notify_all()
+
+
+class TransferProgress:
+    '''
+        The bytes one job transferred so far. Inside "with progress.activate():" every successful transfer
+        recorded by TransferMetrics counts for it, also the ones of worker threads started through
+        SharedResources.map, since the progress is a context variable.
+    '''
+    _current = contextvars.ContextVar("transferProgress", default=None)
+
+    def __init__(self, total=None):
+        self.total = total
+        self.bytes = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def current():
+        return TransferProgress._current.get()
+
+    @contextmanager
+    def activate(self):
+        token = TransferProgress._current.set(self)
+        try:
+            yield self
+        finally:
+            TransferProgress._current.reset(token)
+
+    def add(self, size):
+        with self._lock:
+            self.bytes += size
+            self.requests += 1
+
+    def toDict(self):
+        with self._lock:
+            return {"bytes": self.bytes, "total": self.total, "requests": self.requests,
+                    "fraction": min(self.bytes / self.total, 1.0) if self.total else None}
+
+
+class PartSizePolicy:
+    '''
+        Picks the part size of an upload. It gets stored in the file metadata (p.partSize),
+        so every file can have its own. The part size aims for parts taking about targetSeconds
+        at the observed upload throughput per request (default part size without observations)
+        and is reduced so that big enough files are split into at least one part per worker.
+        It always stays a multiple of the block size between minPartSize and maxPartSize.
+        Files which fit into one part keep the default part size, since GetEndIndex would add
+        an empty part otherwise.
+    '''
+
+    def __init__(self, blockSize=Constants.DEFAULT_BLOCK_SIZE, minPartSize=Constants.MIN_PART_SIZE,
+                 maxPartSize=Constants.MAX_PART_SIZE, defaultPartSize=Constants.UPLOAD_PART_SIZE,
+                 targetSeconds=5.0, workers=8, fixedPartSize=None):
+        self.blockSize = blockSize
+        self.minPartSize = minPartSize
+        self.maxPartSize = maxPartSize
+        self.defaultPartSize = defaultPartSize
+        self.targetSeconds = targetSeconds
+        self.workers = workers
+        self.fixedPartSize = fixedPartSize
+
+    def choose(self, fileSize, throughput=None):
+        if self.fixedPartSize is not None:
+            return self.fixedPartSize
+
+        blocks = math.ceil(fileSize / self.blockSize)
+        if blocks * self.blockSize <= self.defaultPartSize:
+            return self.defaultPartSize
+
+        if throughput is None:
+            partSize = self.defaultPartSize
+        else:
+            partSize = throughput * self.targetSeconds
+        partSize = min(partSize, math.ceil(blocks / self.workers) * self.blockSize)
+        partSize = min(max(partSize, self.minPartSize), self.maxPartSize)
+
+        return max(int(partSize // self.blockSize), 1) * self.blockSize
+
+
+class TransferThrottle:
+    '''
+        Limits shared by concurrent transfers: at most maxRequests range requests at once and
+        on average at most maxBandwidth bytes per second (None for no limit).
+        Every request waits in request(size) until it gets a slot and its share of the bandwidth.
+    '''
+
+    def __init__(self, maxRequests=8, maxBandwidth=None):
+        self.maxRequests = maxRequests
+        self.maxBandwidth = maxBandwidth
+        self._slots = threading.BoundedSemaphore(maxRequests)
+        self._lock = threading.Lock()
+        self._available = 0.0  # time.monotonic() at which the bandwidth for the next request is available
+
+    @contextmanager
+    def request(self, size):
+        with self._slots:
+            if self.maxBandwidth:
+                with self._lock:
+                    now = time.monotonic()
+                    start = max(now, self._available)
+                    self._available = start + size / self.maxBandwidth
+                if start > now:
+                    time.sleep(start - now)
+            yield
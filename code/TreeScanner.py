@@ -0,0 +1,160 @@
+import os
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from Constants import Constants
+from FileMetaData import FileMetaOptions
+from Helper import Helper
+
+
+class PlannedFile:
+    __slots__ = ("path", "folder", "name", "size", "partSize", "parts")
+
+    def __init__(self, path, folder, name, size, partSize, parts):
+        self.path = path
+        self.folder = folder
+        self.name = name
+        self.size = size
+        self.partSize = partSize
+        self.parts = parts
+
+    def toDict(self):
+        return {"path": self.path, "folder": self.folder, "name": self.name, "size": self.size,
+                "partSize": self.partSize, "parts": self.parts}
+
+
+class UploadPlan:
+    '''
+        Everything an upload of a local folder is going to do: the opacity folders to create (parents first),
+        the files with their part size and number of parts, and the files which are skipped.
+        Small files (up to smallFileSize) are uploaded with a single part, SMALL_FILE_WORKERS at once.
+    '''
+    DEFAULT_BANDWIDTH = 10 * 1000 * 1000  # bytes per second while nothing was uploaded yet
+    DEFAULT_REQUEST_SECONDS = 0.3
+
+    def __init__(self, root, target, smallFileSize):
+        self.root = root
+        self.target = target
+        self.smallFileSize = smallFileSize
+        self.folders = []  # opacity paths
+        self.files = []  # List[PlannedFile]
+        self.skipped = []  # (path, reason)
+
+    @property
+    def bytes(self):
+        return sum(file.size for file in self.files)
+
+    @property
+    def uploadBytes(self):
+        return sum(Helper.GetUploadSize(file.size) for file in self.files)
+
+    @property
+    def parts(self):
+        return sum(file.parts for file in self.files)
+
+    def smallFiles(self):
+        return [file for file in self.files if file.size <= self.smallFileSize]
+
+    def largeFiles(self):
+        return [file for file in self.files if file.size > self.smallFileSize]
+
+    def requests(self):
+        '''
+            estimated number of broker requests: metadata/create and metadata/set per new folder,
+            init-upload, the parts and upload-status per file, one metadata/set per large file
+            and per folder with small files
+        '''
+        smallFileFolders = set(file.folder for file in self.smallFiles())
+        return (2 * len(self.folders) + self.parts + 2 * len(self.files) + len(self.largeFiles())
+                + len(smallFileFolders))
+
+    def estimateSeconds(self, bandwidth=None, requestSeconds=None, smallFileWorkers=32):
+        '''
+            bandwidth is the upload throughput of all workers together in bytes per second
+        '''
+        bandwidth = bandwidth or UploadPlan.DEFAULT_BANDWIDTH
+        requestSeconds = requestSeconds or UploadPlan.DEFAULT_REQUEST_SECONDS
+        smallFiles = len(self.smallFiles())
+        # requests besides the parts; the ones of small files overlap smallFileWorkers times
+        overhead = (2 * len(self.folders) + 3 * len(self.largeFiles())
+                    + 2 * smallFiles / smallFileWorkers + len(set(file.folder for file in self.smallFiles())))
+        return self.uploadBytes / bandwidth + overhead * requestSeconds
+
+    def summary(self, seconds=None):
+        text = "{} folders, {} files ({} small), {:.1f} MB in {} parts, about {} requests".format(
+            len(self.folders), len(self.files), len(self.smallFiles()), self.bytes / 1e6, self.parts, self.requests())
+        if len(self.skipped) > 0:
+            text += ", {} skipped".format(len(self.skipped))
+        if seconds is not None:
+            text += ", ETA {:.0f} s".format(seconds)
+        return text
+
+    def toDict(self, seconds=None):
+        return {"root": self.root, "target": self.target, "folders": self.folders,
+                "files": [file.toDict() for file in self.files],
+                "skipped": [{"path": path, "reason": reason} for path, reason in self.skipped],
+                "bytes": self.bytes, "uploadBytes": self.uploadBytes, "parts": self.parts,
+                "requests": self.requests(), "seconds": seconds}
+
+
+class TreeScanner:
+    '''
+        Walks a local folder with os.scandir, the subfolders of every level are scanned in parallel,
+        and returns the UploadPlan of uploading it into an opacity folder.
+        The part sizes come from the PartSizePolicy of the uploader, so the plan matches the upload.
+    '''
+
+    def __init__(self, partSizePolicy, throughput=None, smallFileSize=1024 * 1024, workers=8):
+        self.partSizePolicy = partSizePolicy
+        self.throughput = throughput
+        self.smallFileSize = smallFileSize
+        self.workers = workers
+
+    def scan(self, localPath, uploadToFolder):
+        localPath = os.path.normpath(localPath)
+        plan = UploadPlan(localPath, uploadToFolder, self.smallFileSize)
+        if not os.path.isdir(localPath):
+            self._addFile(plan, localPath, uploadToFolder, os.path.getsize(localPath))
+            return plan
+
+        level = [(localPath, posixpath.join(uploadToFolder, os.path.basename(localPath)))]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while len(level) > 0:
+                nextLevel = []
+                for (_, folder), (files, subfolders, errors) in zip(level, pool.map(TreeScanner._scanFolder, level)):
+                    plan.folders.append(folder)
+                    plan.skipped.extend(errors)
+                    for filePath, size in files:
+                        self._addFile(plan, filePath, folder, size)
+                    nextLevel.extend(subfolders)
+                level = nextLevel
+        return plan
+
+    @staticmethod
+    def _scanFolder(entry):
+        path, folder = entry
+        files, subfolders, errors = [], [], []
+        try:
+            with os.scandir(path) as iterator:
+                entries = sorted(iterator, key=lambda item: item.name)
+        except OSError as e:
+            return files, subfolders, [(path, str(e))]
+        for item in entries:
+            try:
+                if item.is_dir():
+                    subfolders.append((item.path, posixpath.join(folder, item.name)))
+                elif item.is_file():
+                    files.append((item.path, item.stat().st_size))
+            except OSError as e:
+                errors.append((item.path, str(e)))
+        return files, subfolders, errors
+
+    def _addFile(self, plan, path, folder, size):
+        if size == 0:
+            plan.skipped.append((path, "the filesize is equal to 0"))
+            return
+        if size <= self.smallFileSize:
+            partSize = Constants.UPLOAD_PART_SIZE
+        else:
+            partSize = self.partSizePolicy.choose(size, self.throughput)
+        parts = Helper.GetEndIndex(Helper.GetUploadSize(size), FileMetaOptions(partSize))
+        plan.files.append(PlannedFile(path, folder, os.path.basename(path), size, partSize, parts))
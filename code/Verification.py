@@ -0,0 +1,50 @@
+import threading
+import time
+
+
+class VerificationReport:
+    '''
+        Results of Opacity.verify, one entry per file:
+        {"path", "handle", "status", "detail", "bytes", "seconds"}
+    '''
+    OK = "ok"
+    CORRUPT = "corrupt"  # a block failed the GCM tag check or the file is shorter than its metadata says
+    MISSING = "missing"  # opacity doesn't know the file handle anymore
+    FAILED = "failed"  # couldn't be checked, e.g. the connection kept failing
+
+    def __init__(self, target):
+        self.target = target
+        self.results = []
+        self.started = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def add(self, path, handle, status, detail="", size=0, seconds=0.0):
+        with self._lock:
+            self.results.append({"path": path, "handle": handle, "status": status, "detail": detail,
+                                 "bytes": size, "seconds": round(seconds, 3)})
+
+    def finish(self):
+        self.finished = time.time()
+        return self
+
+    def count(self, status):
+        return sum(1 for result in self.results if result["status"] == status)
+
+    def problems(self):
+        return [result for result in self.results if result["status"] != VerificationReport.OK]
+
+    @property
+    def ok(self):
+        return len(self.problems()) == 0
+
+    def summary(self):
+        seconds = (self.finished or time.time()) - self.started
+        return "Verified {} files ({:.1f} MB) of {} in {:.1f} seconds: {} ok, {} corrupt, {} missing, {} failed".format(
+            len(self.results), sum(result["bytes"] for result in self.results) / 1e6, self.target, seconds,
+            self.count(VerificationReport.OK), self.count(VerificationReport.CORRUPT),
+            self.count(VerificationReport.MISSING), self.count(VerificationReport.FAILED))
+
+    def toDict(self):
+        return {"target": self.target, "started": self.started, "finished": self.finished,
+                "ok": self.ok, "results": self.results}
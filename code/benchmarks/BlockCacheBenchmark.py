@@ -0,0 +1,73 @@
+'''
+    Reads a file twice through "OpacityCLI.py --block-cache <directory> cat" against the LocalBroker,
+    the way a user enables the BlockCache. The second run must get its blocks from the cache:
+    same content, no range requests to the storage node.
+
+    usage: python benchmarks/BlockCacheBenchmark.py [--size 20e6] [--latency 0.02] [--bandwidth 50e6]
+'''
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CODE_DIR)
+
+import Opactiy
+from LocalBroker import LocalBroker, randomHandle
+
+
+def cat(broker, handle, fileHandle, directory, home):
+    environment = dict(os.environ, OPACITY_HANDLE=handle, OPACITY_BROKERS=broker.baseUrl, HOME=home,
+                       USERPROFILE=home)
+    environment.pop("OPACITY_BLOCK_CACHE", None)
+    before = broker.state.requests
+    start = time.time()
+    result = subprocess.run([sys.executable, "OpacityCLI.py", "--block-cache", directory, "cat", fileHandle],
+                            cwd=CODE_DIR, env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError("cat failed:\n{}".format(result.stderr.decode(errors="replace")))
+    return result.stdout, time.time() - start, broker.state.requests - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description="block cache through the cli")
+    parser.add_argument("--size", type=float, default=20e6, help="bytes of the file")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every request")
+    parser.add_argument("--bandwidth", type=float, default=50e6, help="bytes per second of every request")
+    args = parser.parse_args()
+
+    broker = LocalBroker(latency=args.latency, bandwidth=args.bandwidth).start()
+    handle = randomHandle()
+    account = Opactiy.Opacity(handle, fetchStatus=False, useCache=False, brokers=[broker.baseUrl])
+    account.createMetadata("/")
+    content = os.urandom(int(args.size))
+    if not account.uploadData(content, "cached.bin", "/"):
+        raise AssertionError("upload failed")
+    fileHandle = account.getFolderData("/")["metadata"].fileSummaries()[0][3]
+
+    with tempfile.TemporaryDirectory() as home:
+        directory = os.path.join(home, "blocks")
+        cold, coldSeconds, coldRequests = cat(broker, handle, fileHandle, directory, home)
+        warm, warmSeconds, warmRequests = cat(broker, handle, fileHandle, directory, home)
+        cached = sum(len(files) for _, _, files in os.walk(directory))
+    broker.stop()
+
+    print("cold: {:.2f} s, {} requests".format(coldSeconds, coldRequests))
+    print("warm: {:.2f} s, {} requests, {} blocks in the cache".format(warmSeconds, warmRequests, cached))
+    failures = []
+    if cold != content or warm != content:
+        failures.append("cat returned different content")
+    if cached == 0:
+        failures.append("--block-cache didn't store any block")
+    if warmRequests >= coldRequests:
+        failures.append("the second run didn't use the cached blocks")
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+'''
+    Starts several LocalBrokers with different latencies on their own ports, sharing one BrokerState,
+    and reads folder metadata through all of them: first with every broker up, then with the fastest
+    one returning 500s and finally with it stopped. Prints the requests and latency per broker.
+
+    usage: python benchmarks/BrokerFailoverBenchmark.py [--latencies 0.01 0.03 0.1] [--requests 200]
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Opactiy
+from LocalBroker import LocalBroker, BrokerState, randomHandle
+
+
+def run(account, count):
+    failed = 0
+    start = time.time()
+    for _ in range(count):
+        try:
+            account.getFolderData("/")
+        except Exception:
+            failed += 1
+    return time.time() - start, failed
+
+
+def printStats(title, account, seconds, failed):
+    print("\n{} ({:.2f} s, {} failed)".format(title, seconds, failed))
+    print("{:>32} {:>8} {:>10} {:>9}".format("broker", "healthy", "latency ms", "requests"))
+    for stats in account.brokers.stats():
+        latency = stats["latency"] * 1000 if stats["latency"] is not None else float("nan")
+        print("{:>32} {:>8} {:>10.1f} {:>9}".format(stats["url"], str(stats["healthy"]), latency, stats["requests"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="broker selection and failover benchmark")
+    parser.add_argument("--latencies", type=float, nargs="+", default=[0.01, 0.03, 0.1],
+                        help="seconds added to every request, one broker per value")
+    parser.add_argument("--requests", type=int, default=200, help="metadata reads per phase")
+    args = parser.parse_args()
+
+    state = BrokerState()
+    brokers = [LocalBroker(latency=latency, state=state).start() for latency in args.latencies]
+    account = Opactiy.Opacity(randomHandle(), fetchStatus=False, useCache=False,
+                              brokers=[broker.baseUrl for broker in brokers])
+    account.brokers.probe()
+    account.createMetadata("/")
+
+    seconds, failed = run(account, args.requests)
+    printStats("all brokers up", account, seconds, failed)
+
+    fastest = min(brokers, key=lambda broker: broker.latency)
+    fastest.failNext = args.requests
+    seconds, failed = run(account, args.requests)
+    printStats("fastest broker answers 500", account, seconds, failed)
+
+    fastest.failNext = 0
+    fastest.stop()
+    seconds, failed = run(account, args.requests)
+    printStats("fastest broker stopped", account, seconds, failed)
+
+    account.brokers.stopProbing()
+    for broker in brokers:
+        if broker is not fastest:
+            broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+'''
+    Compares decoding/encoding speed and memory of the folder metadata representations
+    for folders with a lot of files:
+        legacy  - the former object graph (FolderMetaFile/FolderMetaFileVersion with a __dict__)
+        objects - FolderMetaData.ToObject with the __slots__ classes
+        compact - FolderMetaData.ToCompact (CompactFileList)
+
+    usage: python benchmarks/FolderMetaDataBenchmark.py [--files 100000]
+'''
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FolderMetaData import FolderMetaData
+
+
+class LegacyVersion:
+    def __init__(self, size=None, handle=None, modified=None, created=None):
+        self.size = size
+        self.handle = handle
+        self.modified = modified
+        self.created = created
+
+
+class LegacyFile:
+    def __init__(self):
+        self.name = None
+        self.tags = []
+        self.versions = []
+
+
+class LegacyFolder:
+    def __init__(self, name=None, handle=None):
+        self.name = name
+        self.handle = handle
+
+
+class LegacyFolderMetaData:
+    def __init__(self):
+        self.name = None
+        self.created = None
+        self.modified = None
+        self.files = []
+        self.folders = []
+
+    def toString(self):
+        files = []
+        for file in self.files:
+            versions = [[version.handle, version.size, version.created, version.modified] for version in file.versions]
+            files.append([file.name, file.created, file.modified, versions])
+        folders = [[folder.name, folder.handle] for folder in self.folders]
+        return json.dumps([self.name, files, folders, self.created, self.modified], separators=(',', ':'))
+
+    @staticmethod
+    def ToObject(data):
+        folderMetaData = LegacyFolderMetaData()
+        folderMetaData.name = str(data[0])
+        folderMetaData.created = int(data[3])
+        folderMetaData.modified = int(data[4])
+        for file in data[1]:
+            legacyFile = LegacyFile()
+            legacyFile.name = str(file[0])
+            legacyFile.created = int(file[1])
+            legacyFile.modified = int(file[2])
+            for version in file[3]:
+                legacyVersion = LegacyVersion()
+                legacyVersion.handle = str(version[0])
+                legacyVersion.size = int(version[1])
+                legacyVersion.created = int(version[2])
+                legacyVersion.modified = int(version[3])
+                legacyFile.versions.append(legacyVersion)
+            folderMetaData.files.append(legacyFile)
+        for folder in data[2]:
+            folderMetaData.folders.append(LegacyFolder(folder[0], folder[1]))
+        return folderMetaData
+
+
+def generate(fileCount):
+    random.seed(1)
+    now = 1590000000000
+    files = []
+    for index in range(fileCount):
+        created = now + index
+        versions = [["{:0128x}".format(random.getrandbits(512)), random.randint(1, 10 ** 10), created, created]]
+        if index % 1000 == 0:
+            versions.append(["{:0128x}".format(random.getrandbits(512)), 1, created, created])
+        files.append(["file-{}.bin".format(index), created, created, versions])
+    folders = [["folder-{}".format(index), "{:064x}".format(random.getrandbits(256))] for index in range(100)]
+    return json.dumps(["bench", files, folders, now, now], separators=(',', ':'))
+
+
+def measure(name, decode, string):
+    data = json.loads(string)
+    gc.collect()
+    start = time.perf_counter()
+    decoded = decode(data)
+    decodeTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encoded = decoded.toString()
+    encodeTime = time.perf_counter() - start
+    del decoded
+
+    gc.collect()
+    tracemalloc.start()
+    # kept alive until the memory is measured, afterwards it has to encode to the same string as well
+    decoded = decode(json.loads(string))
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    identical = encoded == string and decoded.toString() == string
+
+    print("{:8} decode {:7.3f} s  encode {:7.3f} s  retained {:8.1f} MB  identical: {}".format(
+        name, decodeTime, encodeTime, retained / 1024 / 1024, identical))
+    return identical
+
+
+def main():
+    parser = argparse.ArgumentParser(description="folder metadata codec benchmark")
+    parser.add_argument("--files", type=int, default=100000)
+    args = parser.parse_args()
+
+    string = generate(args.files)
+    start = time.perf_counter()
+    json.loads(string)
+    print("{} files, {:.1f} MB of metadata json, json.loads takes {:.3f} s (not included below)".format(
+        args.files, len(string) / 1024 / 1024, time.perf_counter() - start))
+
+    identical = measure("legacy", LegacyFolderMetaData.ToObject, string)
+    identical &= measure("objects", FolderMetaData.ToObject, string)
+    identical &= measure("compact", FolderMetaData.ToCompact, string)
+
+    sys.exit(0 if identical else 1)
+
+
+if __name__ == "__main__":
+    main()
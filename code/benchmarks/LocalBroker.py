@@ -0,0 +1,253 @@
+'''
+    In-memory stand-in for the opacity broker and storage node, for benchmarks on the local machine.
+    Signatures aren't checked. Latency and bandwidth of every request can be simulated.
+
+    usage: python benchmarks/LocalBroker.py [--port 3000] [--latency 0.05] [--bandwidth 20e6]
+    then point the client at it: account._baseUrl = "http://127.0.0.1:3000/api/v1/"
+    several brokers on different ports can share one BrokerState, see BrokerFailoverBenchmark
+'''
+import argparse
+import json
+import os
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class BrokerState:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metadata = dict()  # metadataKey -> base64 string
+        self.uploads = dict()  # fileHandle -> {"endIndex", "metadata", "parts": {index: bytes}}
+        self.files = dict()  # fileHandle -> {"metadata": bytes, "data": bytes}
+        self.requests = 0
+
+
+class LocalBroker:
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, bandwidth=None, state=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.state = state or BrokerState()
+        self.failNext = 0  # the next n requests get answered with a 500
+        self.connections = set()  # open keep-alive connections
+        self.server = ThreadingHTTPServer((host, port), BrokerRequestHandler)
+        self.server.daemon_threads = True
+        self.server.broker = self
+        self.thread = None
+
+    @property
+    def baseUrl(self):
+        return "http://{}:{}/api/v1/".format(*self.server.server_address[:2])
+
+    @property
+    def rootUrl(self):
+        return "http://{}:{}/".format(*self.server.server_address[:2])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        '''
+            stops listening and drops the open keep-alive connections, like a broker going down
+        '''
+        self.server.shutdown()
+        self.server.server_close()
+        with self.state.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def simulate(self, size):
+        delay = self.latency
+        if self.bandwidth:
+            delay += size / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+
+class BrokerRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.broker.state.lock:
+            self.server.broker.connections.add(self.connection)
+
+    def finish(self):
+        with self.server.broker.state.lock:
+            self.server.broker.connections.discard(self.connection)
+        super().finish()
+
+    def send(self, status, body, contentType="application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.server.broker.simulate(len(body))
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def readBody(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        self.server.broker.simulate(len(body))
+        return body
+
+    def form(self, body):
+        boundary = b"--" + self.headers["Content-Type"].split("boundary=")[1].strip('"').encode()
+        fields = dict()
+        for part in body.split(boundary)[1:-1]:
+            headers, content = part[2:].split(b"\r\n\r\n", 1)
+            name = re.search(rb'name="([^"]*)"', headers).group(1).decode()
+            fields[name] = content[:-2]
+        return fields
+
+    def shouldFail(self):
+        broker = self.server.broker
+        with broker.state.lock:
+            broker.state.requests += 1
+            if broker.failNext > 0:
+                broker.failNext -= 1
+                return True
+        return False
+
+    def do_POST(self):
+        body = self.readBody()
+        if self.shouldFail():
+            return self.send(500, {"error": "simulated failure"})
+
+        endpoint = self.path.split("/api/v1/", 1)[-1]
+        state = self.server.broker.state
+
+        fields = None
+        if endpoint in ("init-upload", "upload"):
+            fields = self.form(body)
+            request = json.loads(fields["requestBody"].decode())
+        else:
+            payload = json.loads(body.decode() or "{}")
+            request = json.loads(payload["requestBody"]) if "requestBody" in payload else payload
+
+        with state.lock:
+            status, response = self.respond(state, endpoint, request, fields)
+        return self.send(status, response)
+
+    def respond(self, state, endpoint, request, fields):
+        if endpoint == "account-data":
+            return 200, {"paymentStatus": "paid", "account": {
+                "createdAt": "", "expirationDate": "", "monthsInSubscription": 12,
+                "storageLimit": 1000, "storageUsed": 0}}
+
+        if endpoint == "init-upload":
+            state.uploads[request["fileHandle"]] = {"endIndex": request["endIndex"],
+                                                    "metadata": fields["metadata"], "parts": dict()}
+            return 200, {}
+
+        if endpoint == "upload":
+            upload = state.uploads.get(request["fileHandle"])
+            if upload is None:
+                return 404, {"error": "upload not initialized"}
+            upload["parts"][request["partIndex"]] = fields["chunkData"]
+            return 200, {}
+
+        if endpoint == "upload-status":
+            upload = state.uploads.get(request["fileHandle"])
+            if upload is None:
+                return 404, {"error": "upload not initialized"}
+            missing = [index for index in range(1, upload["endIndex"] + 1) if index not in upload["parts"]]
+            if len(missing) > 0:
+                return 200, {"status": "chunks missing", "missingIndexes": missing, "endIndex": upload["endIndex"]}
+            data = b"".join(upload["parts"][index] for index in range(1, upload["endIndex"] + 1))
+            state.files[request["fileHandle"]] = {"metadata": upload["metadata"], "data": data}
+            return 200, {"status": "File is uploaded"}
+
+        if endpoint == "download":
+            if request["fileID"] not in state.files:
+                return 404, {"error": "file not found"}
+            return 200, {"fileDownloadUrl": self.server.broker.rootUrl + "files/" + request["fileID"]}
+
+        if endpoint == "delete":
+            state.files.pop(request["fileID"], None)
+            return 200, "{}"
+
+        if endpoint == "metadata/create":
+            if request["metadataKey"] in state.metadata:
+                return 403, {"error": "metadata already exists"}
+            state.metadata[request["metadataKey"]] = ""
+            return 200, {}
+
+        if endpoint == "metadata/set":
+            state.metadata[request["metadataKey"]] = request["metadata"]
+            return 200, {"metadataKey": request["metadataKey"], "metadata": request["metadata"]}
+
+        if endpoint == "metadata/get":
+            if not state.metadata.get(request["metadataKey"]):
+                return 404, {"error": "metadata not found"}
+            return 200, {"metadata": state.metadata[request["metadataKey"]]}
+
+        if endpoint == "metadata/delete":
+            state.metadata.pop(request["metadataKey"], None)
+            return 200, {"status": "metadata successfully deleted"}
+
+        return 404, {"error": "unknown endpoint"}
+
+    def do_GET(self):
+        if self.shouldFail():
+            return self.send(500, {"error": "simulated failure"})
+
+        match = re.match(r"^/files/([0-9a-f]+)/(metadata|file)$", self.path)
+        state = self.server.broker.state
+        with state.lock:
+            file = state.files.get(match.group(1)) if match else None
+        if file is None:
+            return self.send(404, {"error": "file not found"})
+
+        if match.group(2) == "metadata":
+            return self.send(200, file["metadata"], "application/octet-stream")
+
+        data = file["data"]
+        rangeHeader = self.headers.get("range")
+        if rangeHeader is None:
+            return self.send(200, data, "application/octet-stream")
+        byteFrom, byteTo = rangeHeader.split("=")[1].split("-")
+        byteFrom = int(byteFrom)
+        byteTo = min(int(byteTo) if byteTo else len(data) - 1, len(data) - 1)
+        return self.send(206, data[byteFrom:byteTo + 1], "application/octet-stream")
+
+
+def randomHandle():
+    return os.urandom(64).hex()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="local opacity broker stand-in")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--bandwidth", type=float, default=None, help="bytes per second of every request")
+    args = parser.parse_args()
+
+    broker = LocalBroker(port=args.port, latency=args.latency, bandwidth=args.bandwidth)
+    print("Local broker listening on {}".format(broker.baseUrl))
+    try:
+        broker.server.serve_forever()
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+'''
+    Stress test of many accounts working at the same time in one process against the LocalBroker.
+    Every account uploads a file from memory, creates a folder, lists its root folder and streams the
+    file back; the listing must only contain its own entries and the content must match.
+    All accounts share the sessions, workers and buffers of SharedResources.default().
+
+    usage: python benchmarks/MultiAccountBenchmark.py [--accounts 40] [--size 3e6] [--latency 0.01]
+'''
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Opactiy
+from LocalBroker import LocalBroker, randomHandle
+from SharedResources import SharedResources
+
+
+def runAccount(broker, index, size):
+    account = Opactiy.Opacity(randomHandle(), fetchStatus=False, useCache=False, brokers=[broker.baseUrl])
+    account.createMetadata("/")
+    content = os.urandom(size)
+    name = "account-{}.bin".format(index)
+    if not account.uploadData(content, name, "/"):
+        raise AssertionError("upload of {} failed".format(name))
+    account.createFolder("/folder-{}".format(index))
+
+    metadata = account.getFolderData("/")["metadata"]
+    files = metadata.fileSummaries()
+    if [summary[0] for summary in files] != [name]:
+        raise AssertionError("{} lists {}".format(name, [summary[0] for summary in files]))
+    if [folder.name for folder in metadata.folders] != ["folder-{}".format(index)]:
+        raise AssertionError("{} lists the folders {}".format(name, [folder.name for folder in metadata.folders]))
+
+    with account.open_stream(files[0][3]) as stream:
+        downloaded = b"".join(stream)
+    if downloaded != content:
+        raise AssertionError("{} came back with different content".format(name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="many accounts in one process")
+    parser.add_argument("--accounts", type=int, default=40)
+    parser.add_argument("--size", type=float, default=3e6, help="bytes uploaded per account")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds added to every request")
+    args = parser.parse_args()
+
+    broker = LocalBroker(latency=args.latency).start()
+    peakThreads = threading.active_count()
+    failures = []
+
+    def run(index):
+        try:
+            runAccount(broker, index, int(args.size))
+        except Exception as e:
+            failures.append("account {}: {}: {}".format(index, type(e).__name__, e))
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.accounts) as pool:
+        futures = [pool.submit(run, index) for index in range(args.accounts)]
+        while not all(future.done() for future in futures):
+            peakThreads = max(peakThreads, threading.active_count())
+            time.sleep(0.05)
+    seconds = time.time() - start
+    broker.stop()
+
+    for failure in failures:
+        print(failure)
+    resources = SharedResources.default()
+    print("{} accounts, {} failed, {:.2f} s, {} broker requests, at most {} threads ({} shared workers)".format(
+        args.accounts, len(failures), seconds, broker.state.requests, peakThreads, resources.workers))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
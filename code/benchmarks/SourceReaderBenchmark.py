@@ -0,0 +1,94 @@
+'''
+    Reads every part of a big local file the way the upload workers do and compares
+    Helper.GetPartial (open, seek and read per part), the SourceReader reading into a buffer
+    and the memory mapped SourceReader. Every block of a part is passed to zlib.crc32 as a
+    stand-in for the encryption, so all bytes are actually touched.
+    The file is written once, drop the page cache between runs to measure cold reads.
+
+    usage: python benchmarks/SourceReaderBenchmark.py [--size-gb 4] [--workers 8] [--path big.bin]
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Constants import Constants
+from Helper import Helper
+from SourceReader import SourceReader
+
+BLOCK_SIZE = Constants.DEFAULT_BLOCK_SIZE
+PART_SIZE = Constants.UPLOAD_PART_SIZE
+
+
+def createFile(path, size):
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as file:
+        written = 0
+        while written < size:
+            amount = min(len(block), size - written)
+            file.write(block[:amount])
+            written += amount
+
+
+def touch(part):
+    checksum = 0
+    for start in range(0, len(part), BLOCK_SIZE):
+        checksum = zlib.crc32(part[start:start + BLOCK_SIZE], checksum)
+    return checksum
+
+
+def run(path, size, workers, mode):
+    parts = (size + PART_SIZE - 1) // PART_SIZE
+    fileInfo = {"fullName": path, "size": size}
+    reader = SourceReader(path, size, useMmap=mode == "mmap") if mode != "read" else None
+
+    def readPart(index):
+        if reader is None:
+            return touch(Helper.GetPartial(fileInfo, PART_SIZE, index))
+        return touch(reader.part(index, PART_SIZE, bytearray(PART_SIZE)))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        checksums = list(pool.map(readPart, range(parts)))
+    seconds = time.perf_counter() - start
+    if reader is not None:
+        mapped = reader.mapped
+        reader.close()
+    else:
+        mapped = False
+    return seconds, checksums, mapped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="upload source reading benchmark")
+    parser.add_argument("--size-gb", type=float, default=4, help="size of the generated file")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--path", help="existing file to read instead of generating one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.path
+        if path is None:
+            path = os.path.join(directory, "source.bin")
+            print("Writing {:.1f} GB test file".format(args.size_gb))
+            createFile(path, int(args.size_gb * 1024 ** 3))
+        size = os.path.getsize(path)
+
+        print("{:>10} {:>10} {:>10} {:>8}".format("mode", "seconds", "GB/s", "mapped"))
+        reference = None
+        for mode in ("read", "readinto", "mmap"):
+            seconds, checksums, mapped = run(path, size, args.workers, mode)
+            if reference is None:
+                reference = checksums
+            elif checksums != reference:
+                raise AssertionError("{} returned different bytes".format(mode))
+            print("{:>10} {:>10.2f} {:>10.2f} {:>8}".format(mode, seconds, size / seconds / 1024 ** 3, str(mapped)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+'''
+    Measures the cold start of the cli with "python -X importtime".
+
+    usage: python benchmarks/StartupBenchmark.py [--runs 5] [--target-ms 150] [--module OpacityCLI]
+
+    Exits with 1 if the median import time is above the target or if one of the heavy
+    modules got imported at startup (they should only be loaded on first use).
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["web3", "bitcoinlib", "joblib", "requests", "cryptography", "Crypto", "kivy", "kivymd"]
+
+
+def measure(module):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+                            cwd=CODE_DIR, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError("Importing {} failed:\n{}".format(module, result.stderr))
+
+    cumulative = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        name = parts[2].strip()
+        imported.add(name.split(".")[0])
+        if name == module:
+            cumulative = int(parts[1])
+
+    return cumulative / 1000.0, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="cold start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target-ms", type=float, default=150.0)
+    parser.add_argument("--module", default="OpacityCLI")
+    args = parser.parse_args()
+
+    timings = []
+    heavy = set()
+    for _ in range(args.runs):
+        milliseconds, imported = measure(args.module)
+        timings.append(milliseconds)
+        heavy |= imported.intersection(HEAVY_MODULES)
+
+    median = statistics.median(timings)
+    print("import {}: median {:.1f} ms, min {:.1f} ms, max {:.1f} ms over {} runs (target {:.0f} ms)".format(
+        args.module, median, min(timings), max(timings), args.runs, args.target_ms))
+
+    failed = False
+    if heavy:
+        print("Heavy modules imported at startup: {}".format(", ".join(sorted(heavy))))
+        failed = True
+    if median > args.target_ms:
+        print("Cold start is above the target")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+'''
+    Compares the total upload time of 1 MB, 100 MB (and with --large 10 GB) files
+    for several fixed part sizes and the automatic PartSizePolicy against the LocalBroker.
+
+    usage: python benchmarks/UploadPartSizeBenchmark.py [--latency 0.05] [--bandwidth 25e6] [--large]
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Opactiy
+from Constants import Constants
+from LocalBroker import LocalBroker, randomHandle
+from TransferTuning import PartSizePolicy
+
+PART_SIZES = [16 * Constants.DEFAULT_BLOCK_SIZE, 40 * Constants.DEFAULT_BLOCK_SIZE,
+              80 * Constants.DEFAULT_BLOCK_SIZE, 160 * Constants.DEFAULT_BLOCK_SIZE, None]
+
+
+def createFile(directory, size):
+    path = os.path.join(directory, "upload-{}.bin".format(size))
+    with open(path, "wb") as file:
+        if size > 1024 * 1024 * 1024:
+            # sparse file, the content doesn't matter for the upload time
+            file.truncate(size)
+        else:
+            file.write(os.urandom(size))
+    return path
+
+
+def createAccount(broker):
+    account = Opactiy.Opacity(randomHandle(), fetchStatus=False, useCache=False)
+    account._baseUrl = broker.baseUrl
+    account.createMetadata("/")
+    return account
+
+
+def main():
+    parser = argparse.ArgumentParser(description="upload part size benchmark")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every request")
+    parser.add_argument("--bandwidth", type=float, default=25e6, help="bytes per second of every request")
+    parser.add_argument("--large", action="store_true", help="also upload a 10 GB file")
+    args = parser.parse_args()
+
+    broker = LocalBroker(latency=args.latency, bandwidth=args.bandwidth).start()
+    fileSizes = [1000 * 1000, 100 * 1000 * 1000] + ([10 * 1000 * 1000 * 1000] if args.large else [])
+
+    print("{:>14} {:>12} {:>10}".format("file size", "part size", "seconds"))
+    with tempfile.TemporaryDirectory() as directory:
+        for fileSize in fileSizes:
+            path = createFile(directory, fileSize)
+            for partSize in PART_SIZES:
+                account = createAccount(broker)
+                if partSize is not None:
+                    account.partSizePolicy = PartSizePolicy(fixedPartSize=partSize)
+                else:
+                    # let the policy observe the link first, like it would after the first uploads
+                    account.metrics.record("upload", Constants.UPLOAD_PART_SIZE,
+                                           args.latency + Constants.UPLOAD_PART_SIZE / args.bandwidth)
+
+                start = time.perf_counter()
+                account.uploadFile(path, "/")
+                seconds = time.perf_counter() - start
+
+                label = "{:.2f} MB".format(partSize / 1e6) if partSize else "auto"
+                print("{:>11.0f} MB {:>12} {:>10.2f}".format(fileSize / 1e6, label, seconds))
+            os.remove(path)
+
+    broker.stop()
+
+
+if __name__ == "__main__":
+    main()